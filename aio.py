@@ -0,0 +1,629 @@
+# aio.py
+"""
+下载 / 抽帧核心的 async 版本，给 FastAPI 的 async 路由用：
+- 直链用 httpx.AsyncClient 分段拉取，与 downloader 共用 .direct.part + sidecar 格式（两边可以互相续传）；
+- ffmpeg 用 asyncio 子进程；协程被取消（客户端断开 / 超过期限）时立即 kill，不留孤儿进程；
+- 并发由 asyncio.Semaphore 限制（ASYNC_DOWNLOAD_CONCURRENCY / ASYNC_EXTRACT_CONCURRENCY），不占线程池；
+- 只有 yt-dlp 回退、ffprobe、帧过滤/打包这类同步库调用经 asyncio.to_thread 执行。
+同一视频与同步路径（任务队列、边下边抽）之间靠 downloader.try_claim 互斥，不会同时写同一个 .part。
+"""
+from __future__ import annotations
+import asyncio
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+import weakref
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from config import (
+    FRAMES, UA, REFERER, DL_CONNECTIONS, DL_CHUNK, DL_TIMEOUT, DL_RETRIES, DL_META_EVERY,
+    DL_CLAIM_WAIT, ASYNC_DOWNLOAD_CONCURRENCY, ASYNC_EXTRACT_CONCURRENCY, API_DOWNLOAD_TIMEOUT,
+)
+import downloader
+import link_cache
+from downloader import (
+    _RemoteChanged, _browser_cookies, _if_range, _load_meta, _part_paths, _plan_segments,
+    _preallocate, _record, _same_remote, _save_meta,
+)
+from extractor import (
+    META_NAME, _cache_entry, _clamp_step, _dedup_note, _bytes_note, _evict, _finalize, _FrameFilter,
+    _frame_files, _frame_name, _read_meta, _FrameScan, _write_zip, adopt_work_dir, cmd_parallelism, frame_opts,
+    plan_cmds,
+)
+from frame_source import iter_frames, iter_npy
+from metrics import DOWNLOAD_RATE, cache_hit, cache_miss, observe, span
+from state_store import PAGE_TO_PATH
+from utils import find_existing_by_code, pick_platform_and_code, refresh_code, target_path_for
+from zipstream import ZipWriter
+
+class _Shared:
+    """同一视频的下载只跑一份；最后一个等待者离开（断开/超时）时才取消。"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _LoopState:
+    # 信号量与 httpx 客户端都绑定事件循环，按循环各建一份（正常运行只有 uvicorn 的一个）
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": UA, "Referer": REFERER}, timeout=DL_TIMEOUT, follow_redirects=True,
+            limits=httpx.Limits(max_connections=max(DL_CONNECTIONS * ASYNC_DOWNLOAD_CONCURRENCY, 10)),
+        )
+        self.downloads = asyncio.Semaphore(ASYNC_DOWNLOAD_CONCURRENCY)
+        self.extracts = asyncio.Semaphore(ASYNC_EXTRACT_CONCURRENCY)
+        self.inflight: Dict[str, _Shared] = {}
+
+_LOOPS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+def _state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    st = _LOOPS.get(loop)
+    if st is None:
+        st = _LOOPS[loop] = _LoopState()
+    return st
+
+async def aclose():
+    """应用关闭时调用：关掉当前事件循环上的 httpx 连接池。"""
+    st = _LOOPS.pop(asyncio.get_running_loop(), None)
+    if st is not None:
+        await st.client.aclose()
+
+def _cookie_header(url: str) -> dict:
+    # 浏览器 Cookie 按目标 URL 过滤后拼成请求头（httpx 已不建议逐请求传 cookies=）
+    jar = _browser_cookies()
+    if jar is None:
+        return {}
+    req = httpx.Request("GET", url)
+    httpx.Cookies(jar).set_cookie_header(req)
+    c = req.headers.get("Cookie")
+    return {"Cookie": c} if c else {}
+
+# ---------- 直链（httpx） ----------
+async def _probe(client: httpx.AsyncClient, url: str, hdrs: dict) -> Tuple[Optional[int], bool, Optional[str], Optional[str]]:
+    """同 downloader._probe：Range: bytes=0-0，返回 (总长, 是否支持 Range, ETag, Last-Modified)。"""
+    async with client.stream("GET", url, headers={**hdrs, "Range": "bytes=0-0"}) as r:
+        r.raise_for_status()
+        etag, lm = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        if r.status_code == 206:
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit():
+                return int(total), True, etag, lm
+        length = r.headers.get("Content-Length")
+        return (int(length) if length and length.isdigit() else None), False, etag, lm
+
+# 文件操作（预分配、写块、sidecar）都经 asyncio.to_thread：大文件预分配、慢盘写入不卡事件循环
+def _create_part(part: Path, size: int):
+    with open(part, "wb") as f:
+        _preallocate(f, size)
+
+def _open_at(part: Path, mode: str, pos: int = 0):
+    f = open(part, mode, buffering=0)
+    if pos:
+        f.seek(pos)
+    return f
+
+async def _fetch_segment(client: httpx.AsyncClient, url: str, hdrs: dict, part: Path, seg: dict,
+                         if_range: Optional[str], progress: Callable[[dict, int], Awaitable[None]]):
+    """拉一段到 part 的对应位置；断流时按已写入的字节数续传，最多重试 DL_RETRIES 次。取消即刻生效。"""
+    for attempt in range(DL_RETRIES + 1):
+        start = seg["start"] + seg["done"]
+        if start > seg["end"]:
+            return
+        headers = {**hdrs, "Range": f"bytes={start}-{seg['end']}"}
+        if if_range:
+            headers["If-Range"] = if_range
+        try:
+            async with client.stream("GET", url, headers=headers) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise _RemoteChanged(f"range {start}-{seg['end']} 返回 {r.status_code}")
+                f = await asyncio.to_thread(_open_at, part, "r+b", start)
+                try:
+                    async for chunk in r.aiter_bytes(DL_CHUNK):
+                        await asyncio.to_thread(f.write, chunk)
+                        await progress(seg, len(chunk))
+                finally:
+                    f.close()
+            if seg["start"] + seg["done"] > seg["end"]:
+                return
+            raise IOError(f"range {start}-{seg['end']} 提前结束")
+        except _RemoteChanged:
+            raise
+        except Exception:
+            if attempt >= DL_RETRIES:
+                raise
+            await asyncio.sleep(min(2 ** attempt, 8))
+
+async def _download_segments(client: httpx.AsyncClient, url: str, hdrs: dict, part: Path, meta: dict, meta_path: Path):
+    """DL_CONNECTIONS 个协程按顺序领取未完成的段；某段失败不打断其它段，进度照常落进 sidecar。"""
+    unsaved = [0]
+    saving = asyncio.Lock()  # sidecar 经同一个 .tmp 改名写入，同时只写一份
+
+    async def save():
+        snap = {**meta, "segments": [dict(g) for g in meta["segments"]]}  # 线程里序列化期间进度还在变
+        async with saving:
+            await asyncio.to_thread(_save_meta, meta_path, snap)
+
+    async def progress(seg: dict, n: int):
+        seg["done"] += n  # 都在事件循环线程里，不用加锁
+        unsaved[0] += n
+        if unsaved[0] >= DL_META_EVERY:
+            unsaved[0] = 0
+            await save()
+
+    todo = iter([g for g in meta["segments"] if g["start"] + g["done"] <= g["end"]])
+    if_range = _if_range(meta.get("etag"), meta.get("last_modified"))
+    errors: List[Exception] = []
+
+    async def worker():
+        for g in todo:
+            try:
+                await _fetch_segment(client, url, hdrs, part, g, if_range, progress)
+            except Exception as e:
+                errors.append(e)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(DL_CONNECTIONS)))
+    finally:
+        await save()
+    for e in errors:
+        if isinstance(e, _RemoteChanged):
+            raise e
+    if errors:
+        raise errors[0]
+
+async def _download_single(client: httpx.AsyncClient, url: str, hdrs: dict, part: Path):
+    async with client.stream("GET", url, headers=hdrs) as r:
+        r.raise_for_status()
+        expect = r.headers.get("Content-Length")
+        got = 0
+        f = await asyncio.to_thread(_open_at, part, "wb")
+        try:
+            async for chunk in r.aiter_bytes(DL_CHUNK):
+                await asyncio.to_thread(f.write, chunk)
+                got += len(chunk)
+        finally:
+            f.close()
+    if expect and expect.isdigit() and r.headers.get("Content-Encoding") in (None, "identity") and got != int(expect):
+        raise IOError(f"长度不符：收到 {got} / {expect} 字节")
+
+async def _try_direct(url: str, save_to: Path) -> Tuple[bool, Optional[Path], str]:
+    """downloader._try_direct 的 async 版：同样的 .part / sidecar / 原子改名，日志格式一致。"""
+    t_ck = time.perf_counter()
+    hdrs = await asyncio.to_thread(_cookie_header, url)  # 首次要读浏览器 Cookie 库，可能较慢
+    ck_ms = (time.perf_counter() - t_ck) * 1000
+    client = _state().client
+    save_to.parent.mkdir(parents=True, exist_ok=True)
+    part, meta_path = _part_paths(save_to)
+    try:
+        t0 = time.perf_counter()
+        size, ranged, etag, lm = await _probe(client, url, hdrs)
+        resumed = 0
+        if ranged and size:
+            meta = await asyncio.to_thread(_load_meta, meta_path)
+            if meta and part.exists() and part.stat().st_size == size and _same_remote(meta, size, etag, lm):
+                resumed = sum(g["done"] for g in meta["segments"])
+            else:
+                meta = {"size": size, "etag": etag, "last_modified": lm, "segments": _plan_segments(size)}
+                await asyncio.to_thread(_create_part, part, size)
+                await asyncio.to_thread(_save_meta, meta_path, meta)
+            try:
+                await _download_segments(client, url, hdrs, part, meta, meta_path)
+            except _RemoteChanged:
+                part.unlink(missing_ok=True)
+                meta_path.unlink(missing_ok=True)
+                raise
+            if any(g["start"] + g["done"] <= g["end"] for g in meta["segments"]) or part.stat().st_size != size:
+                raise IOError("分段未全部完成")
+            mode = f"async, {min(DL_CONNECTIONS, len(meta['segments']))} conn"
+        else:
+            await _download_single(client, url, hdrs, part)
+            mode = "async, single"
+        os.replace(part, save_to)
+        meta_path.unlink(missing_ok=True)
+        dt = time.perf_counter() - t0
+        got = save_to.stat().st_size - resumed
+        _record("direct", "ok", dt, got)
+        DOWNLOAD_RATE.observe(got / max(dt, 1e-6))
+        extra = f", resumed {resumed / 1048576:.1f} MiB" if resumed else ""
+        return True, save_to, (f"direct ok ({mode}{extra}, {got / 1048576:.1f} MiB, "
+                               f"{got / 1048576 / max(dt, 1e-6):.1f} MiB/s, cookies {ck_ms:.1f} ms)")
+    except asyncio.CancelledError:
+        _record("direct", "cancelled", time.perf_counter() - t_ck)
+        raise
+    except Exception as e:
+        _record("direct", "failed", time.perf_counter() - t_ck)
+        return False, None, f"direct failed: {e}"
+
+async def _ytdlp(page_url: str, base_noext: Path) -> Tuple[bool, Optional[Path], str]:
+    # yt-dlp 没有 async 接口，放线程里跑；被取消时通过进度回调让它停下，等它放手再返回
+    cancel = threading.Event()
+    fut = asyncio.ensure_future(asyncio.to_thread(downloader._fallback_ytdlp, page_url, base_noext, None, cancel))
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        cancel.set()
+        await asyncio.wait([fut])
+        raise
+
+async def _remember(page_url: Optional[str], path: str):
+    # 写 PAGE_TO_PATH 会登记文件并算整段视频的 sha1（见 StateStore.record_file），不能卡住事件循环
+    if page_url:
+        await asyncio.to_thread(PAGE_TO_PATH.__setitem__, page_url, path)
+
+async def _download(pf: str, code: str, direct_url: Optional[str], page_url: Optional[str]) -> Tuple[bool, Optional[str], str]:
+    key = f"{pf}:{code}"
+    loop = asyncio.get_running_loop()
+    give_up = loop.time() + min(DL_CLAIM_WAIT, API_DOWNLOAD_TIMEOUT)
+    while not downloader.try_claim(key):  # 同步路径正在下同一个视频：在信号量外面等，不占下载名额
+        if loop.time() > give_up:
+            return False, None, "busy"
+        await asyncio.sleep(0.2)
+    try:
+        async with _state().downloads:
+            existing = find_existing_by_code(pf, code)
+            if existing:
+                await _remember(page_url, str(existing))
+                return True, str(existing), "already exists"
+            from_cache = False
+            if not direct_url and page_url:
+                direct_url = await asyncio.to_thread(link_cache.lookup, page_url)
+                from_cache = bool(direct_url)
+            if direct_url:
+                ok, path, log = await _try_direct(direct_url, target_path_for(pf, code, "mp4"))
+                if ok and path:
+                    await asyncio.to_thread(refresh_code, pf, code)
+                    await _remember(page_url, str(path))
+                    return True, str(path), log + (" (cached link)" if from_cache else "")
+                if from_cache:
+                    await asyncio.to_thread(link_cache.forget, page_url)  # 缓存的直链已不可用
+            if page_url:
+                ok2, path2, log2 = await _ytdlp(page_url, target_path_for(pf, code))
+                if ok2 and path2:
+                    await _remember(page_url, str(path2))
+                    return True, str(path2), log2
+            return False, None, "download failed"
+    finally:
+        downloader.release(key)
+
+async def download_video_async(direct_url: Optional[str], page_url: Optional[str]) -> Tuple[bool, Optional[str], str]:
+    """
+    同 downloader.download_video：直链优先（未传时查直链缓存）-> 回退 yt-dlp，返回 (ok, path, log)。
+    多个请求要同一个视频时共用一次下载；调用方被取消（断开 / 超时）只是不再等，
+    所有等待者都走了才真正取消下载（已下的部分留在 .part 里，下次续传）。
+    """
+    # 短链要联网换成数字 ID（见 short_links.py），放线程里
+    pf, code, msg = await asyncio.to_thread(pick_platform_and_code, page_url, direct_url, True)
+    if pf != "douyin" or not code:
+        return False, None, f"不支持的平台或无法提取编码：{msg}"
+    existing = find_existing_by_code(pf, code)
+    if existing:
+        cache_hit("video")
+        await _remember(page_url, str(existing))
+        return True, str(existing), "already exists"
+    cache_miss("video")
+
+    st = _state()
+    key = f"{pf}:{code}"
+    sh = st.inflight.get(key)
+    if sh is None:
+        sh = st.inflight[key] = _Shared(asyncio.ensure_future(_download(pf, code, direct_url, page_url)))
+        sh.task.add_done_callback(lambda _t, s=sh: st.inflight.pop(key, None) if st.inflight.get(key) is s else None)
+    sh.waiters += 1
+    try:
+        with span("download.total"):
+            return await asyncio.shield(sh.task)
+    finally:
+        sh.waiters -= 1
+        if sh.waiters == 0 and not sh.task.done():
+            sh.task.cancel()
+            if st.inflight.get(key) is sh:
+                del st.inflight[key]
+
+# ---------- 抽帧（asyncio 子进程） ----------
+async def _run(cmd: List[str], log_path: Path) -> int:
+    with open(log_path, "ab") as log_f:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.DEVNULL, stderr=log_f)
+    try:
+        return await proc.wait()
+    finally:
+        if proc.returncode is None:  # 被取消：杀掉并回收，不留僵尸
+            proc.kill()
+            await proc.wait()
+
+def _tail(log_path: Path) -> str:
+    try:
+        return log_path.read_text(encoding="utf-8", errors="replace")[-1000:]
+    except OSError:
+        return ""
+
+async def _extract(vp: Path, work: Path, step: int, opts: dict, shards: Optional[int],
+                   strategy: str) -> Tuple[str, int, Optional[dict]]:
+    """_Runner 的 async 版：跑完全部 ffmpeg，返回 (策略, 分片数, probe 信息)；失败抛 RuntimeError。"""
+    strategy, n_shards, info, cmds = await asyncio.to_thread(plan_cmds, vp, work, step, opts, shards, strategy)
+    log_path = work / ".ffmpeg.log"
+    lim = asyncio.Semaphore(cmd_parallelism(strategy, cmds))
+
+    async def one(cmd: List[str]) -> int:
+        async with lim:
+            return await _run(cmd, log_path)
+
+    t0 = time.perf_counter()
+    rcs = await asyncio.gather(*(one(c) for c in cmds))  # 外层被取消时 gather 会取消（并杀掉）全部
+    ok = all(rc == 0 for rc in rcs)
+    observe(f"extract.ffmpeg.{strategy}", time.perf_counter() - t0, ok)
+    if not ok:
+        raise RuntimeError(_tail(log_path) or "ffmpeg 执行失败")
+    return strategy, n_shards, info
+
+async def extract_frames_async(video_path: str, step_sec: int, shards: Optional[int] = None,
+                               strategy: str = "auto", keyframes: bool = False, fmt: str = "jpg",
+                               max_width: int = 0, max_height: int = 0, quality: Optional[int] = None,
+                               scene: float = 0.0, dedup: Optional[int] = None) -> Tuple[bool, str, str]:
+    """同 extractor.extract_frames（参数、缓存、返回值一致），被取消时 ffmpeg 随之被杀、临时目录清掉。"""
+    step = _clamp_step(step_sec)
+    vp = Path(video_path)
+    if not vp.exists():
+        return False, "", f"视频不存在: {video_path}"
+    try:
+        opts = frame_opts(fmt, (max_width, max_height), keyframes, quality, scene, dedup)
+    except ValueError as e:
+        return False, "", str(e)
+    key, out_dir, zip_path = _cache_entry(vp, step, opts)
+    meta = _read_meta(out_dir)
+    if meta is not None:
+        cache_hit("frames")
+        os.utime(out_dir / META_NAME)
+        if not zip_path.exists():
+            await asyncio.to_thread(_write_zip, out_dir, zip_path)
+        return True, str(zip_path), (f"抽帧完成（缓存命中）：间隔 {step}s，{meta.get('frames', '?')} 帧"
+                                     f"{_dedup_note(meta)}{_bytes_note(meta)}")
+    cache_miss("frames")
+    async with _state().extracts:
+        work = FRAMES / f".work-{key}-{uuid.uuid4().hex[:6]}"
+        work.mkdir(parents=True, exist_ok=True)
+        try:
+            with span("extract.total"):
+                t0 = time.perf_counter()
+                try:
+                    chosen, n_shards, info = await _extract(vp, work, step, opts, shards, strategy)
+                except RuntimeError as e:
+                    return False, "", str(e)
+                zip_path_s, log = await asyncio.to_thread(adopt_work_dir, work, str(vp), step, opts, t0,
+                                                          chosen, n_shards, info)
+            return True, zip_path_s, log
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+async def _aiter_zip(files: List[Tuple[str, Path]]) -> AsyncIterator[bytes]:
+    zw = ZipWriter()
+    for name, p in files:
+        for chunk in zw.add(name, p):
+            yield chunk
+    tail = zw.close()
+    if tail:
+        yield tail
+
+class _StreamBody:
+    """
+    响应字节流 + 收尾。响应结束后调用方必须 aclose()：生成器跑过时由它的 finally 收尾；
+    响应头还没发出客户端就断开时生成器从未启动、finally 不会执行，这里补上，
+    否则抽帧信号量的名额、ffmpeg 与临时目录都会遗留。
+    """
+
+    def __init__(self, gen: AsyncIterator[bytes], cleanup: Callable[[], Awaitable[None]]):
+        self._gen = gen
+        self._cleanup = cleanup
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._gen
+
+    async def aclose(self):
+        await self._gen.aclose()
+        await self._cleanup()
+
+async def stream_frames_zip_async(video_path: str, step_sec: int, shards: Optional[int] = None,
+                                  strategy: str = "auto", keyframes: bool = False, fmt: str = "jpg",
+                                  max_width: int = 0, max_height: int = 0, quality: Optional[int] = None,
+                                  scene: float = 0.0, dedup: Optional[int] = None,
+                                  deadline: Optional[float] = None) -> Tuple[bool, Optional[AsyncIterator[bytes]], str]:
+    """
+    extractor.stream_frames_zip 的 async 版：返回 (ok, zip 字节流异步迭代器, 文件名或错误信息)。
+    迭代器带 aclose()，调用方发完（或放弃发送）后必须调用，见 _StreamBody。
+    deadline：事件循环时间（loop.time()）上的截止点，超过后停掉 ffmpeg 并中断 zip 流；
+    调用方不再读取（客户端断开）时迭代器被取消，同样杀掉 ffmpeg、清理临时目录，且不写入缓存。
+    第一帧出来之前就失败时 ok=False，调用方还能回 JSON 错误。
+    """
+    step = _clamp_step(step_sec)
+    vp = Path(video_path)
+    if not vp.exists():
+        return False, None, f"视频不存在: {video_path}"
+    try:
+        opts = frame_opts(fmt, (max_width, max_height), keyframes, quality, scene, dedup)
+    except ValueError as e:
+        return False, None, str(e)
+    key, out_dir, zip_path = _cache_entry(vp, step, opts)
+    name = zip_path.name
+    if _read_meta(out_dir) is not None:
+        cache_hit("frames")
+        os.utime(out_dir / META_NAME)
+        return True, _aiter_zip([(p.name, p) for p in _frame_files(out_dir)]), name
+    cache_miss("frames")
+
+    loop = asyncio.get_running_loop()
+
+    def check_deadline():
+        if deadline is not None and loop.time() > deadline:
+            raise asyncio.TimeoutError("抽帧超时")
+
+    sem = _state().extracts
+    await sem.acquire()
+    work = FRAMES / f".work-{key}-{uuid.uuid4().hex[:6]}"
+    work.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    task = asyncio.ensure_future(_extract(vp, work, step, opts, shards, strategy))
+
+    async def _cleanup():
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        shutil.rmtree(work, ignore_errors=True)
+        sem.release()
+
+    done: List[asyncio.Future] = []
+
+    def cleanup():
+        # 在独立任务里收尾：StreamingResponse 的取消作用域会反复取消当前任务里的每个 await，
+        # 直接 await 的话等不到 ffmpeg 退出、临时目录也删不掉；只收尾一次，信号量不会多放
+        if not done:
+            done.append(asyncio.ensure_future(_cleanup()))
+        return asyncio.shield(done[0])
+
+    first = work / _frame_name(1, opts)  # 场景/去重模式下首帧也总是保留
+    try:
+        while not task.done() and not first.exists():
+            check_deadline()
+            await asyncio.sleep(0.05)
+        if not first.exists() and task.done() and task.exception() is not None:
+            err = str(task.exception())
+            await cleanup()
+            return False, None, err or "ffmpeg 执行失败"
+    except BaseException:  # 超时 / 等首帧期间被取消
+        await cleanup()
+        raise
+
+    flt = _FrameFilter(opts, step)
+
+    async def produced() -> AsyncIterator[Path]:
+        if opts.get("scene"):
+            scan = _FrameScan(work, opts)
+            while True:
+                running = not task.done()
+                new = scan.poll(force=not running)  # ffmpeg 已退出时最后完整扫一遍
+                for p in new:
+                    yield p
+                if not new:
+                    if not running:
+                        break
+                    check_deadline()
+                    await asyncio.sleep(0.05)
+            return
+        n = 1
+        while True:
+            running = not task.done()
+            p = work / _frame_name(n, opts)
+            if p.exists():
+                yield p
+                n += 1
+            elif running:
+                check_deadline()
+                await asyncio.sleep(0.05)
+            else:
+                # 分片少出帧时缺号之后的帧也要发，见 extractor.stream_frames_zip
+                for p in _FrameScan(work, opts, after=n - 1).poll(force=True):
+                    yield p
+                break
+
+    async def body() -> AsyncIterator[bytes]:
+        ok = False
+        kept = 0
+        zw = ZipWriter()
+        try:
+            async for p in produced():
+                # 感知哈希要解码图片，放线程里算
+                if flt.deduper is not None and not await asyncio.to_thread(flt.keep, p):
+                    continue
+                kept += 1
+                for chunk in zw.add(p.name, p):
+                    yield chunk
+            tail = zw.close()
+            if tail:
+                yield tail
+            chosen, n_shards, info = await task  # ffmpeg 失败时在这里抛出，zip 流不完整
+            await asyncio.to_thread(_finalize_and_evict, work, out_dir, vp, step, opts, t0, n_shards, chosen,
+                                    flt.stats(kept, info))
+            ok = True
+        finally:
+            observe("extract.stream", time.perf_counter() - t0, ok)
+            await cleanup()
+
+    return True, _StreamBody(body(), cleanup), name
+
+def _finalize_and_evict(work: Path, out_dir: Path, vp: Path, step: int, opts: dict, t0: float,
+                        shards: int, strategy: str, dedup: Optional[dict]):
+    _finalize(work, out_dir, vp, step, opts, t0, shards, strategy, dedup)
+    _evict(out_dir)
+
+
+# ---------- 原始帧流（.npy） ----------
+async def stream_npy_async(video_path: str, step_sec: int, max_width: int = 0, max_height: int = 0,
+                           pix_fmt: str = "rgb24", batch: int = 16,
+                           deadline: Optional[float] = None) -> Tuple[bool, Optional[AsyncIterator[bytes]], str]:
+    """
+    frame_source.iter_frames + iter_npy 的 async 版：读 ffmpeg 管道的阻塞调用放线程里，不占事件循环。
+    返回 (ok, .npy 字节流异步迭代器, 错误信息)，迭代器用法同 stream_frames_zip_async（带 aclose()）；
+    第一批出来之前就失败（打不开 / 解码失败 / 没有帧）时 ok=False。超过 deadline 或被取消时 ffmpeg 被结束。
+    """
+    frames = iter_frames(video_path, step_sec, max_width, max_height, pix_fmt, batch)
+    chunks = iter_npy(frames)
+    pending: List[asyncio.Future] = []
+
+    async def pull() -> Optional[bytes]:
+        # 线程里的 next() 被取消也会跑完；收尾前要等它，否则生成器还在执行、关不掉
+        fut = asyncio.ensure_future(asyncio.to_thread(next, chunks, None))
+        pending[:] = [fut]
+        return await asyncio.shield(fut)
+
+    def close_gens():
+        chunks.close()
+        frames.close()  # 生成器的 finally 里结束 ffmpeg
+
+    async def _cleanup():
+        await asyncio.gather(*pending, return_exceptions=True)
+        await asyncio.to_thread(close_gens)
+
+    done: List[asyncio.Future] = []
+
+    def cleanup():
+        # 同 stream_frames_zip_async：独立任务里只收尾一次
+        if not done:
+            done.append(asyncio.ensure_future(_cleanup()))
+        return asyncio.shield(done[0])
+
+    try:
+        first = await pull()
+    except (OSError, ValueError, RuntimeError) as e:
+        await cleanup()
+        return False, None, str(e)
+    except BaseException:
+        await cleanup()
+        raise
+    if first is None:
+        await cleanup()
+        return False, None, "没有解出任何帧"
+    loop = asyncio.get_running_loop()
+
+    async def body() -> AsyncIterator[bytes]:
+        ok = False
+        t0 = time.perf_counter()
+        try:
+            chunk: Optional[bytes] = first
+            while chunk is not None:
+                yield chunk
+                if deadline is not None and loop.time() > deadline:
+                    raise asyncio.TimeoutError("抽帧超时")
+                chunk = await pull()
+            ok = True
+        finally:
+            observe("frames.npy", time.perf_counter() - t0, ok)
+            await cleanup()
+
+    return True, _StreamBody(body(), cleanup), ""
@@ -1,36 +1,67 @@
 # app_gradio.py
 from __future__ import annotations
-from pathlib import Path
+import asyncio
+import json
+import threading
 from urllib.parse import quote
 
 import gradio as gr
 from gradio import mount_gradio_app
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Query, Body, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 # 你现有的依赖
-from parser import sniff_serial
+import aio
+from batch import STAGES, run_batch
+from parser import sniff_serial, get_pool, tier_stats
 from downloader import download_video
-from extractor import extract_frames
-from state_store import PAGE_TO_PATH
+from extractor import extract_frames, extract_multi
+from frame_source import PIX_FMTS
+from pipeline import download_and_extract
+from jobs import JOBS, QueueFull
+from metrics import collect, render as render_metrics, span
+from state_store import PAGE_TO_PATH, resolve_page, start_reconcile
+import link_cache
 from utils import detect_platform, extract_code, find_existing_by_code
-from config import STEP_MIN, STEP_MAX
+from config import (
+    STEP_MIN, STEP_MAX, SNIFF_CONCURRENCY, SNIFF_FAST, BATCH_MAX_URLS, API_DOWNLOAD_TIMEOUT, API_EXTRACT_TIMEOUT,
+    LINK_PAGE_SIZE, LINK_REFRESH_SEC,
+)
 
 # 新增：两个 Tab 的模块
 from tabs.link_tab import build_link_tab
 from tabs.local_tab import build_local_tab
 
+def extract_query(step: int, fmt: str = "jpg", max_w=0, max_h=0, quality=0) -> str:
+    """两个 Tab 里“抽帧 / 下载zip”链接的查询串，与 /api/extract_by_page 的参数一一对应；默认值不写，保持链接简短。"""
+    qs = f"step={step}"
+    if fmt and fmt != "jpg":
+        qs += f"&fmt={fmt}"
+    for k, v in (("max_width", max_w), ("max_height", max_h), ("quality", quality)):
+        if int(v or 0) > 0:
+            qs += f"&{k}={int(v)}"
+    return qs
+
 # 共享上下文，传给各 Tab，避免循环依赖
 CTX = dict(
     STEP_MIN=STEP_MIN,
     STEP_MAX=STEP_MAX,
     PAGE_TO_PATH=PAGE_TO_PATH,
     sniff_serial=sniff_serial,
+    sniff_pool=get_pool(),
+    SNIFF_CONCURRENCY=SNIFF_CONCURRENCY,
+    SNIFF_FAST=SNIFF_FAST,
+    LINK_PAGE_SIZE=LINK_PAGE_SIZE,
+    LINK_REFRESH_SEC=LINK_REFRESH_SEC,
     download_video=download_video,
+    JOBS=JOBS,
     extract_frames=extract_frames,
+    extract_query=extract_query,
     detect_platform=detect_platform,
     extract_code=extract_code,
     find_existing_by_code=find_existing_by_code,
+    lookup_direct=link_cache.lookup,
+    remember_direct=link_cache.remember,
 )
 
 with gr.Blocks(title="抖音直链解析 + 固定目录下载 + 抽帧") as demo:
@@ -45,20 +76,308 @@ with gr.Blocks(title="抖音直链解析 + 固定目录下载 + 抽帧") as demo
 # ---------- FastAPI 路由（保持原有逻辑） ----------
 app = FastAPI()
 
+def _reply(payload: dict, timing: dict | None = None) -> JSONResponse:
+    """timing 不为空时附上本次请求各阶段耗时（毫秒），即 metrics.collect() 收集到的 span。"""
+    if timing is not None:
+        payload["timing_ms"] = {k: round(v * 1000, 1) for k, v in timing.items()}
+    return JSONResponse(payload)
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """发送结束、出错或客户端在响应头发出前就断开，都会 aclose() body（见 aio._StreamBody）。"""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+async def _until_disconnect(request: Request, coro, timeout: float):
+    """
+    跑 coro，最多 timeout 秒（超时抛 asyncio.TimeoutError）；客户端先断开就取消它并返回 None。
+    取消会一路传到 aio 里：下载停下（.part 留着续传），ffmpeg 被杀。
+    """
+    task = asyncio.ensure_future(coro)
+    gone = False
+
+    async def watch():
+        nonlocal gone
+        while not await request.is_disconnected():
+            await asyncio.sleep(0.5)
+        gone = True
+        task.cancel()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await asyncio.wait_for(task, timeout)
+    except asyncio.CancelledError:
+        if gone:
+            return None
+        raise
+    finally:
+        watcher.cancel()
+
+async def _in_thread(fn, *args, **kw):
+    """
+    同步的重活（带 cancel 参数）放线程里跑；协程被取消（断开 / 超时）时置位 cancel，
+    等线程里的下载 / ffmpeg 停下再返回，不在线程池里留下没人要的活。
+    """
+    cancel = threading.Event()
+    fut = asyncio.ensure_future(asyncio.to_thread(fn, *args, cancel=cancel, **kw))
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        cancel.set()
+        await asyncio.wait([fut])
+        raise
+
+@app.get("/metrics")
+def api_metrics():
+    body, ctype = render_metrics()
+    return Response(body, media_type=ctype)
+
 @app.get("/api/download")
-def api_download(direct_url: str | None = Query(default=None), page_url: str | None = Query(default=None)):
-    ok, path, log = download_video(direct_url, page_url)
-    return JSONResponse({"status": "ok" if ok else "error", "path": path, "log": log})
+async def api_download(request: Request, direct_url: str | None = Query(default=None),
+                       page_url: str | None = Query(default=None), timing: bool = Query(False)):
+    # async 下载：不占线程池，并发由 ASYNC_DOWNLOAD_CONCURRENCY 限制，同视频共用一次下载；
+    # 超过 API_DOWNLOAD_TIMEOUT 或客户端断开即取消（需要排队/查询进度的用 /api/jobs）
+    with collect() as t:
+        try:
+            res = await _until_disconnect(request, aio.download_video_async(direct_url, page_url),
+                                          API_DOWNLOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            res = (False, None, f"下载超时（>{API_DOWNLOAD_TIMEOUT}s），已取消；再次请求会从断点续传")
+    if res is None:
+        return Response(status_code=499)  # 客户端已断开，没人接收
+    ok, path, log = res
+    return _reply({"status": "ok" if ok else "error", "path": path, "log": log}, t if timing else None)
+
+# ---------- 后台下载任务 ----------
+@app.post("/api/jobs")
+def api_jobs_submit(payload: dict = Body(...)):
+    """
+    提交下载任务，立即返回任务 ID；body 为 {"page_url": ..., "direct_url": ...}
+    或 {"items": [{"page_url": ..., "direct_url": ...}, ...]}
+    """
+    items = payload.get("items") or [payload]
+    out = []
+    for it in items:
+        page_url, direct_url = it.get("page_url"), it.get("direct_url")
+        if not page_url and not direct_url:
+            out.append({"status": "error", "msg": "page_url / direct_url 至少给一个"})
+            continue
+        try:
+            out.append(JOBS.submit(page_url, direct_url).to_dict())
+        except QueueFull as e:
+            out.append({"status": "error", "msg": str(e)})
+    return JSONResponse({"status": "ok", "jobs": out})
+
+@app.get("/api/jobs")
+def api_jobs_list(state: str | None = Query(default=None)):
+    return JSONResponse({"status": "ok", "stats": JOBS.stats(), "jobs": [j.to_dict() for j in JOBS.list(state)]})
+
+@app.get("/api/jobs/{job_id}")
+def api_jobs_get(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "msg": "任务不存在"}, status_code=404)
+    return JSONResponse({"status": "ok", "job": job.to_dict()})
+
+@app.delete("/api/jobs/{job_id}")
+def api_jobs_cancel(job_id: str):
+    if JOBS.get(job_id) is None:
+        return JSONResponse({"status": "error", "msg": "任务不存在"}, status_code=404)
+    return JSONResponse({"status": "ok", "cancelled": JOBS.cancel(job_id)})
+
+@app.post("/api/sniff")
+def api_sniff(payload: dict = Body(...)):
+    """
+    批量解析直链，与 Gradio 共用同一个解析池（先读页面内嵌数据，拿不到才用浏览器）。
+    body: {"urls": [...], "headless": true, "wait_ms": 8000, "concurrency": 4, "fast": true, "timing": false}
+    fast 模式下 wait_ms 只是超时上限，命中直链即返回；timing=true 时附上各阶段耗时。
+    返回里的 tiers 是进程启动以来各解析层的命中次数与命中率。
+    """
+    urls = [str(u).strip() for u in (payload.get("urls") or []) if str(u).strip()]
+    if not urls:
+        return JSONResponse({"status": "error", "msg": "urls 不能为空"})
+    with collect() as t:
+        # 先查直链缓存，只把未命中的交给浏览器池
+        with span("sniff.cache_lookup"):
+            cached = {u: link_cache.lookup(u) for u in urls}
+        misses = list(dict.fromkeys(u for u in urls if not cached[u]))
+        with span("sniff.batch"):
+            rows = get_pool().sniff_many(
+                misses,
+                headless=bool(payload.get("headless", True)),
+                wait_ms=int(payload.get("wait_ms", 8000)),
+                concurrency=payload.get("concurrency"),
+                fast=bool(payload.get("fast", SNIFF_FAST)),
+            )
+    sniffed = {}
+    for (u, d, s, dt) in rows:
+        link_cache.remember(u, d)
+        sniffed[u] = {"page_url": u, "direct_url": d, "status": s, "elapsed_ms": round(dt * 1000), "cached": False}
+    items = [
+        {"page_url": u, "direct_url": cached[u], "status": "✅ 解析成功", "elapsed_ms": 0, "cached": True}
+        if cached[u] else sniffed[u]
+        for u in urls
+    ]
+    return _reply({"status": "ok", "items": items, "tiers": tier_stats()}, t if payload.get("timing") else None)
+
+@app.post("/api/batch")
+def api_batch(payload: dict = Body(...)):
+    """
+    批量 解析 → 下载 → 抽帧，按完成顺序流式返回 NDJSON（每行一个事件，见 batch.run_batch）。
+    body: {"urls": [...], "stages": ["sniff", "download", "extract"], "step": 1,
+           "concurrency": {"sniff": 4, "download": 3, "extract": 1},
+           "fmt": "jpg", "max_width": 0, "max_height": 0, "quality": 0, "scene": 0, "dedup": null,
+           "wait_ms": 8000, "fast": true}
+    """
+    urls = [str(u).strip() for u in (payload.get("urls") or []) if str(u).strip()]
+    if not urls:
+        return JSONResponse({"status": "error", "msg": "urls 不能为空"})
+    if len(urls) > BATCH_MAX_URLS:
+        return JSONResponse({"status": "error", "msg": f"单次最多 {BATCH_MAX_URLS} 条链接"})
+    stages = payload.get("stages") or list(STAGES)
+    bad = [s for s in stages if s not in STAGES]
+    if bad:
+        return JSONResponse({"status": "error", "msg": f"未知阶段: {', '.join(map(str, bad))}"})
+    extract_kw = {k: payload[k] for k in ("fmt", "max_width", "max_height", "scene", "dedup") if payload.get(k) is not None}
+    if payload.get("quality"):
+        extract_kw["quality"] = payload["quality"]
+    sniff_kw = {"wait_ms": int(payload.get("wait_ms", 8000)), "fast": bool(payload.get("fast", SNIFF_FAST))}
+    events = run_batch(urls, stages, payload.get("step", 1), extract_kw, payload.get("concurrency") or {},
+                       sniff_kw=sniff_kw)
+    return StreamingResponse((json.dumps(ev, ensure_ascii=False) + "\n" for ev in events),
+                             media_type="application/x-ndjson")
+
+@app.on_event("startup")
+def _reconcile_index():
+    start_reconcile()  # 后台把 videos/ 与持久化索引对齐
+
+@app.on_event("shutdown")
+def _close_sniff_pool():
+    get_pool().close()
+
+@app.on_event("shutdown")
+async def _close_http_client():
+    await aio.aclose()
 
 @app.get("/api/extract_by_page")
-def api_extract_by_page(page_url: str = Query(...), step: int = Query(1)):
-    vp = PAGE_TO_PATH.get(page_url)
+async def api_extract_by_page(request: Request, page_url: str = Query(...), step: int = Query(1),
+                              strategy: str = Query("auto", pattern="^(auto|decode|seek)$"),
+                              keyframes: bool = Query(False),
+                              fmt: str = Query("jpg", pattern="^(jpg|jpeg|webp|png)$"),
+                              max_width: int = Query(0, ge=0), max_height: int = Query(0, ge=0),
+                              quality: int = Query(0, ge=0, le=100),
+                              scene: float = Query(0.0, ge=0, le=1),
+                              dedup: int | None = Query(default=None, ge=0, le=64)):
+    vp = await asyncio.to_thread(resolve_page, page_url)  # 查索引库，不卡事件循环
     if not vp:
         return JSONResponse({"status": "error", "msg": "该链接尚未在服务器下载，无法抽帧。请先下载。"})
-    ok, zip_path, log = extract_frames(vp, step)
+    # 边抽帧边发送 zip（STORED），不再先落盘整包；ffmpeg 是 asyncio 子进程，
+    # 客户端断开（StreamingResponse 取消迭代）或超过 API_EXTRACT_TIMEOUT 时被杀掉
+    deadline = asyncio.get_running_loop().time() + API_EXTRACT_TIMEOUT
+    try:
+        res = await _until_disconnect(request, aio.stream_frames_zip_async(
+            vp, step, strategy=strategy, keyframes=keyframes, fmt=fmt, max_width=max_width, max_height=max_height,
+            quality=quality or None, scene=scene, dedup=dedup, deadline=deadline), API_EXTRACT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return JSONResponse({"status": "error", "msg": f"抽帧超时（>{API_EXTRACT_TIMEOUT}s），已中止"})
+    if res is None:
+        return Response(status_code=499)
+    ok, body, name_or_err = res
     if not ok:
-        return JSONResponse({"status": "error", "msg": log})
-    return FileResponse(zip_path, filename=Path(zip_path).name)
+        return JSONResponse({"status": "error", "msg": name_or_err})
+    return _ClosingStreamingResponse(
+        body,
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(name_or_err)}"},
+    )
+
+@app.get("/api/frames_npy")
+async def api_frames_npy(request: Request, page_url: str = Query(...), step: int = Query(1),
+                         max_width: int = Query(0, ge=0), max_height: int = Query(0, ge=0),
+                         pix_fmt: str = Query("rgb24"), batch: int = Query(16, ge=1, le=256)):
+    """
+    原始帧流：一串首尾相接的 .npy（每个是 [N, H, W, C] 的 uint8 批），不经 JPEG、不落盘。
+    客户端对响应流反复 numpy.lib.format.read_array(f) 直到 EOF；第 k 帧的时间点为 k * step 秒。
+    与 /api/extract_by_page 一样受 API_EXTRACT_TIMEOUT 限制，客户端断开时 ffmpeg 被结束。
+    """
+    vp = await asyncio.to_thread(resolve_page, page_url)
+    if not vp:
+        return JSONResponse({"status": "error", "msg": "该链接尚未在服务器下载，无法抽帧。请先下载。"})
+    if pix_fmt not in PIX_FMTS:
+        return JSONResponse({"status": "error", "msg": f"pix_fmt 只支持 {', '.join(PIX_FMTS)}"})
+    deadline = asyncio.get_running_loop().time() + API_EXTRACT_TIMEOUT
+    try:
+        # 先拿到第一批：打不开/解码失败时还能回 JSON 错误
+        res = await _until_disconnect(request, aio.stream_npy_async(
+            vp, step, max_width, max_height, pix_fmt, batch, deadline=deadline), API_EXTRACT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return JSONResponse({"status": "error", "msg": f"抽帧超时（>{API_EXTRACT_TIMEOUT}s），已中止"})
+    if res is None:
+        return Response(status_code=499)
+    ok, body, err = res
+    if not ok:
+        return JSONResponse({"status": "error", "msg": err})
+    return _ClosingStreamingResponse(
+        body,
+        media_type="application/octet-stream",
+        headers={"X-Frame-Step": str(max(STEP_MIN, min(STEP_MAX, step)))},
+    )
+
+@app.post("/api/extract_multi")
+async def api_extract_multi(request: Request, payload: dict = Body(...)):
+    """
+    一次解码产出多组抽帧结果。
+    body: {"page_url": ..., "outputs": [{"step": 1}, {"step": 5, "size": "320x180", "format": "webp", "quality": 70}, ...]}
+    """
+    vp = await asyncio.to_thread(resolve_page, str(payload.get("page_url") or ""))
+    if not vp:
+        return JSONResponse({"status": "error", "msg": "该链接尚未在服务器下载，无法抽帧。请先下载。"})
+    outputs = [
+        (o.get("step", 1), o.get("size"), o.get("format", "jpg"), o.get("quality"))
+        for o in (payload.get("outputs") or [])
+    ]
+    with collect() as t:
+        try:
+            res = await _until_disconnect(request, _in_thread(extract_multi, vp, outputs), API_EXTRACT_TIMEOUT)
+        except asyncio.TimeoutError:
+            res = (False, [], f"抽帧超时（>{API_EXTRACT_TIMEOUT}s），已中止")
+    if res is None:
+        return Response(status_code=499)
+    ok, results, log = res
+    return _reply({"status": "ok" if ok else "error", "outputs": results, "log": log},
+                  t if payload.get("timing") else None)
+
+@app.get("/api/download_extract")
+async def api_download_extract(request: Request, page_url: str | None = Query(default=None),
+                               direct_url: str | None = Query(default=None),
+                               step: int = Query(1),
+                               fmt: str = Query("jpg", pattern="^(jpg|jpeg|webp|png)$"),
+                               max_width: int = Query(0, ge=0), max_height: int = Query(0, ge=0),
+                               quality: int = Query(0, ge=0, le=100),
+                               scene: float = Query(0.0, ge=0, le=1),
+                               dedup: int | None = Query(default=None, ge=0, le=64),
+                               timing: bool = Query(False)):
+    """
+    下载 + 抽帧一步完成：faststart / 分片 MP4 边下载边解码，moov 在尾部时下载完再抽。
+    结果与分开调用 /api/download、/api/extract_by_page 相同（视频与帧都进缓存）。
+    最长 API_DOWNLOAD_TIMEOUT + API_EXTRACT_TIMEOUT 秒；超时或客户端断开时停下载（.part 留着续传）、杀掉 ffmpeg。
+    """
+    timeout = API_DOWNLOAD_TIMEOUT + API_EXTRACT_TIMEOUT
+    with collect() as t:
+        try:
+            res = await _until_disconnect(request, _in_thread(
+                download_and_extract, direct_url, page_url, step, fmt=fmt, max_width=max_width,
+                max_height=max_height, quality=quality or None, scene=scene, dedup=dedup), timeout)
+        except asyncio.TimeoutError:
+            res = (False, "", f"下载抽帧超时（>{timeout}s），已取消；再次请求会从断点续传")
+    if res is None:
+        return Response(status_code=499)
+    ok, zip_path, log = res
+    return _reply({"status": "ok" if ok else "error", "zip": zip_path or None,
+                   "path": PAGE_TO_PATH.get(page_url) if page_url else None, "log": log}, t if timing else None)
 
 # 挂 Gradio 到根路径
 app = mount_gradio_app(app, demo, path="/")
@@ -0,0 +1,222 @@
+# batch.py
+"""
+批量 解析 → 下载 → 抽帧：每个阶段一个固定大小的线程池（各自的并发上限），
+条目完成一个阶段就产出一条事件并交给下一阶段，调用方按完成顺序逐条拿到结果。
+内存有界：同时在途的条目数不超过 max_inflight，事件队列也有上限——消费方读得慢时各阶段自然停下来等。
+调用方中途停止迭代（如 HTTP 客户端断开）时：不再放行新条目，正在下载的任务收到取消信号。
+"""
+from __future__ import annotations
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+from config import (
+    BATCH_SNIFF_CONCURRENCY, BATCH_DOWNLOAD_CONCURRENCY, BATCH_EXTRACT_CONCURRENCY, BATCH_MAX_INFLIGHT,
+)
+from downloader import download_video
+from extractor import _clamp_step, extract_frames
+import link_cache
+from metrics import register_gauge
+from parser import get_pool
+from state_store import resolve_page
+from utils import pick_platform_and_code
+
+STAGES = ("sniff", "download", "extract")
+
+_ACTIVE = {"batches": 0, "inflight": 0}
+_ACTIVE_LOCK = threading.Lock()
+register_gauge("batch_running", lambda: _ACTIVE["batches"])
+register_gauge("batch_inflight", lambda: _ACTIVE["inflight"])
+
+def _limit(requested, default: int) -> int:
+    try:
+        n = int(requested)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(n, default))
+
+class _Item:
+    __slots__ = ("i", "page_url", "direct_url", "path", "t0")
+
+    def __init__(self, i: int, page_url: str):
+        self.i = i
+        self.page_url = page_url
+        self.direct_url: Optional[str] = None
+        self.path: Optional[str] = None
+        self.t0 = time.perf_counter()
+
+class _Batch:
+    def __init__(self, urls: List[str], stages, step: int, extract_kw: dict, concurrency: dict,
+                 max_inflight: int, sniff_kw: dict):
+        self.urls = urls
+        self.stages = [s for s in STAGES if s in set(stages)]
+        self.step = _clamp_step(step)
+        self.extract_kw = extract_kw
+        self.sniff_kw = sniff_kw
+        self.pools = {
+            "sniff": ThreadPoolExecutor(_limit(concurrency.get("sniff"), BATCH_SNIFF_CONCURRENCY),
+                                        thread_name_prefix="batch-sniff"),
+            "download": ThreadPoolExecutor(_limit(concurrency.get("download"), BATCH_DOWNLOAD_CONCURRENCY),
+                                           thread_name_prefix="batch-dl"),
+            "extract": ThreadPoolExecutor(_limit(concurrency.get("extract"), BATCH_EXTRACT_CONCURRENCY),
+                                          thread_name_prefix="batch-extract"),
+        }
+        self.slots = threading.Semaphore(max(1, max_inflight))
+        self.events: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max(16, 2 * max_inflight))
+        self.cancel = threading.Event()
+        self.pending = 0  # 已放行、尚未结束的条目
+        self.lock = threading.Lock()
+        self.admitted_all = False
+        self.counts = {"items": 0, "ok": 0, "failed": 0, "duplicate": 0}
+
+    # ---------- 事件 ----------
+    def _emit(self, ev: dict):
+        while not self.cancel.is_set():
+            try:
+                self.events.put(ev, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _event(self, it: _Item, stage: str, ok: bool, t0: float, **extra) -> dict:
+        return {"i": it.i, "page_url": it.page_url, "stage": stage, "ok": ok,
+                "elapsed_ms": round((time.perf_counter() - t0) * 1000), **extra}
+
+    def _finish(self, it: _Item, ok: bool, **extra):
+        self._emit({"i": it.i, "page_url": it.page_url, "stage": "done", "ok": ok,
+                    "total_ms": round((time.perf_counter() - it.t0) * 1000), **extra})
+        with self.lock:
+            self.counts["ok" if ok else "failed"] += 1
+            self.pending -= 1
+            last = self.admitted_all and self.pending == 0
+        with _ACTIVE_LOCK:
+            _ACTIVE["inflight"] -= 1
+        self.slots.release()
+        if last:
+            self._emit(None)
+
+    def _next(self, it: _Item, stage: str):
+        """进入 stage 之后的下一个启用的阶段；没有了就结束该条目。"""
+        later = self.stages[self.stages.index(stage) + 1:] if stage in self.stages else self.stages
+        if not later:
+            return self._finish(it, True, path=it.path, direct_url=it.direct_url)
+        if self.cancel.is_set():
+            return self._finish(it, False, msg="cancelled")
+        nxt = later[0]
+        self.pools[nxt].submit(self._guard, getattr(self, f"_{nxt}"), it, nxt)
+
+    def _guard(self, fn, it: _Item, stage: str):
+        if self.cancel.is_set():  # 排队期间整批已取消
+            return self._finish(it, False, msg="cancelled")
+        try:
+            fn(it)
+        except Exception as e:  # 单条出错不影响整批
+            self._emit(self._event(it, stage, False, it.t0, msg=str(e)))
+            self._finish(it, False, msg=str(e))
+
+    # ---------- 各阶段 ----------
+    def _sniff(self, it: _Item):
+        t0 = time.perf_counter()
+        if resolve_page(it.page_url):
+            self._emit(self._event(it, "sniff", True, t0, skipped="downloaded"))
+            return self._next(it, "sniff")
+        cached = link_cache.lookup(it.page_url)
+        if cached:
+            it.direct_url = cached
+            self._emit(self._event(it, "sniff", True, t0, skipped="cached", direct_url=cached))
+            return self._next(it, "sniff")
+        rows = get_pool().sniff_many([it.page_url], concurrency=1, **self.sniff_kw)
+        _u, direct, status, _dt = rows[0]
+        link_cache.remember(it.page_url, direct)
+        it.direct_url = direct
+        self._emit(self._event(it, "sniff", bool(direct), t0, direct_url=direct, msg=status))
+        # 没解析到直链仍可交给下载阶段：download_video 会回退 yt-dlp
+        self._next(it, "sniff")
+
+    def _download(self, it: _Item):
+        t0 = time.perf_counter()
+        ok, path, log = download_video(it.direct_url, it.page_url, cancel=self.cancel)
+        it.path = path
+        self._emit(self._event(it, "download", ok, t0, path=path, msg=log))
+        if not ok:
+            return self._finish(it, False, msg=log)
+        self._next(it, "download")
+
+    def _extract(self, it: _Item):
+        t0 = time.perf_counter()
+        vp = it.path or resolve_page(it.page_url)
+        if not vp:
+            self._emit(self._event(it, "extract", False, t0, msg="视频尚未下载"))
+            return self._finish(it, False, msg="视频尚未下载")
+        ok, zip_path, log = extract_frames(vp, self.step, **self.extract_kw)
+        self._emit(self._event(it, "extract", ok, t0, zip=zip_path or None, msg=log))
+        if not ok:
+            return self._finish(it, False, msg=log)
+        self._finish(it, True, path=vp, zip=zip_path)
+
+    # ---------- 放行与收尾 ----------
+    def _admit(self):
+        seen = set()
+        try:
+            for i, url in enumerate(self.urls):
+                pf, code, _ = pick_platform_and_code(url, None)
+                key = f"{pf}:{code}" if (pf and code) else url
+                if key in seen:  # 同一视频只处理一次
+                    with self.lock:
+                        self.counts["duplicate"] += 1
+                    self._emit({"i": i, "page_url": url, "stage": "done", "ok": False, "msg": "duplicate"})
+                    continue
+                seen.add(key)
+                while not self.slots.acquire(timeout=0.5):
+                    if self.cancel.is_set():
+                        return
+                if self.cancel.is_set():
+                    self.slots.release()
+                    return
+                with self.lock:
+                    self.pending += 1
+                    self.counts["items"] += 1
+                with _ACTIVE_LOCK:
+                    _ACTIVE["inflight"] += 1
+                self._next(_Item(i, url), "")
+        finally:
+            with self.lock:
+                self.admitted_all = True
+                last = self.pending == 0
+            if last:
+                self._emit(None)
+
+    def run(self) -> Iterator[dict]:
+        t0 = time.perf_counter()
+        with _ACTIVE_LOCK:
+            _ACTIVE["batches"] += 1
+        admit = threading.Thread(target=self._admit, name="batch-admit", daemon=True)
+        admit.start()
+        try:
+            while True:
+                ev = self.events.get()
+                if ev is None:
+                    break
+                yield ev
+            yield {"stage": "summary", **self.counts, "wall_ms": round((time.perf_counter() - t0) * 1000)}
+        finally:
+            self.cancel.set()
+            for pool in self.pools.values():
+                pool.shutdown(wait=False)  # 排队中的条目会在 _guard 里直接以 cancelled 结束
+            with _ACTIVE_LOCK:
+                _ACTIVE["batches"] -= 1
+
+def run_batch(urls: List[str], stages=STAGES, step: int = 1, extract_kw: Optional[dict] = None,
+              concurrency: Optional[dict] = None, max_inflight: int = BATCH_MAX_INFLIGHT,
+              sniff_kw: Optional[dict] = None) -> Iterator[dict]:
+    """
+    逐条产出事件（dict），按完成顺序：
+      {"i", "page_url", "stage": "sniff"|"download"|"extract", "ok", "elapsed_ms", ...各阶段结果}
+      {"i", "page_url", "stage": "done", "ok", "total_ms", ...}   每条一次
+      {"stage": "summary", "items", "ok", "failed", "duplicate", "wall_ms"}   最后一条
+    stages：启用哪些阶段（抽帧需要视频已下载或同批下载）；concurrency：{"sniff": n, "download": n, "extract": n}，
+    不超过 config 里的默认上限；extract_kw 同 extract_frames 的输出参数；sniff_kw 传给 BrowserPool.sniff_many。
+    """
+    return _Batch(urls, stages, step, extract_kw or {}, concurrency or {}, max_inflight, sniff_kw or {}).run()
@@ -0,0 +1,2 @@
+# bench/__init__.py
+# 离线基准脚本：用本地替身服务测量解析/下载/抽帧的耗时，运行方式见各脚本顶部说明。
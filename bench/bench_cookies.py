@@ -0,0 +1,49 @@
+# bench/bench_cookies.py
+"""
+每次下载前取 Cookie 的开销：旧做法（每次读取解密浏览器 Cookie 库）vs CookieProvider 缓存。
+用法：python -m bench.bench_cookies --n 20 [--browser chrome --profile Default]
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import time
+
+from config import BROWSER, PROFILE
+from cookie_jar import CookieProvider
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20)
+    ap.add_argument("--browser", default=BROWSER)
+    ap.add_argument("--profile", default=PROFILE)
+    args = ap.parse_args()
+
+    from yt_dlp.cookies import extract_cookies_from_browser
+
+    legacy = []
+    for _ in range(args.n):
+        t0 = time.perf_counter()
+        try:
+            extract_cookies_from_browser(args.browser, profile=args.profile)
+        except Exception:
+            pass
+        legacy.append((time.perf_counter() - t0) * 1000)
+
+    prov = CookieProvider(args.browser, args.profile)
+    cached = []
+    for _ in range(args.n):
+        t0 = time.perf_counter()
+        prov.jar()
+        cached.append((time.perf_counter() - t0) * 1000)
+
+    print(json.dumps({
+        "browser": args.browser,
+        "calls": args.n,
+        "legacy_ms": {"median": round(statistics.median(legacy), 2), "total": round(sum(legacy), 1)},
+        "provider_ms": {"median": round(statistics.median(cached), 3), "total": round(sum(cached), 1)},
+        "provider_stats": prov.stats(),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# bench/bench_e2e.py
+"""
+端到端基准：本地替身服务仿抖音分享页 + douyinvod 直链（真实生成的 MP4，支持 Range 与单连接限速），
+按不同批量依次跑 解析（parser.BrowserPool）→ 下载（downloader.download_video）→ 抽帧（extractor.extract_frames），
+每个阶段输出吞吐与 p50/p95 延迟，结果为 JSON，可 --out 存档、--baseline 与之前的结果对比。
+用法：python -m bench.bench_e2e --batches 1,4,8 --seconds 30 --rate 4000000 --step 2 --out e2e.json
+未安装 Playwright 浏览器时解析阶段记为失败，下载阶段改用替身服务的直链继续。
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import downloader
+import extractor
+from bench.fixtures import clean_outputs, make_video, register_file, serve
+from bench.stats import summarize
+
+# 基准专用的编码段，清理时只动这些文件
+CODE_BASE = 7990000000000000000
+
+def _timed(fn: Callable[[], Tuple[bool, object]]) -> Tuple[float, bool, object]:
+    t0 = time.perf_counter()
+    try:
+        ok, val = fn()
+    except Exception as e:
+        ok, val = False, str(e)
+    return time.perf_counter() - t0, ok, val
+
+def _parallel(jobs: List[Callable[[], Tuple[bool, object]]], workers: int):
+    """并发跑一批，返回 (墙钟秒数, [(耗时, ok, 值)])。"""
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        rows = list(ex.map(lambda f: _timed(f), jobs))
+    return time.perf_counter() - t0, rows
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def _ffmpeg_version() -> Optional[str]:
+    try:
+        out = subprocess.run(["ffmpeg", "-hide_banner", "-version"], capture_output=True, text=True, timeout=5).stdout
+        return out.split("\n", 1)[0]
+    except Exception:
+        return None
+
+def _sniff_stage(base: str, codes: List[str], args) -> Tuple[dict, List[Optional[str]]]:
+    from parser import BrowserPool  # 只有解析阶段需要 Playwright
+    q = f"media_delay={args.media_delay}&asset_delay={args.asset_delay}&rate={args.rate}"
+    urls = [f"{base}/share/{c}?{q}" for c in codes]
+    pool = BrowserPool(concurrency=len(urls))
+    try:
+        pool.sniff_many(urls[:1], wait_ms=args.wait_ms, fast=True)  # 预热：启动浏览器不计入
+        t0 = time.perf_counter()
+        rows = pool.sniff_many(urls, wait_ms=args.wait_ms, concurrency=len(urls), fast=True)
+        wall = time.perf_counter() - t0
+    finally:
+        pool.close()
+    hits = [r[1] for r in rows]
+    row = summarize([r[3] for r in rows], wall, sum(1 for h in hits if h))
+    if not any(hits):
+        row["error"] = rows[0][2][:200] if rows else "no rows"
+    return row, hits
+
+def _download_stage(base: str, codes: List[str], hits: List[Optional[str]], args) -> Tuple[dict, List[Optional[str]]]:
+    def job(code: str, direct: str):
+        ok, path, log = downloader.download_video(direct, f"https://www.douyin.com/video/{code}")
+        return ok, path if ok else log
+    # 没嗅到直链（如没装浏览器）时直接用替身服务的直链，保证后续阶段照常计时
+    directs = [h or f"{base}/douyinvod.com/{c}.mp4?mime_type=video_mp4&rate={args.rate}" for c, h in zip(codes, hits)]
+    wall, rows = _parallel([lambda c=c, d=d: job(c, d) for c, d in zip(codes, directs)], len(codes))
+    paths = [v if ok else None for _dt, ok, v in rows]
+    mib = sum(Path(p).stat().st_size for p in paths if p) / 1048576
+    row = summarize([dt for dt, _ok, _v in rows], wall, sum(1 for p in paths if p), mib, "mib")
+    errs = [v for _dt, ok, v in rows if not ok]
+    if errs:
+        row["error"] = str(errs[0])[:200]
+    return row, paths
+
+def _extract_stage(paths: List[Optional[str]], args) -> dict:
+    def job(p: str):
+        ok, zip_path, log = extractor.extract_frames(p, args.step)
+        return ok, (len(extractor._frame_files(Path(zip_path).with_suffix(""))) if ok else log)
+    todo = [p for p in paths if p]
+    wall, rows = _parallel([lambda p=p: job(p) for p in todo], len(todo))
+    frames = sum(v for _dt, ok, v in rows if ok)
+    row = summarize([dt for dt, _ok, _v in rows], wall, sum(1 for _dt, ok, _v in rows if ok), frames, "frames")
+    errs = [v for _dt, ok, v in rows if not ok]
+    if errs:
+        row["error"] = str(errs[0])[:200]
+    return row
+
+def _compare(report: dict, baseline: dict) -> list:
+    """按 (batch, stage) 对齐，给出 p50/p95/吞吐 相对基线的变化百分比（负数 = 延迟下降/吞吐下降）。"""
+    old = {(r["batch"], r["stage"]): r for r in baseline.get("results", [])}
+    out = []
+    for r in report["results"]:
+        b = old.get((r["batch"], r["stage"]))
+        if not b:
+            continue
+        d = {"batch": r["batch"], "stage": r["stage"]}
+        for k in r:
+            if (k in ("p50_s", "p95_s") or k.endswith("_per_s")) and r[k] and b.get(k):
+                d[f"{k}_change_pct"] = round(100 * (r[k] - b[k]) / b[k], 1)
+        out.append(d)
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--batches", default="1,4,8", help="批量大小（逗号分隔）")
+    ap.add_argument("--seconds", type=int, default=30, help="测试视频时长")
+    ap.add_argument("--size", default="1280x720")
+    ap.add_argument("--rate", type=int, default=4_000_000, help="直链单连接限速（字节/秒），0 不限")
+    ap.add_argument("--step", type=int, default=2, help="抽帧间隔（秒）")
+    ap.add_argument("--wait-ms", type=int, default=8000)
+    ap.add_argument("--media-delay", type=int, default=300)
+    ap.add_argument("--asset-delay", type=int, default=800)
+    ap.add_argument("--stages", default="sniff,download,extract")
+    ap.add_argument("--dir", default=str(Path(tempfile.gettempdir()) / "bench_videos"))
+    ap.add_argument("--out", help="结果另存为 JSON 文件")
+    ap.add_argument("--baseline", help="之前保存的结果 JSON，输出里附上对比")
+    args = ap.parse_args()
+    stages = set(args.stages.split(","))
+
+    vp = make_video(Path(args.dir) / f"test-{args.seconds}s-{args.size}-faststart.mp4",
+                    args.seconds, args.size, movflags="+faststart")
+    register_file("douyinvod", vp)
+    report = {
+        "bench": "e2e",
+        "git": _git_rev(),
+        "env": {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count(),
+                "ffmpeg": _ffmpeg_version()},
+        "params": {"seconds": args.seconds, "size": args.size, "video_bytes": vp.stat().st_size,
+                   "rate": args.rate, "step": args.step, "dl_connections": downloader.DL_CONNECTIONS},
+        "results": [],
+    }
+    with serve() as base:
+        for batch in (int(b) for b in args.batches.split(",")):
+            codes = [str(CODE_BASE + batch * 1000 + i) for i in range(batch)]
+            clean_outputs(codes)
+            hits: List[Optional[str]] = [None] * batch
+            paths: List[Optional[str]] = []
+            try:
+                if "sniff" in stages:
+                    row, hits = _sniff_stage(base, codes, args)
+                    report["results"].append({"batch": batch, "stage": "sniff", **row})
+                if "download" in stages or "extract" in stages:
+                    row, paths = _download_stage(base, codes, hits, args)
+                    if "download" in stages:
+                        report["results"].append({"batch": batch, "stage": "download", **row})
+                if "extract" in stages:
+                    row = _extract_stage(paths, args)
+                    report["results"].append({"batch": batch, "stage": "extract", **row})
+            finally:
+                clean_outputs(codes)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            old = json.load(f)
+        report["vs_baseline"] = {"git": old.get("git"), "changes": _compare(report, old)}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+
+if __name__ == "__main__":
+    main()
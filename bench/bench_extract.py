@@ -0,0 +1,51 @@
+# bench/bench_extract.py
+"""
+抽帧策略对比：整段解码（fps 过滤）vs 逐帧跳转（精确 / 关键帧），在生成的测试视频上计时，
+并给出 choose_strategy 在各步长下的选择，用来校准 EXTRACT_SEEK_COST_FRAMES。
+用法：python -m bench.bench_extract --seconds 600 --steps 1,5,15,60
+"""
+from __future__ import annotations
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import extractor
+from bench.fixtures import make_video
+
+def _run(vp: Path, step: int, strategy: str, keyframes: bool) -> dict:
+    work = Path(tempfile.mkdtemp(prefix="bench_ex_"))
+    try:
+        t0 = time.perf_counter()
+        runner = extractor._Runner(work / ".ffmpeg.log").start(vp, work, step, extractor.frame_opts(keyframes=keyframes), 1, strategy)
+        ok, err = runner.wait()
+        dt = time.perf_counter() - t0
+        return {"ok": ok, "strategy": runner.strategy, "keyframes": keyframes,
+                "frames": len(extractor._frame_files(work)), "seconds": round(dt, 3), "err": err[-200:]}
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=int, default=600, help="测试视频时长")
+    ap.add_argument("--size", default="1280x720")
+    ap.add_argument("--gop", type=int, default=250)
+    ap.add_argument("--steps", default="1,5,15,60")
+    ap.add_argument("--dir", default=str(Path(tempfile.gettempdir()) / "bench_videos"))
+    args = ap.parse_args()
+
+    vp = make_video(Path(args.dir) / f"test-{args.seconds}s-{args.size}-g{args.gop}.mp4",
+                    args.seconds, args.size, gop=args.gop)
+    info = extractor.probe_video(vp)
+    report = {"video": str(vp), "probe": info, "cases": []}
+    for step in (int(s) for s in args.steps.split(",")):
+        row = {"step": step, "auto_choice": extractor.choose_strategy("auto", info, step)}
+        for name, strategy, kf in (("decode", "decode", False), ("seek", "seek", False), ("keyframe", "seek", True)):
+            row[name] = _run(vp, step, strategy, kf)
+        report["cases"].append(row)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench/bench_precheck.py
+"""
+预检查吞吐：在合成的 5 万文件目录上，对比旧的 glob+stat 查找与内存索引。
+用法：python -m bench.bench_precheck --files 50000 --urls 1000
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import utils
+
+def _legacy_find(d: Path, code: str):
+    # 原 find_existing_by_code：每次 mkdir + glob + stat
+    d.mkdir(parents=True, exist_ok=True)
+    cands = sorted(d.glob(f"{code}.*"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return cands[0] if cands else None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=50000)
+    ap.add_argument("--urls", type=int, default=1000)
+    ap.add_argument("--hit-ratio", type=float, default=0.5)
+    args = ap.parse_args()
+
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory(prefix="bench_precheck_") as tmp:
+        d = Path(tmp) / "douyin"
+        d.mkdir()
+        codes = [str(7000000000000000000 + i) for i in range(args.files)]
+        t0 = time.perf_counter()
+        for c in codes:
+            (d / f"{c}.mp4").touch()
+        t_make = time.perf_counter() - t0
+
+        n_hit = int(args.urls * args.hit_ratio)
+        picks = rnd.sample(codes, n_hit) + [str(8000000000000000000 + i) for i in range(args.urls - n_hit)]
+        rnd.shuffle(picks)
+        urls = [f"https://www.douyin.com/video/{c}" for c in picks]
+
+        def run(find):
+            t = time.perf_counter()
+            hits = 0
+            for u in urls:
+                pf = utils.detect_platform(u) or "douyin"
+                code = utils.extract_code(pf, u)
+                if find(code):
+                    hits += 1
+            return time.perf_counter() - t, hits
+
+        t_legacy, h_legacy = run(lambda c: _legacy_find(d, c))
+
+        utils.PLATFORM_DIRS["douyin"] = d
+        utils._INDEXES.pop("douyin", None)
+        t_first = time.perf_counter()
+        utils.find_existing_by_code("douyin", "warmup")  # 首次加载索引
+        t_load = time.perf_counter() - t_first
+        t_index, h_index = run(lambda c: utils.find_existing_by_code("douyin", c))
+
+    print(json.dumps({
+        "files": args.files,
+        "urls": args.urls,
+        "make_files_s": round(t_make, 3),
+        "legacy": {"total_s": round(t_legacy, 4), "urls_per_s": round(args.urls / t_legacy, 1), "hits": h_legacy},
+        "index": {"load_s": round(t_load, 4), "total_s": round(t_index, 4),
+                  "urls_per_s": round(args.urls / max(t_index, 1e-9), 1), "hits": h_index},
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# bench/bench_resolve.py
+"""
+分层解析：HTTP 层（读页面内嵌数据）+ 浏览器兜底 vs 只用浏览器。
+本地替身分享页三种：embed=render（RENDER_DATA）、embed=router（_ROUTER_DATA，带水印地址）、none（只能靠浏览器）。
+输出每种页面、每种分层的命中数、p50/p95、各层命中率，以及是否启动过浏览器；拿到的直链会用 Range: bytes=0-0 验证可下载。
+用法：python -m bench.bench_resolve --n 8 --concurrency 4
+没装 Playwright 浏览器时浏览器层记为出错，HTTP 层的结果照常统计。
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+
+import requests
+
+import parser
+from bench.fixtures import serve
+from bench.stats import summarize
+
+CHAINS = {"http+browser": ("http", "browser"), "browser": ("browser",)}
+EMBEDS = ("render", "router", "none")
+
+def _delta(before: dict, after: dict) -> dict:
+    out = {}
+    for name, c in after.items():
+        b = before.get(name, {})
+        d = {k: c[k] - b.get(k, 0) for k in ("hit", "miss", "error")}
+        n = sum(d.values())
+        if n:
+            out[name] = {**d, "hit_rate": round(d["hit"] / n, 3)}
+    return out
+
+def _playable(url: str) -> bool:
+    try:
+        with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=10) as r:
+            return r.status_code in (200, 206)
+    except requests.RequestException:
+        return False
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=8)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--wait-ms", type=int, default=8000)
+    ap.add_argument("--media-delay", type=int, default=300)
+    ap.add_argument("--asset-delay", type=int, default=800)
+    ap.add_argument("--chains", default=",".join(CHAINS))
+    args = ap.parse_args()
+
+    report = []
+    with serve() as base:
+        for chain in args.chains.split(","):
+            for embed in EMBEDS:
+                pool = parser.BrowserPool(concurrency=args.concurrency, tiers=CHAINS[chain])
+                q = f"media_delay={args.media_delay}&asset_delay={args.asset_delay}&embed={embed}"
+                urls = [f"{base}/share/{7100000000000000000 + i}?{q}" for i in range(args.n)]
+                try:
+                    before = parser.tier_stats()
+                    t0 = time.perf_counter()
+                    rows = pool.sniff_many(urls, wait_ms=args.wait_ms, fast=True)
+                    wall = time.perf_counter() - t0
+                    hits = [r[1] for r in rows if r[1]]
+                    row = {"chain": chain, "embed": embed,
+                           **summarize([r[3] for r in rows], wall, len(hits)),
+                           "playable": sum(1 for h in hits if _playable(h)),
+                           "browser_started": bool(pool._browsers),
+                           "tiers": _delta(before, parser.tier_stats())}
+                    if len(hits) < len(rows):
+                        row["status"] = next(r[2] for r in rows if not r[1])[:200]
+                    report.append(row)
+                finally:
+                    pool.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# bench/bench_sniff.py
+"""
+对比普通模式与快速模式（命中即返回 + 屏蔽资源）的解析耗时。
+用法：python -m bench.bench_sniff --n 8 --media-delay 300 --asset-delay 800
+需要已执行 playwright install。
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import time
+
+from parser import BrowserPool
+from bench.fixtures import serve
+from bench.stats import pct
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=8)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--wait-ms", type=int, default=8000)
+    ap.add_argument("--media-delay", type=int, default=300)
+    ap.add_argument("--asset-delay", type=int, default=800)
+    ap.add_argument("--assets", type=int, default=12)
+    args = ap.parse_args()
+
+    pool = BrowserPool(concurrency=args.concurrency)
+    report = []
+    try:
+        with serve() as base:
+            q = f"media_delay={args.media_delay}&asset_delay={args.asset_delay}&assets={args.assets}"
+            urls = [f"{base}/share/{7000000000000000000 + i}?{q}" for i in range(args.n)]
+            pool.sniff_many(urls[:1], wait_ms=args.wait_ms, fast=True)  # 预热：启动浏览器不计入
+            for fast in (False, True):
+                t0 = time.perf_counter()
+                rows = pool.sniff_many(urls, wait_ms=args.wait_ms, fast=fast)
+                wall = time.perf_counter() - t0
+                per = [r[3] for r in rows]
+                report.append({
+                    "mode": "fast" if fast else "full_wait",
+                    "n": len(rows),
+                    "hits": sum(1 for r in rows if r[1]),
+                    "wall_s": round(wall, 3),
+                    "p50_s": round(statistics.median(per), 3),
+                    "p95_s": round(pct(per, 0.95), 3),
+                })
+    finally:
+        pool.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
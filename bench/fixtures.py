@@ -0,0 +1,271 @@
+# bench/fixtures.py
+"""
+本地替身服务（只监听 127.0.0.1）：
+- /share/<id>   仿抖音分享页：带一批慢速图片/样式/字体，延迟 media_delay 毫秒后由 <video> 发起
+                 “douyinvod.com” 风格的 mp4 请求，正好命中 parser._is_media 的规则（rate 原样带进直链）；
+                 embed=render|router 时页面里另带内嵌数据（RENDER_DATA / window._ROUTER_DATA），供 parser 的 HTTP 层解析
+- /aweme/v1/play/?video_id=<id>  仿无水印播放接口：302 到对应的 douyinvod 直链
+- /slow/<name>  慢速静态资源，?d=毫秒
+- /douyinvod.com/<id>.mp4  视频请求的落点：登记了名为 "douyinvod" 的文件时按 /file 规则发送真实视频
+                 （端到端基准用嗅探到的直链直接下载），否则只回几个字节（解析阶段不关心内容）
+- /media/<name>?size=字节数&rate=单连接字节/秒&norange=1&cut=字节数
+                 确定性随机内容，支持 HEAD 与单段 Range；rate 模拟 CDN 的单连接限速，
+                 cut 让每个连接发够这么多字节后直接断开（模拟断网）
+- /file/<name>?rate=...  把 register_file() 登记的真实文件按同样的 Range/限速规则发出去（边下边抽基准用）
+另有 make_video()：用 ffmpeg 的 testsrc 生成指定时长/分辨率/GOP 的测试视频，供抽帧基准使用。
+"""
+from __future__ import annotations
+import contextlib
+import functools
+import json
+import random
+import re
+import shutil
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+from urllib.parse import urlparse, parse_qs, quote
+
+_PIXEL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+def _int(qs: dict, key: str, default: int) -> int:
+    try:
+        return int(qs.get(key, [default])[0])
+    except (TypeError, ValueError):
+        return default
+
+def _embed(vid: str, kind: str, origin: str, rate: int) -> str:
+    """分享页内嵌数据的两种常见形态：网页版 RENDER_DATA（URL 编码的 JSON）与移动端 _ROUTER_DATA（带水印地址）。"""
+    media = f"{origin}/douyinvod.com/{vid}.mp4?mime_type=video_mp4{f'&rate={rate}' if rate else ''}"
+    if kind == "render":
+        data = {"app": {"videoDetail": {"awemeId": vid, "video": {"playAddr": [{"src": media}]}}}}
+        return f'<script id="RENDER_DATA" type="application/json">{quote(json.dumps(data))}</script>'
+    if kind == "router":
+        wm = f"{origin}/aweme/v1/playwm/?video_id={vid}{f'&rate={rate}' if rate else ''}"
+        data = {"loaderData": {"video_(id)/page": {"videoInfoRes": {"item_list": [
+            {"aweme_id": vid, "video": {"play_addr": {"uri": vid, "url_list": [wm]}}}]}}}}
+        return f"<script>window._ROUTER_DATA = {json.dumps(data)}</script>"
+    return ""
+
+def share_page(vid: str, media_delay: int = 300, assets: int = 12, asset_delay: int = 800, rate: int = 0,
+               embed: str = "", origin: str = "") -> str:
+    imgs = "\n".join(f'<img src="/slow/img{i}.png?d={asset_delay}">' for i in range(assets))
+    css = "\n".join(f'<link rel="stylesheet" href="/slow/s{i}.css?d={asset_delay}">' for i in range(max(1, assets // 4)))
+    return f"""<!doctype html>
+<html><head><meta charset="utf-8"><title>share {vid}</title>
+{css}
+<style>@font-face {{ font-family: f; src: url(/slow/f.woff2?d={asset_delay}); }} body {{ font-family: f; }}</style>
+</head><body>
+<h1>video {vid}</h1>
+{imgs}
+{_embed(vid, embed, origin, rate)}
+<script>
+setTimeout(function () {{
+  var v = document.createElement("video");
+  v.src = "/douyinvod.com/{vid}.mp4?mime_type=video_mp4{f'&rate={rate}' if rate else ''}";
+  v.autoplay = true; v.muted = true;
+  document.body.appendChild(v);
+}}, {media_delay});
+</script>
+</body></html>"""
+
+@functools.lru_cache(maxsize=4)
+def blob(size: int) -> bytes:
+    """/media 返回的内容：按 size 播种的随机字节，方便校验下载结果。"""
+    return random.Random(size).randbytes(size)
+
+# /file/<name> 可发送的真实文件
+FILES: Dict[str, Path] = {}
+
+def register_file(name: str, path: Path) -> str:
+    FILES[name] = Path(path)
+    return f"/file/{name}"
+
+@functools.lru_cache(maxsize=8)
+def _file_bytes(path: Path, mtime_ns: int) -> bytes:
+    return path.read_bytes()
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # 基准时不刷屏
+        pass
+
+    def _send(self, code: int, body: bytes, ctype: str):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_media(self, qs: dict, head: bool = False, data: Optional[bytes] = None, etag: str = ""):
+        if data is None:
+            size = _int(qs, "size", 8 * 1024 * 1024)
+            data, etag = blob(size), f"blob-{size}"
+        size = len(data)
+        rate = _int(qs, "rate", 0)
+        cut = _int(qs, "cut", 0)
+        ranges_ok = not _int(qs, "norange", 0)
+        start, end = 0, size - 1
+        m = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", "")) if ranges_ok else None
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            else:  # bytes=-N
+                start = max(0, size - int(m.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", f'"{etag}"')
+        if ranges_ok:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if head:
+            return
+        step = 64 * 1024
+        t0 = time.perf_counter()
+        sent = 0
+        try:
+            for off in range(start, end + 1, step):
+                chunk = data[off:min(off + step, end + 1)]
+                if cut and sent + len(chunk) > cut:
+                    self.wfile.write(chunk[:cut - sent])
+                    self.close_connection = True
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    ahead = sent / rate - (time.perf_counter() - t0)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_file(self, name: str, qs: dict, head: bool = False):
+        path = FILES.get(name)
+        if path is None or not path.exists():
+            return self._send(404, b"not found", "text/plain")
+        mt = path.stat().st_mtime_ns
+        return self._send_media(qs, head, _file_bytes(path, mt), f"file-{name}-{mt}")
+
+    def do_HEAD(self):
+        u = urlparse(self.path)
+        if u.path.startswith("/media/"):
+            return self._send_media(parse_qs(u.query), head=True)
+        if u.path.startswith("/file/"):
+            return self._send_file(u.path.split("/")[-1], parse_qs(u.query), head=True)
+        if u.path.startswith("/douyinvod.com/") and "douyinvod" in FILES:
+            return self._send_file("douyinvod", parse_qs(u.query), head=True)
+        self._send(404, b"", "text/plain")
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        qs = parse_qs(u.query)
+        parts = [p for p in u.path.split("/") if p]
+        if parts and parts[0] == "media":
+            return self._send_media(qs)
+        if len(parts) == 2 and parts[0] == "file":
+            return self._send_file(parts[1], qs)
+        if len(parts) == 2 and parts[0] == "share":
+            html = share_page(
+                parts[1],
+                media_delay=_int(qs, "media_delay", 300),
+                assets=_int(qs, "assets", 12),
+                asset_delay=_int(qs, "asset_delay", 800),
+                rate=_int(qs, "rate", 0),
+                embed=qs.get("embed", [""])[0],
+                origin=f"http://{self.headers.get('Host', '127.0.0.1')}",
+            )
+            return self._send(200, html.encode("utf-8"), "text/html; charset=utf-8")
+        if parts[:3] == ["aweme", "v1", "play"]:
+            vid = qs.get("video_id", ["0"])[0]
+            rate = f"&rate={qs['rate'][0]}" if "rate" in qs else ""
+            self.send_response(302)
+            self.send_header("Location", f"/douyinvod.com/{vid}.mp4?mime_type=video_mp4{rate}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if parts and parts[0] == "slow":
+            time.sleep(_int(qs, "d", 0) / 1000)
+            name = parts[-1]
+            if name.endswith(".png"):
+                return self._send(200, _PIXEL, "image/png")
+            if name.endswith(".css"):
+                return self._send(200, b"body{margin:0}", "text/css")
+            return self._send(200, b"\0" * 64, "application/octet-stream")
+        if parts and parts[0] == "douyinvod.com":
+            if "douyinvod" in FILES:
+                return self._send_file("douyinvod", qs)
+            return self._send(200, b"\0" * 16, "video/mp4")
+        self._send(404, b"not found", "text/plain")
+
+@contextlib.contextmanager
+def serve(port: int = 0, handler=FixtureHandler) -> Iterator[str]:
+    """后台线程起服务，yield 基础 URL，例如 http://127.0.0.1:51234"""
+    srv = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    srv.daemon_threads = True
+    t = threading.Thread(target=srv.serve_forever, name="bench-fixtures", daemon=True)
+    t.start()
+    try:
+        yield f"http://127.0.0.1:{srv.server_address[1]}"
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+def make_video(path: Path, seconds: int, size: str = "1280x720", fps: int = 25, gop: int = 250,
+               movflags: str = "") -> Path:
+    """
+    生成测试视频（已存在就直接用）；画面带时间码，便于肉眼核对抽到的是哪一帧。
+    movflags 控制 MP4 版式：""（moov 在尾部）、"+faststart"、"+frag_keyframe+empty_moov"（分片）。
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp.mp4")
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+         "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={seconds}",
+         "-c:v", "libx264", "-preset", "ultrafast", "-g", str(gop), "-pix_fmt", "yuv420p",
+         *(["-movflags", movflags] if movflags else []),
+         str(tmp)],
+        check=True,
+    )
+    tmp.replace(path)
+    return path
+
+def clean_outputs(codes: Iterable[str]):
+    """
+    删掉基准自己产生的视频与抽帧缓存（只按给定编码，不动其它已下载内容），
+    以及状态库里对应的文件记录和指向它们的 page_url key，基准跑完不在索引里留下假视频。
+    """
+    from config import FRAMES
+    from state_store import STORE
+    from utils import find_existing_by_code, refresh_code
+    for code in codes:
+        p = find_existing_by_code("douyin", code) or STORE.find_by_code("douyin", code)
+        if p:
+            Path(p).unlink(missing_ok=True)
+            refresh_code("douyin", code)
+            STORE.forget_file(str(p))
+        for q in FRAMES.glob(f"{code}-*"):
+            if q.is_dir():
+                shutil.rmtree(q, ignore_errors=True)
+            else:
+                q.unlink(missing_ok=True)
@@ -0,0 +1,27 @@
+# bench/stats.py
+"""基准脚本共用的统计：分位数与每个阶段的汇总行（JSON 友好，便于跨提交对比）。"""
+from __future__ import annotations
+import statistics
+from typing import List, Optional
+
+def pct(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+def summarize(latencies: List[float], wall: float, ok: int, units: Optional[float] = None,
+              unit: str = "items") -> dict:
+    """
+    latencies：每项耗时（秒）；wall：整批墙钟时间；ok：成功项数；
+    units：吞吐按什么计（默认按成功项数），例如下载的 MiB、抽帧的帧数。
+    """
+    n = len(latencies)
+    amount = ok if units is None else units
+    return {
+        "n": n,
+        "ok": ok,
+        "wall_s": round(wall, 3),
+        f"{unit}_per_s": round(amount / wall, 3) if wall > 0 else None,
+        "p50_s": round(statistics.median(latencies), 3) if n else None,
+        "p95_s": round(pct(latencies, 0.95), 3) if n else None,
+        "max_s": round(max(latencies), 3) if n else None,
+    }
@@ -8,6 +8,12 @@ VIDEOS.mkdir(exist_ok=True)
 FRAMES = BASE / "frames"
 FRAMES.mkdir(exist_ok=True)
 
+CACHE = BASE / "cache"
+CACHE.mkdir(exist_ok=True)
+
+# 持久化索引（page_url / local:// / 编码 -> 文件）
+STATE_DB = BASE / "state" / "index.sqlite3"
+
 # 用哪个本机浏览器读取 Cookie（yt-dlp 支持：chrome / safari / firefox 等）
 BROWSER = "chrome"
 PROFILE = "Default"  # Chrome 常见：Default / Profile 1 / Profile 2
@@ -20,4 +26,90 @@ REFERER = "https://www.douyin.com/"
 
 # 抽帧限制
 STEP_MIN = 1
-STEP_MAX = 60
\ No newline at end of file
+STEP_MAX = 60
+
+# 解析直链：常驻浏览器池同时打开的页面数（Gradio 与 API 共享）
+SNIFF_CONCURRENCY = 4
+
+# 快速模式：命中第一个视频请求即返回（等待时长只作超时），并屏蔽播放器用不到的资源
+SNIFF_FAST = True
+SNIFF_BLOCK_TYPES = {"image", "font", "stylesheet"}
+SNIFF_BLOCK_HOSTS = (
+    "google-analytics.com", "googletagmanager.com",
+    "mcs.snssdk.com", "mon.zijieapi.com", "sf1-cdn-tos.douyinstatic.com/obj/rc-web-sdk",
+)
+
+# 解析直链分层依次尝试：http = 直接请求页面，从内嵌 JSON（RENDER_DATA / _ROUTER_DATA）读播放地址；
+# browser = 无头 Chromium 监听视频请求（慢、占内存，只在前面各层都失败时才用）
+SNIFF_TIERS = ("http", "browser")
+SNIFF_HTTP_TIMEOUT = 8
+SNIFF_HTTP_UA = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) "
+    "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+)
+
+# 直链缓存：签名链接识别不出过期参数时的默认有效期；临近过期前多少秒就视为失效
+LINK_CACHE_DEFAULT_TTL = 600
+LINK_CACHE_MARGIN = 60
+
+# 短链（v.douyin.com/<短码>/）换数字视频 ID：单次请求超时（秒）、最多跟随几跳、解析失败后多久内不再重试
+SHORT_LINK_TIMEOUT = 5
+SHORT_LINK_MAX_HOPS = 5
+SHORT_LINK_RETRY_SEC = 60
+
+# 已下载文件的内存索引：最多每隔多少秒 stat 一次目录，发现外部增删
+INDEX_RECHECK_SEC = 1.0
+
+# 直链下载：支持 Range 时最多开几条连接并行拉取；小于 DL_MIN_SPLIT 的文件直接单流
+DL_CONNECTIONS = 4
+DL_MIN_SPLIT = 4 * 1024 * 1024
+DL_MIN_SEGMENT = 2 * 1024 * 1024
+DL_CHUNK = 256 * 1024
+DL_TIMEOUT = 30
+# 断流后单段最多重试几次；每写入多少字节把分段进度落盘一次（.direct.part.json）
+DL_RETRIES = 3
+DL_META_EVERY = 4 * 1024 * 1024
+# 边下边抽（pipeline.py）：把文件切成这么大的小段，DL_CONNECTIONS 条连接按顺序领取，
+# 让“从头连续已落盘”的部分以接近总带宽的速度前进，ffmpeg 才能紧跟着解码
+PIPE_PIECE = 2 * 1024 * 1024
+# 同一视频正被别处下载时最多等多久（秒）；持有者卡住（如连接假死）时不至于让后来者一直占着线程，超时返回 busy
+DL_CLAIM_WAIT = 600
+
+# 后台下载任务：并行下载数、最多排队数、保留多少条已结束任务供查询
+JOB_WORKERS = 3
+JOB_MAX_PENDING = 1000
+JOB_KEEP_FINISHED = 500
+
+# 浏览器 Cookie 缓存有效期（秒）；Cookie 库文件有变化时会提前刷新
+COOKIE_TTL = 600
+
+# 抽帧结果缓存（frames/ 下）总量上限，超出后按最近使用时间淘汰
+FRAMES_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+# 长视频分片并行抽帧：时长 ≥ EXTRACT_SHARD_MIN_SEC 时按时间切成若干段各起一个 ffmpeg；
+# EXTRACT_SHARDS=0 表示按 CPU 核数决定段数，1 表示关闭分片
+EXTRACT_SHARDS = 0
+EXTRACT_SHARD_MIN_SEC = 600
+
+# 抽帧策略估算：一次“跳转取帧”折合解码多少帧（进程启动 + 平均半个 GOP）；
+# 输出帧数 × 该值 < 视频总帧数 时 auto 改用逐帧跳转。可用 python -m bench.bench_extract 实测后调整
+EXTRACT_SEEK_COST_FRAMES = 80
+EXTRACT_KEYFRAME_COST_FRAMES = 30
+
+# 批量接口 /api/batch：各阶段默认并发（请求里可再调小）、同时在途的条目数上限（限制内存）、单次最多多少条链接
+BATCH_SNIFF_CONCURRENCY = SNIFF_CONCURRENCY
+BATCH_DOWNLOAD_CONCURRENCY = JOB_WORKERS
+BATCH_EXTRACT_CONCURRENCY = 1
+BATCH_MAX_INFLIGHT = 64
+BATCH_MAX_URLS = 10000
+
+# async 接口（/api/download、/api/extract_by_page）：同时进行的下载 / 抽帧数由信号量限制（不占线程池），
+# 以及单个请求的最长用时（秒）；超时或客户端断开时取消下载、杀掉 ffmpeg
+ASYNC_DOWNLOAD_CONCURRENCY = JOB_WORKERS
+ASYNC_EXTRACT_CONCURRENCY = 2
+API_DOWNLOAD_TIMEOUT = 900
+API_EXTRACT_TIMEOUT = 600
+
+# 链接页结果表：每页显示多少条（只渲染当前页，几千条链接时页面也不卡）、解析 / 下载 / 抽帧进行中最快多久刷新一次（秒）
+LINK_PAGE_SIZE = 50
+LINK_REFRESH_SEC = 1.0
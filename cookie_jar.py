@@ -0,0 +1,138 @@
+# cookie_jar.py
+"""
+浏览器 Cookie 提供者：整个进程只读取/解密一次浏览器 Cookie 库，
+之后按 TTL 或 Cookie 源文件 mtime 变化才刷新；直链下载（requests）与 yt-dlp 回退共用同一份 jar。
+"""
+from __future__ import annotations
+import glob
+import io
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from config import BROWSER, PROFILE, COOKIE_TTL
+from metrics import cache_hit, cache_miss
+
+def _source_files(browser: str, profile: Optional[str]) -> List[Path]:
+    """尽力定位浏览器的 Cookie 库文件（找不到就只按 TTL 刷新）。"""
+    cands: List[str] = []
+    try:
+        if browser == "firefox":
+            roots = [
+                "~/.mozilla/firefox", "~/Library/Application Support/Firefox/Profiles",
+                os.path.expandvars(r"%APPDATA%\Mozilla\Firefox\Profiles"),
+            ]
+            for r in roots:
+                cands += glob.glob(os.path.join(os.path.expanduser(r), profile or "*", "cookies.sqlite"))
+        elif browser == "safari":
+            cands += [
+                os.path.expanduser("~/Library/Cookies/Cookies.binarycookies"),
+                os.path.expanduser("~/Library/Containers/com.apple.Safari/Data/Library/Cookies/Cookies.binarycookies"),
+            ]
+        else:
+            from yt_dlp.cookies import _get_chromium_based_browser_settings
+            root = _get_chromium_based_browser_settings(browser)["browser_dir"]
+            base = os.path.join(root, profile or "Default")
+            cands += [os.path.join(base, "Network", "Cookies"), os.path.join(base, "Cookies")]
+    except Exception:
+        return []
+    return [Path(p) for p in cands if os.path.exists(p)]
+
+class CookieProvider:
+    def __init__(self, browser: Optional[str] = BROWSER, profile: Optional[str] = PROFILE, ttl: float = COOKIE_TTL):
+        self.browser = browser
+        self.profile = profile
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jar = None
+        self._netscape: Optional[str] = None
+        self._loaded_at = 0.0
+        self._src_mtime: Optional[int] = None
+        self._sources: Optional[List[Path]] = None
+        # 计时：用来对比“每次下载都读一遍”与缓存命中的开销
+        self.loads = 0
+        self.hits = 0
+        self.load_ms_total = 0.0
+        self.last_load_ms = 0.0
+
+    def _source_mtime(self) -> Optional[int]:
+        if self._sources is None:
+            self._sources = _source_files(self.browser, self.profile)
+        mts = []
+        for p in self._sources:
+            for q in (p, p.with_name(p.name + "-wal"), p.with_name(p.name + "-journal")):
+                try:
+                    mts.append(q.stat().st_mtime_ns)
+                except OSError:
+                    pass
+        return max(mts) if mts else None
+
+    def _stale(self) -> bool:
+        if self._loaded_at == 0.0:
+            return True
+        if time.time() - self._loaded_at >= self.ttl:
+            return True
+        mt = self._source_mtime()
+        return mt is not None and mt != self._src_mtime
+
+    def _load(self):
+        t0 = time.perf_counter()
+        mt = self._source_mtime()
+        jar = None
+        try:
+            from yt_dlp.cookies import extract_cookies_from_browser
+            jar = extract_cookies_from_browser(self.browser, profile=self.profile)
+        except Exception:
+            jar = None
+        netscape = None
+        if jar is not None:
+            try:
+                buf = io.StringIO()
+                jar.save(buf)
+                netscape = buf.getvalue()
+            except Exception:
+                netscape = None
+        self._jar, self._netscape = jar, netscape
+        self._loaded_at, self._src_mtime = time.time(), mt
+        self.last_load_ms = (time.perf_counter() - t0) * 1000
+        self.load_ms_total += self.last_load_ms
+        self.loads += 1
+
+    def jar(self):
+        """requests 可直接使用的 CookieJar；未配置浏览器或读取失败时为 None。"""
+        if not self.browser:
+            return None
+        with self._lock:
+            if self._stale():
+                cache_miss("cookies")
+                self._load()
+            else:
+                cache_hit("cookies")
+                self.hits += 1
+            return self._jar
+
+    def ytdlp_cookiefile(self) -> Optional[io.StringIO]:
+        """
+        给 yt-dlp 的 cookiefile：每次返回新的内存文本流（Netscape 格式），
+        yt-dlp 退出时回写 Cookie 只会写进这个流，不会并发改同一个文件。
+        """
+        self.jar()
+        return io.StringIO(self._netscape) if self._netscape else None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "loads": self.loads,
+            "hits": self.hits,
+            "last_load_ms": round(self.last_load_ms, 1),
+            "avg_load_ms": round(self.load_ms_total / self.loads, 1) if self.loads else 0.0,
+            # 命中缓存省下的时间 ≈ 命中次数 × 平均读取耗时
+            "saved_ms": round(self.hits * (self.load_ms_total / self.loads), 1) if self.loads else 0.0,
+        }
+
+COOKIES = CookieProvider()
@@ -1,52 +1,319 @@
 # downloader.py
 from __future__ import annotations
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Tuple
-import shutil
+from typing import Callable, List, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 import yt_dlp
 
-from config import VIDEOS, BROWSER, PROFILE, UA, REFERER
+from config import (
+    VIDEOS, UA, REFERER,
+    DL_CONNECTIONS, DL_MIN_SPLIT, DL_MIN_SEGMENT, DL_CHUNK, DL_TIMEOUT, DL_RETRIES, DL_META_EVERY,
+    DL_CLAIM_WAIT,
+)
 from state_store import PAGE_TO_PATH
+from cookie_jar import COOKIES
+import link_cache
+from metrics import (
+    DOWNLOADS, DOWNLOAD_BYTES, DOWNLOAD_RATE, YTDLP_FALLBACK, cache_hit, cache_miss, observe, timed,
+)
 from utils import (
     pick_platform_and_code,
     target_path_for,
     find_existing_by_code,
+    refresh_code,
 )
 
+# 进度回调：(已下载字节, 总字节或 None)
+Progress = Callable[[int, Optional[int]], None]
+
+class DownloadCancelled(Exception):
+    pass
+
 def _browser_cookies():
-    if not BROWSER:
-        return None
+    # 进程级缓存：只有 TTL 到期或浏览器 Cookie 库变动时才重新读取解密
+    return COOKIES.jar()
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+def _session() -> requests.Session:
+    """进程内共享的连接池 Session（keep-alive），分段下载的各线程共用。"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(DL_CONNECTIONS * 4, 10))
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update({"User-Agent": UA, "Referer": REFERER})
+            _SESSION = s
+        return _SESSION
+
+# 同一视频同一时刻只允许一个下载者（任务队列、async 接口、边下边抽共用），避免两边同时写同一个 .part
+_CLAIMS: set = set()
+_CLAIMS_LOCK = threading.Lock()
+
+def try_claim(key: str) -> bool:
+    with _CLAIMS_LOCK:
+        if key in _CLAIMS:
+            return False
+        _CLAIMS.add(key)
+        return True
+
+def release(key: str):
+    with _CLAIMS_LOCK:
+        _CLAIMS.discard(key)
+
+class _RemoteChanged(IOError):
+    """服务端文件已变化（If-Range 不匹配 / 不再支持 Range），.part 作废需从头下。"""
+
+def _probe(direct_url: str, cookies) -> Tuple[Optional[int], bool, Optional[str], Optional[str]]:
+    """
+    用 Range: bytes=0-0 探测：206 + Content-Range 说明支持分段并拿到总长；
+    200 则只有 Content-Length（可能没有），按单流处理。
+    返回 (总长, 是否支持 Range, ETag, Last-Modified)。
+    """
+    with _session().get(direct_url, headers={"Range": "bytes=0-0"}, cookies=cookies,
+                        stream=True, timeout=DL_TIMEOUT) as r:
+        r.raise_for_status()
+        etag, lm = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        if r.status_code == 206:
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit():
+                return int(total), True, etag, lm
+        length = r.headers.get("Content-Length")
+        return (int(length) if length and length.isdigit() else None), False, etag, lm
+
+def _preallocate(f, size: int):
+    f.truncate(size)
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass  # 部分文件系统不支持，稀疏文件也能用
+
+# ---------- .part + sidecar ----------
+def _part_paths(save_to: Path) -> Tuple[Path, Path]:
+    # 不用 yt-dlp 的 "<name>.part"，避免回退下载时被它当成自己的半成品续传
+    part = save_to.with_name(save_to.name + ".direct.part")
+    return part, part.with_name(part.name + ".json")
+
+def _load_meta(meta_path: Path) -> Optional[dict]:
     try:
-        from yt_dlp.cookies import extract_cookies_from_browser
-        return extract_cookies_from_browser(BROWSER, profile=PROFILE)
-    except Exception:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        return meta if isinstance(meta.get("segments"), list) else None
+    except (OSError, ValueError, AttributeError):
         return None
 
-def _try_direct(direct_url: str, save_to: Path) -> Tuple[bool, Optional[Path], str]:
+def _save_meta(meta_path: Path, meta: dict):
+    tmp = meta_path.with_name(meta_path.name + ".tmp")
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, meta_path)
+
+def _same_remote(meta: dict, size: int, etag: Optional[str], lm: Optional[str]) -> bool:
+    # 直链每次解析都会换签名，不比 URL；比总长 + ETag/Last-Modified（至少一个对得上）
+    if meta.get("size") != size:
+        return False
+    if etag and meta.get("etag"):
+        return etag == meta["etag"]
+    if lm and meta.get("last_modified"):
+        return lm == meta["last_modified"]
+    return False
+
+def _if_range(etag: Optional[str], lm: Optional[str]) -> Optional[str]:
+    # If-Range 只接受强 ETag；弱 ETag 时退回 Last-Modified
+    if etag and not etag.startswith("W/"):
+        return etag
+    return lm
+
+def _plan_segments(size: int, piece: Optional[int] = None) -> List[dict]:
+    """默认切成至多 DL_CONNECTIONS 段各占一条连接；给了 piece 则切成等长小段，由连接池按顺序领取。"""
+    if piece:
+        seg = max(piece, DL_MIN_SEGMENT)
+    else:
+        n = 1 if size < DL_MIN_SPLIT else max(1, min(DL_CONNECTIONS, -(-size // DL_MIN_SEGMENT)))
+        seg = -(-size // n)
+    return [{"start": a, "end": min(a + seg, size) - 1, "done": 0} for a in range(0, size, seg)]
+
+def _fetch_segment(direct_url: str, cookies, part: Path, seg: dict, if_range: Optional[str],
+                   stop: threading.Event, progress):
+    """拉一段到 part 的对应位置；断流时按已写入的字节数续传，最多重试 DL_RETRIES 次。"""
+    for attempt in range(DL_RETRIES + 1):
+        if stop.is_set():
+            raise DownloadCancelled("cancelled")
+        start = seg["start"] + seg["done"]
+        if start > seg["end"]:
+            return
+        headers = {"Range": f"bytes={start}-{seg['end']}"}
+        if if_range:
+            headers["If-Range"] = if_range
+        try:
+            with _session().get(direct_url, headers=headers, cookies=cookies, stream=True, timeout=DL_TIMEOUT) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise _RemoteChanged(f"range {start}-{seg['end']} 返回 {r.status_code}")
+                # 无缓冲写：sidecar 记下的字节一定已交给操作系统
+                with open(part, "r+b", buffering=0) as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(DL_CHUNK):
+                        if stop.is_set():
+                            raise DownloadCancelled("cancelled")
+                        f.write(chunk)
+                        progress(seg, len(chunk))
+            if seg["start"] + seg["done"] > seg["end"]:
+                return
+            raise IOError(f"range {start}-{seg['end']} 提前结束")
+        except (_RemoteChanged, DownloadCancelled):
+            raise
+        except Exception:
+            if stop.is_set() or attempt >= DL_RETRIES:
+                raise
+            time.sleep(min(2 ** attempt, 8))
+
+def _download_segments(direct_url: str, cookies, part: Path, meta: dict, meta_path: Path,
+                       on_progress: Optional[Progress] = None, stop: Optional[threading.Event] = None):
+    """并行补齐 sidecar 里所有未完成的段；进度定期落盘，进程中断后下次从断点继续。"""
+    lock = threading.Lock()
+    unsaved = [0]
+    done = [sum(g["done"] for g in meta["segments"])]
+
+    def progress(seg: dict, n: int):
+        with lock:
+            seg["done"] += n
+            done[0] += n
+            unsaved[0] += n
+            if unsaved[0] >= DL_META_EVERY:
+                unsaved[0] = 0
+                _save_meta(meta_path, meta)
+            if on_progress:
+                on_progress(done[0], meta["size"])
+
+    todo = [g for g in meta["segments"] if g["start"] + g["done"] <= g["end"]]
+    if_range = _if_range(meta.get("etag"), meta.get("last_modified"))
+    stop = stop or threading.Event()
+    try:
+        # 段数多于连接数时按顺序排队领取（pipeline 靠这一点让已落盘部分从头连续增长）
+        with ThreadPoolExecutor(max_workers=max(1, min(DL_CONNECTIONS, len(todo))), thread_name_prefix="dl-seg") as ex:
+            futs = [ex.submit(_fetch_segment, direct_url, cookies, part, g, if_range, stop, progress) for g in todo]
+            # 某段失败不打断其它段：让它们尽量写完，已写入的字节都记进 sidecar，下次只补缺口
+            errors = [fu.exception() for fu in futs]
+    finally:
+        with lock:
+            _save_meta(meta_path, meta)
+    for e in errors:
+        if isinstance(e, (_RemoteChanged, DownloadCancelled)):
+            raise e
+    for e in errors:
+        if e is not None:
+            raise e
+
+def _download_single(direct_url: str, cookies, part: Path,
+                     on_progress: Optional[Progress] = None, stop: Optional[threading.Event] = None):
+    """服务端不支持 Range：只能单流整段下载，无法续传；按 Content-Length 校验长度。"""
+    with _session().get(direct_url, cookies=cookies, stream=True, timeout=DL_TIMEOUT) as r:
+        r.raise_for_status()
+        expect = r.headers.get("Content-Length")
+        total = int(expect) if expect and expect.isdigit() else None
+        got = 0
+        with open(part, "wb") as f:
+            for chunk in r.iter_content(DL_CHUNK):
+                if stop is not None and stop.is_set():
+                    raise DownloadCancelled("cancelled")
+                f.write(chunk)
+                got += len(chunk)
+                if on_progress:
+                    on_progress(got, total)
+    if expect and expect.isdigit() and r.headers.get("Content-Encoding") in (None, "identity") and got != int(expect):
+        raise IOError(f"长度不符：收到 {got} / {expect} 字节")
+
+def _record(via: str, result: str, seconds: float, nbytes: int = 0):
+    DOWNLOADS.labels(via, result).inc()
+    observe(f"download.{via}", seconds, result == "ok")
+    if nbytes:
+        DOWNLOAD_BYTES.labels(via).inc(nbytes)
+
+def _try_direct(direct_url: str, save_to: Path, progress: Optional[Progress] = None,
+                cancel: Optional[threading.Event] = None, piece: Optional[int] = None,
+                on_meta: Optional[Callable[[dict], None]] = None) -> Tuple[bool, Optional[Path], str]:
+    """
+    先写 <name>.direct.part（+ .json 记录各段进度与 ETag/Last-Modified），
+    校验长度无误后 os.replace 原子改名为最终文件；失败时保留 .part，下次按 Range 只补缺的字节。
+    piece：新建分段计划时改用按顺序领取的小段（见 PIPE_PIECE）；on_meta：分段下载开始前回调一次 sidecar
+    （其中各段的 done 会随下载原地更新，progress 回调时读取是一致的）。
+    """
+    t_ck = time.perf_counter()
     cookies = _browser_cookies()
-    headers = {"User-Agent": UA, "Referer": REFERER}
+    ck_ms = (time.perf_counter() - t_ck) * 1000
     save_to.parent.mkdir(parents=True, exist_ok=True)
+    part, meta_path = _part_paths(save_to)
     # 直链一般是 mp4；强制落到指定文件名
     try:
-        with requests.get(direct_url, headers=headers, cookies=cookies, stream=True, timeout=30) as r:
-            r.raise_for_status()
-            with open(save_to, "wb") as f:
-                shutil.copyfileobj(r.raw, f)
-        return True, save_to, "direct ok"
+        t0 = time.perf_counter()
+        size, ranged, etag, lm = _probe(direct_url, cookies)
+        resumed = 0
+        if ranged and size:
+            meta = _load_meta(meta_path)
+            if meta and part.exists() and part.stat().st_size == size and _same_remote(meta, size, etag, lm):
+                resumed = sum(g["done"] for g in meta["segments"])
+            else:
+                meta = {"size": size, "etag": etag, "last_modified": lm, "segments": _plan_segments(size, piece)}
+                with open(part, "wb") as f:
+                    _preallocate(f, size)
+                _save_meta(meta_path, meta)
+            if on_meta:
+                on_meta(meta)
+            try:
+                _download_segments(direct_url, cookies, part, meta, meta_path, progress, cancel)
+            except _RemoteChanged:
+                part.unlink(missing_ok=True)
+                meta_path.unlink(missing_ok=True)
+                raise
+            if any(g["start"] + g["done"] <= g["end"] for g in meta["segments"]) or part.stat().st_size != size:
+                raise IOError("分段未全部完成")
+            n = len(meta["segments"])
+            mode = f"{min(DL_CONNECTIONS, n)} conn" + (f", {n} pieces" if n > DL_CONNECTIONS else "")
+        else:
+            _download_single(direct_url, cookies, part, progress, cancel)
+            mode = "single"
+        os.replace(part, save_to)
+        meta_path.unlink(missing_ok=True)
+        dt = time.perf_counter() - t0
+        got = save_to.stat().st_size - resumed
+        _record("direct", "ok", dt, got)
+        DOWNLOAD_RATE.observe(got / max(dt, 1e-6))
+        extra = f", resumed {resumed / 1048576:.1f} MiB" if resumed else ""
+        return True, save_to, (f"direct ok ({mode}{extra}, {got / 1048576:.1f} MiB, "
+                               f"{got / 1048576 / max(dt, 1e-6):.1f} MiB/s, cookies {ck_ms:.1f} ms)")
+    except DownloadCancelled:
+        _record("direct", "cancelled", time.perf_counter() - t_ck)
+        return False, None, "cancelled"
     except Exception as e:
+        _record("direct", "failed", time.perf_counter() - t_ck)
         return False, None, f"direct failed: {e}"
 
-def _fallback_ytdlp(page_url: str, base_noext: Path) -> Tuple[bool, Optional[Path], str]:
+def _fallback_ytdlp(page_url: str, base_noext: Path, progress: Optional[Progress] = None,
+                    cancel: Optional[threading.Event] = None) -> Tuple[bool, Optional[Path], str]:
     """
     yt-dlp 输出模板：<base_noext>.%(ext)s
     下载后寻找以编码为前缀的最新文件返回。
     """
     outtmpl = str(base_noext) + ".%(ext)s"
     logs = []
+    YTDLP_FALLBACK.inc()
+    t0 = time.perf_counter()
     def hook(d):
+        if cancel is not None and cancel.is_set():
+            raise DownloadCancelled("cancelled")  # 在 hook 里抛异常即可中断 yt-dlp
         if d.get("status") == "finished":
             logs.append(f"done: {d.get('filename')}")
+        elif d.get("status") == "downloading" and progress:
+            progress(int(d.get("downloaded_bytes") or 0), d.get("total_bytes") or d.get("total_bytes_estimate"))
     ydl_opts = {
         "outtmpl": outtmpl,
         "retries": 10,
@@ -55,7 +322,8 @@ def _fallback_ytdlp(page_url: str, base_noext: Path) -> Tuple[bool, Optional[Pat
         "progress_hooks": [hook],
         "concurrent_fragment_downloads": 4,
         "http_headers": {"User-Agent": UA, "Referer": REFERER},
-        "cookiesfrombrowser": (BROWSER, PROFILE, None, None) if BROWSER else None,
+        # 与直链下载共用已缓存的 jar，避免 yt-dlp 再读一遍浏览器 Cookie 库
+        "cookiefile": COOKIES.ytdlp_cookiefile(),
         "format": "bv*+ba/b",
         # 某些站点需要此项提高成功率，可按需开启：
         # "geo_bypass": True,
@@ -65,42 +333,83 @@ def _fallback_ytdlp(page_url: str, base_noext: Path) -> Tuple[bool, Optional[Pat
             ydl.download([page_url])
         # 返回编码匹配的最新文件
         code = base_noext.name
-        saved = find_existing_by_code("douyin", code)  # 这里只有 douyin，更多平台时按 pf 传参
+        saved = refresh_code("douyin", code)  # 这里只有 douyin，更多平台时按 pf 传参
+        _record("ytdlp", "ok", time.perf_counter() - t0, saved.stat().st_size if saved else 0)
         return True, saved, "\n".join(logs) or "ytdlp ok"
     except Exception as e:
+        if cancel is not None and cancel.is_set():
+            _record("ytdlp", "cancelled", time.perf_counter() - t0)
+            return False, None, "cancelled"
+        _record("ytdlp", "failed", time.perf_counter() - t0)
         return False, None, f"ytdlp failed: {e}"
 
-def download_video(direct_url: Optional[str], page_url: Optional[str]) -> Tuple[bool, Optional[str], str]:
+@timed("download.total")
+def download_video(direct_url: Optional[str], page_url: Optional[str], progress: Optional[Progress] = None,
+                   cancel: Optional[threading.Event] = None) -> Tuple[bool, Optional[str], str]:
     """
     命名规范：videos/<platform>/<code>.<ext>
-    逻辑：优先直链 -> 回退 ytdlp；成功后写入 PAGE_TO_PATH[page_url] = 保存路径
+    逻辑：优先直链（未传时查直链缓存）-> 回退 ytdlp；成功后写入 PAGE_TO_PATH[page_url] = 保存路径
+    progress / cancel 供后台任务队列上报进度与取消（见 jobs.py）
     """
-    pf, code, msg = pick_platform_and_code(page_url, direct_url)
+    pf, code, msg = pick_platform_and_code(page_url, direct_url, resolve=True)
     if pf != "douyin" or not code:
         return False, None, f"不支持的平台或无法提取编码：{msg}"
 
-    # 目标“基名”与默认直链文件名（mp4）
-    base_noext = target_path_for(pf, code)          # e.g. videos/douyin/7536...
-    mp4_target = target_path_for(pf, code, "mp4")   # e.g. videos/douyin/7536....mp4
-
     # 如果已存在同编码文件，直接返回“已存在”
     existing = find_existing_by_code(pf, code)
     if existing:
+        cache_hit("video")
         if page_url:
             PAGE_TO_PATH[page_url] = str(existing)
         return True, str(existing), "already exists"
+    cache_miss("video")
+
+    key = f"{pf}:{code}"
+    give_up = time.monotonic() + DL_CLAIM_WAIT
+    while not try_claim(key):  # 别处正在下同一个视频：等它结束
+        if cancel is not None and cancel.is_set():
+            return False, None, "cancelled"
+        if time.monotonic() > give_up:
+            return False, None, "busy"
+        time.sleep(0.2)
+    try:
+        existing = find_existing_by_code(pf, code)
+        if existing:
+            if page_url:
+                PAGE_TO_PATH[page_url] = str(existing)
+            return True, str(existing), "already exists"
+        return _download_claimed(pf, code, direct_url, page_url, progress, cancel)
+    finally:
+        release(key)
+
+def _download_claimed(pf, code: str, direct_url: Optional[str], page_url: Optional[str],
+                      progress: Optional[Progress], cancel: Optional[threading.Event]) -> Tuple[bool, Optional[str], str]:
+    # 目标“基名”与默认直链文件名（mp4）
+    base_noext = target_path_for(pf, code)          # e.g. videos/douyin/7536...
+    mp4_target = target_path_for(pf, code, "mp4")   # e.g. videos/douyin/7536....mp4
+
+    # 没给直链时，用之前解析过且未过期的缓存直链，省掉 yt-dlp 回退
+    from_cache = False
+    if not direct_url and page_url:
+        direct_url = link_cache.lookup(page_url)
+        from_cache = bool(direct_url)
 
     # 直链优先
     if direct_url:
-        ok, path, log = _try_direct(direct_url, mp4_target)
+        ok, path, log = _try_direct(direct_url, mp4_target, progress, cancel)
         if ok and path:
+            refresh_code(pf, code)
             if page_url:
                 PAGE_TO_PATH[page_url] = str(path)
-            return True, str(path), log
+            return True, str(path), log + (" (cached link)" if from_cache else "")
+        if cancel is not None and cancel.is_set():
+            return False, None, "cancelled"
+        if from_cache:
+            link_cache.forget(page_url)  # 缓存的直链已不可用
 
     # 回退 ytdlp（按页面链接）
     if page_url:
-        ok2, path2, log2 = _fallback_ytdlp(page_url, base_noext)
+        ok2, path2, log2 = _fallback_ytdlp(page_url, base_noext, progress, cancel)
         if ok2 and path2:
             PAGE_TO_PATH[page_url] = str(path2)
             return True, str(path2), log2
@@ -1,40 +1,769 @@
 # extractor.py
 from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import re
 import shutil
 import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, List, Optional, Tuple, Union
 
-from config import FRAMES, STEP_MIN, STEP_MAX
+from config import (
+    FRAMES, STEP_MIN, STEP_MAX, FRAMES_CACHE_MAX_BYTES, EXTRACT_SHARDS, EXTRACT_SHARD_MIN_SEC,
+    EXTRACT_SEEK_COST_FRAMES, EXTRACT_KEYFRAME_COST_FRAMES,
+)
+from frame_dedup import Deduper
+from metrics import FRAMES_OUT, cache_hit, cache_miss, observe, span, timed
+from state_store import STORE
+from zipstream import iter_zip, write_zip
 
-def extract_frames(video_path: str, step_sec: int) -> Tuple[bool, str, str]:
+META_NAME = ".meta.json"  # 写在结果目录里，同时充当“已完成”标记与 LRU 访问时间
+_EVICT_LOCK = threading.Lock()
+JPEG_QSCALE = 3  # ffmpeg -q:v，2~31，越小越清晰
+WEBP_QUALITY = 80  # libwebp -quality，0~100
+FORMATS = ("jpg", "webp", "png")
+
+def _clamp_step(step_sec) -> int:
+    try:
+        return max(STEP_MIN, min(STEP_MAX, int(step_sec)))
+    except Exception:
+        return 1
+
+def _video_identity(vp: Path) -> str:
     """
-    每 step_sec 秒抽一帧，输出到 frames/<video_stem>/frame_00001.jpg，并打包为 zip
-    返回: (ok, zip_path_or_err, log)
+    视频内容标识：索引里有 sha1 且 size/mtime 对得上就用 sha1（同内容不同路径也能命中），
+    否则退回 size + mtime + 路径。
     """
+    st = vp.stat()
+    info = STORE.file_info(str(vp.resolve()))
+    if info and info["sha1"] and info["size"] == st.st_size and info["mtime_ns"] == st.st_mtime_ns:
+        return f"sha1:{info['sha1']}"
+    return f"stat:{st.st_size}:{st.st_mtime_ns}:{vp.resolve().as_posix()}"
+
+def _cache_entry(vp: Path, step: int, opts: dict) -> Tuple[str, Path, Path]:
+    """按 (视频内容, 步长, 输出参数) 生成缓存 key，不同参数落到不同目录。"""
+    raw = json.dumps({"video": _video_identity(vp), "step": step, "opts": opts}, sort_keys=True)
+    key = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+    out_dir = FRAMES / f"{vp.stem}-{key}"
+    return key, out_dir, out_dir.with_name(out_dir.name + ".zip")
+
+def _read_meta(out_dir: Path) -> Optional[dict]:
     try:
-        step = max(STEP_MIN, min(STEP_MAX, int(step_sec)))
-    except Exception:
-        step = 1
+        return json.loads((out_dir / META_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _frame_files(out_dir: Path) -> List[Path]:
+    return sorted(p for p in out_dir.iterdir() if p.is_file() and not p.name.startswith("."))
+
+def _write_zip(out_dir: Path, zip_path: Path):
+    # JPEG 已是压缩格式，STORED 即可
+    tmp = zip_path.with_name(zip_path.name + f".{uuid.uuid4().hex[:6]}.tmp")
+    write_zip(((p.name, p) for p in _frame_files(out_dir)), tmp)
+    os.replace(tmp, zip_path)
+
+def _dir_bytes(d: Path) -> int:
+    return sum(p.stat().st_size for p in d.iterdir() if p.is_file())
+
+def _evict(*keep: Path):
+    """
+    LRU：按结果目录里 .meta.json 的 mtime（命中时会 touch）从旧到新淘汰，
+    直到 frames/ 下缓存总量不超过 FRAMES_CACHE_MAX_BYTES；刚产出的 keep 不动。
+    """
+    with _EVICT_LOCK:
+        entries = []
+        total = 0
+        for d in FRAMES.iterdir():
+            meta = d / META_NAME
+            if d.name.startswith(".") or not d.is_dir() or not meta.exists():  # .work-* 是进行中的任务
+                continue
+            z = d.with_name(d.name + ".zip")
+            size = _dir_bytes(d) + (z.stat().st_size if z.exists() else 0)
+            entries.append((meta.stat().st_mtime, d, z, size))
+            total += size
+        for _mt, d, z, size in sorted(entries, key=lambda e: e[0]):
+            if total <= FRAMES_CACHE_MAX_BYTES:
+                break
+            if d in keep:
+                continue
+            shutil.rmtree(d, ignore_errors=True)
+            z.unlink(missing_ok=True)
+            total -= size
+
+def probe_video(vp: Path) -> Optional[dict]:
+    """
+    读取时长/分辨率/帧率：优先 ffprobe；没有 ffprobe 时退回解析 `ffmpeg -i` 的输出。
+    返回 {"duration": 秒, "width", "height", "fps"}（拿不到的字段为 None），完全失败返回 None。
+    """
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "format=duration:stream=width,height,avg_frame_rate",
+             "-of", "json", str(vp)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30,
+        )
+        data = json.loads(out.stdout or "{}")
+        st = (data.get("streams") or [{}])[0]
+        dur = float(data.get("format", {}).get("duration") or 0) or None
+        fps = None
+        num, _, den = (st.get("avg_frame_rate") or "").partition("/")
+        if num and den and float(den):
+            fps = float(num) / float(den) or None
+        if dur:
+            return {"duration": dur, "width": st.get("width"), "height": st.get("height"), "fps": fps}
+    except (OSError, ValueError, subprocess.SubprocessError):
+        pass
+
+    try:
+        out = subprocess.run(["ffmpeg", "-hide_banner", "-i", str(vp)],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    m = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", out.stderr)
+    if not m:
+        return None
+    h, mi, sec = m.groups()
+    info = {"duration": int(h) * 3600 + int(mi) * 60 + float(sec), "width": None, "height": None, "fps": None}
+    v = re.search(r"Video:.*?(\d{2,5})x(\d{2,5}).*?(\d+(?:\.\d+)?) fps", out.stderr)
+    if v:
+        info.update(width=int(v.group(1)), height=int(v.group(2)), fps=float(v.group(3)))
+    return info
+
+def parse_size(size) -> Tuple[int, int]:
+    """
+    输出尺寸上限：None/0/"" 表示原尺寸；320 或 "320" 只限宽；"x180" 只限高；"320x180" 限定在框内。
+    等比缩放，只缩不放。
+    """
+    if not size:
+        return 0, 0
+    if isinstance(size, int):
+        return max(0, size), 0
+    if isinstance(size, (tuple, list)):
+        w, h = (list(size) + [0, 0])[:2]
+        return max(0, int(w or 0)), max(0, int(h or 0))
+    w, _, h = str(size).lower().partition("x")
+    try:
+        return max(0, int(w or 0)), max(0, int(h or 0))
+    except ValueError:
+        raise ValueError(f"无效的尺寸: {size}")
+
+def _jpeg_qscale(quality: int) -> int:
+    # 1~100（越大越清晰）映射到 mjpeg 的 -q:v 31~2
+    return round(31 - (quality - 1) * 29 / 99)
+
+def frame_opts(fmt: str = "jpg", size=None, keyframes: bool = False, quality: Optional[int] = None,
+               scene: float = 0.0, dedup: Optional[int] = None) -> dict:
+    """
+    输出参数（同时用作缓存 key 的一部分）；默认参数与早先的 {"fmt": "jpg", "q": 3} 保持一致。
+    quality：1~100，None/0 用各格式默认值；PNG 无损，忽略 quality。
+    scene：0~1，>0 时只保留场景切换帧（与上一取样帧相比的 ffmpeg scene 分数超过该值，首帧总是保留）；
+    dedup：感知哈希汉明距离阈值（0~64），与上一张保留帧的距离不超过它就丢弃；None 不做。
+    这两种模式下保留帧仍按取样序号命名（frame_00007 即第 7 个取样点，时刻 6*step），序号会有空缺。
+    """
+    fmt = (fmt or "jpg").lower().replace("jpeg", "jpg")
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的格式: {fmt}")
+    quality = max(1, min(100, int(quality))) if quality else None
+    opts: dict = {"fmt": fmt}
+    if fmt == "jpg":
+        opts["q"] = _jpeg_qscale(quality) if quality else JPEG_QSCALE
+    elif fmt == "webp":
+        opts["q"] = quality or WEBP_QUALITY
+    w, h = parse_size(size)
+    if w:
+        opts["w"] = w
+    if h:
+        opts["h"] = h
+    if keyframes:
+        opts["kf"] = True  # 关键帧精度的结果与逐帧精确结果不同，单独缓存
+    if scene and float(scene) > 0:
+        opts["scene"] = round(min(1.0, float(scene)), 3)
+    if dedup is not None and int(dedup) >= 0:
+        opts["dedup"] = min(64, int(dedup))
+    return opts
+
+def _frame_name(n: int, opts: dict) -> str:
+    return f"frame_{n:05d}.{opts['fmt']}"
+
+class _FrameScan:
+    """
+    poll() 按序返回序号大于已发出序号（初始为 after）的帧文件，用于序号有空缺的输出：
+    场景模式（-frame_pts）全程靠它取帧；普通模式在 ffmpeg 退出后用它补发缺号之后的帧（分片少出帧时）。
+    目录 mtime 没变就不重扫；重扫用 os.scandir，只按文件名切出序号，只给新文件排序。
+    """
+
+    def __init__(self, work: Path, opts: dict, after: int = 0):
+        self.work = work
+        self._suffix = f".{opts['fmt']}"
+        self._last = after
+        self._mtime: Optional[int] = None
+
+    def poll(self, force: bool = False) -> List[Path]:
+        mt = os.stat(self.work).st_mtime_ns
+        if mt == self._mtime and not force:
+            return []
+        self._mtime = mt
+        k = len(self._suffix)
+        new = []
+        with os.scandir(self.work) as it:
+            for e in it:
+                name = e.name
+                if name.startswith("frame_") and name.endswith(self._suffix) and name[6:-k].isdigit():
+                    n = int(name[6:-k])
+                    if n > self._last:
+                        new.append((n, e.path))
+        new.sort()
+        if new:
+            self._last = new[-1][0]
+        return [Path(p) for _n, p in new]
+
+def _vf(step: Optional[int], opts: dict) -> str:
+    """fps 取样 + 可选的场景切换筛选 + 可选的等比缩小（偶数边长，兼容 yuv420 编码）。step=None 表示不做 fps 取样。"""
+    chain = [f"fps=1/{step}"] if step else []
+    if opts.get("scene"):
+        # 先把时间戳改成取样序号（从 1 起），筛掉的帧不占号，输出文件名配合 -frame_pts 保留原序号
+        chain += ["setpts=N+1", f"select=eq(n\\,0)+gt(scene\\,{opts['scene']})"]
+    w, h = opts.get("w"), opts.get("h")
+    if w and h:
+        chain.append(f"scale=w=min(iw\\,{w}):h=min(ih\\,{h}):force_original_aspect_ratio=decrease:force_divisible_by=2")
+    elif w:
+        chain.append(f"scale=w=min(iw\\,{w}):h=-2")
+    elif h:
+        chain.append(f"scale=w=-2:h=min(ih\\,{h})")
+    return ",".join(chain) or "null"
+
+def _enc_args(opts: dict) -> List[str]:
+    # 固定质量参数：mjpeg 默认码率控制会受前面帧影响，分片/跳转后同一帧编码结果就不一致了
+    if opts["fmt"] == "jpg":
+        return ["-q:v", str(opts["q"])]
+    if opts["fmt"] == "webp":
+        return ["-c:v", "libwebp", "-quality", str(opts["q"])]
+    return ["-c:v", "png"]
+
+def _ffmpeg_cmd(vp: Union[Path, str], work: Path, step: int, opts: dict, start_sec: float = 0.0,
+                max_frames: Optional[int] = None, start_number: int = 1, threads: int = 0) -> List[str]:
+    out_tpl = work / f"frame_%05d.{opts['fmt']}"
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    if start_sec > 0:
+        # -ss 放在 -i 前：输入端跳转 + 精确解码到该时刻，输出时间戳从 0 重新计起
+        cmd += ["-ss", f"{start_sec:.3f}"]
+    cmd += ["-i", str(vp), "-vf", _vf(step, opts)] + _enc_args(opts)
+    if max_frames is not None:
+        cmd += ["-frames:v", str(max_frames)]
+    if opts.get("scene"):
+        cmd += ["-fps_mode", "passthrough", "-frame_pts", "1"]
+    cmd += [
+        "-start_number", str(start_number),
+        # 显式用 image2：.webp 后缀默认会选 webp 复用器，它不支持 -atomic_writing
+        "-f", "image2",
+        # 先写 .tmp 再改名：看到 frame_xxxxx.jpg 就一定是完整文件，边抽边发依赖这一点
+        "-atomic_writing", "1",
+        str(out_tpl),
+    ]
+    return cmd
+
+def _plan_shards(duration: Optional[float], step: int, shards: Optional[int]) -> List[Tuple[int, Optional[int]]]:
+    """
+    把输出帧序号切成若干段：[(起始帧序号 k0, 帧数上限或 None)]，第 k 帧对应时刻 k*step。
+    段边界都落在 step 的整数倍上，每段从 k0*step 起抽、恰好抽满上限帧数，
+    因此段与段之间既不重叠也不留空；最后一段不设上限，一直抽到文件结束（与整段解码的收尾一致）。
+    """
+    if shards is None:
+        if not duration or duration < EXTRACT_SHARD_MIN_SEC:
+            return [(0, None)]
+        shards = EXTRACT_SHARDS or (os.cpu_count() or 1)
+    total = math.ceil(duration / step) if duration else 0
+    n = max(1, min(int(shards), total))
+    if n == 1:
+        return [(0, None)]
+    per = math.ceil(total / n)
+    plan = []
+    for k0 in range(0, total, per):
+        plan.append((k0, per))
+    k0, _ = plan[-1]
+    plan[-1] = (k0, None)
+    return plan
+
+def _seek_cmd(vp: Path, out: Path, t: float, step: int, opts: dict) -> List[str]:
+    """
+    只取 t 时刻的一帧：输入端跳转后解码到 t；仍挂同样的 fps 过滤器，取到的帧与整段解码逐字节一致。
+    关键帧模式（opts["kf"]）：解码器只解关键帧，取 t 之后（含 t）的第一个关键帧，几乎不用解码；
+    GOP 比步长长时相邻时刻可能落到同一关键帧，片尾最后一个关键帧之后的时刻取不到帧。
+    """
+    keyframes = opts.get("kf", False)
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-threads", "1"]
+    if keyframes:
+        cmd += ["-skip_frame", "nokey"]
+    cmd += ["-ss", f"{t:.3f}", "-i", str(vp), "-vf", _vf(None if keyframes else step, opts)]
+    cmd += ["-frames:v", "1"] + _enc_args(opts) + ["-f", "image2", "-update", "1", "-atomic_writing", "1", str(out)]
+    return cmd
+
+def choose_strategy(strategy: str, info: Optional[dict], step: int, keyframes: bool = False) -> str:
+    """
+    decode：整段解码 + fps 过滤，代价 ≈ 视频总帧数；
+    seek  ：每个输出帧单独跳转，代价 ≈ 输出帧数 × 单次跳转成本（进程启动 + 平均半个 GOP 的解码，折算成帧数）。
+    auto 按两者估算取小；探测不到时长时只能 decode。
+    """
+    if not info or not info.get("duration"):
+        return "decode"
+    if strategy in ("decode", "seek"):
+        return strategy
+    duration = info["duration"]
+    decode_cost = duration * (info.get("fps") or 25.0)
+    per_seek = EXTRACT_KEYFRAME_COST_FRAMES if keyframes else EXTRACT_SEEK_COST_FRAMES
+    seek_cost = math.ceil(duration / step) * per_seek
+    return "seek" if seek_cost < decode_cost else "decode"
+
+def plan_cmds(vp: Path, work: Path, step: int, opts: dict, shards: Optional[int] = None,
+              strategy: str = "auto") -> Tuple[str, int, Optional[dict], List[List[str]]]:
+    """
+    决定抽帧策略并生成要跑的 ffmpeg 命令，返回 (策略, 分片数, probe 信息, 命令列表)：
+    decode 时每个分片一条命令（各自并行），seek 时每个时刻一条（按 CPU 核数并行）。
+    同步的 _Runner 与 aio 里的异步版共用。
+    """
+    keyframes = opts.get("kf", False)
+    if opts.get("scene"):  # 场景分数要和相邻帧比较，只能单进程整段解码
+        strategy, shards = "decode", 1
+    info = None
+    if strategy != "decode" or keyframes or shards is None or shards > 1 or opts.get("scene"):
+        info = probe_video(vp)
+    duration = info["duration"] if info else None
+    chosen = choose_strategy(strategy, info, step, keyframes)
+    if chosen == "seek":
+        times = [k * step for k in range(math.ceil(duration / step))]
+        return chosen, 1, info, [_seek_cmd(vp, work / _frame_name(k + 1, opts), t, step, opts)
+                                 for k, t in enumerate(times)]
+    plan = _plan_shards(duration, step, shards)
+    if len(plan) == 1:
+        return chosen, 1, info, [_ffmpeg_cmd(vp, work, step, opts)]
+    threads = max(1, (os.cpu_count() or 1) // len(plan))
+    return chosen, len(plan), info, [_ffmpeg_cmd(vp, work, step, opts, s[0] * step, s[1], s[0] + 1, threads)
+                                     for s in plan]
+
+def cmd_parallelism(strategy: str, cmds: List[List[str]]) -> int:
+    """分片全部同时跑；逐帧跳转的短命进程按 CPU 核数并行。"""
+    if strategy == "seek":
+        return max(1, min(len(cmds), os.cpu_count() or 1))
+    return max(1, len(cmds))
+
+class _Runner:
+    """
+    在后台线程里跑抽帧（单进程或多分片），登记所有 ffmpeg 子进程，
+    调用方可以轮询 running()、等待 wait() 或中途 kill()。各子进程的 stderr 追加到 log_path。
+    """
+
+    def __init__(self, log_path: Path):
+        self.log_path = log_path
+        self._procs: List[subprocess.Popen] = []
+        self._lock = threading.Lock()
+        self._killed = False
+        self._thread: Optional[threading.Thread] = None
+        self.error = ""
+        self.shards = 1
+        self.strategy = "decode"
+        self.info: Optional[dict] = None
+
+    def run(self, cmd: List[str]) -> int:
+        with self._lock:
+            if self._killed:
+                return -1
+            with open(self.log_path, "ab") as log_f:
+                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=log_f)
+            self._procs.append(proc)
+        return proc.wait()
+
+    def start(self, vp: Path, work: Path, step: int, opts: dict, shards: Optional[int] = None,
+              strategy: str = "auto") -> "_Runner":
+        self._thread = threading.Thread(target=self._main, args=(vp, work, step, opts, shards, strategy),
+                                        name="extract", daemon=True)
+        self._thread.start()
+        return self
+
+    def _main(self, vp: Path, work: Path, step: int, opts: dict, shards: Optional[int], strategy: str):
+        try:
+            self.strategy, self.shards, self.info, cmds = plan_cmds(vp, work, step, opts, shards, strategy)
+            if len(cmds) == 1:
+                rcs = [self.run(cmds[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=cmd_parallelism(self.strategy, cmds),
+                                        thread_name_prefix=f"extract-{self.strategy}") as pool:
+                    rcs = list(pool.map(self.run, cmds))
+            if any(rc != 0 for rc in rcs):
+                raise RuntimeError("ffmpeg 执行失败")
+        except Exception as e:
+            self.error = self._tail() or str(e)
+
+    def _tail(self) -> str:
+        try:
+            return self.log_path.read_text(encoding="utf-8", errors="replace")[-1000:]
+        except OSError:
+            return ""
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait(self) -> Tuple[bool, str]:
+        if self._thread is not None:
+            self._thread.join()
+        if self._killed:
+            return False, "已中止"
+        return (not self.error), self.error
+
+    def kill(self):
+        with self._lock:
+            self._killed = True
+            procs = list(self._procs)
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+
+def _finalize(work: Path, out_dir: Path, vp: Path, step: int, opts: dict, t0: float,
+              shards: int = 1, strategy: str = "decode", dedup: Optional[dict] = None) -> dict:
+    """写 .meta.json 并把临时目录改名成缓存目录。"""
+    frames = _frame_files(work)
+    meta = {"video": str(vp), "step": step, "opts": opts, "frames": len(frames), "shards": shards, "strategy": strategy,
+            "bytes": sum(p.stat().st_size for p in frames), "seconds": round(time.perf_counter() - t0, 3)}
+    if dedup:
+        meta["dedup"] = dedup
+    (work / META_NAME).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    FRAMES_OUT.inc(len(frames))
+    try:
+        os.replace(work, out_dir)
+    except OSError:
+        pass  # 并发下别人已先产出同一结果，用现成的
+    return meta
+
+def _runner_note(runner: "_Runner") -> str:
+    if runner.strategy == "seek":
+        return "，逐帧跳转"
+    return f"，分 {runner.shards} 段并行" if runner.shards > 1 else ""
+
+class _FrameFilter:
+    """
+    场景切换 / 感知哈希去重的统计与逐帧过滤（按序号顺序喂入）。
+    sampled：取样点总数；场景模式下 ffmpeg 已经把没切换的帧丢了，按时长估算。
+    """
+
+    def __init__(self, opts: dict, step: int):
+        self.opts = opts
+        self.step = step
+        self.deduper = Deduper(opts["dedup"]) if "dedup" in opts else None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.opts.get("scene")) or self.deduper is not None
+
+    def keep(self, p: Path) -> bool:
+        if self.deduper is None or self.deduper.keep(p):
+            return True
+        p.unlink(missing_ok=True)
+        return False
+
+    def stats(self, kept: int, info: Optional[dict]) -> Optional[dict]:
+        if not self.active:
+            return None
+        hash_dropped = self.deduper.dropped if self.deduper else 0
+        after_scene = kept + hash_dropped
+        sampled = after_scene
+        if self.opts.get("scene") and info and info.get("duration"):
+            sampled = max(after_scene, math.ceil(info["duration"] / self.step))
+        return {"sampled": sampled, "kept": kept,
+                "scene_dropped": sampled - after_scene, "hash_dropped": hash_dropped}
+
+def _dedup_note(meta: dict) -> str:
+    d = meta.get("dedup")
+    if not d:
+        return ""
+    ratio = 100 * (1 - d["kept"] / d["sampled"]) if d["sampled"] else 0
+    return (f"，去重：保留 {d['kept']}/{d['sampled']} 帧（场景过滤 {d['scene_dropped']}，"
+            f"近似重复 {d['hash_dropped']}，减少 {ratio:.0f}%）")
+
+def _bytes_note(meta: dict) -> str:
+    total, n = meta.get("bytes") or 0, meta.get("frames") or 0
+    if not n:
+        return ""
+    return f"，共 {total / 1048576:.2f} MiB（平均 {total / n / 1024:.0f} KiB/帧）"
+
+@timed("extract.total")
+def extract_frames(video_path: str, step_sec: int, shards: Optional[int] = None,
+                   strategy: str = "auto", keyframes: bool = False, fmt: str = "jpg",
+                   max_width: int = 0, max_height: int = 0, quality: Optional[int] = None,
+                   scene: float = 0.0, dedup: Optional[int] = None) -> Tuple[bool, str, str]:
+    """
+    每 step_sec 秒抽一帧，输出到 frames/<video_stem>-<key>/frame_00001.jpg，并打包为 zip
+    key 由视频内容、步长与输出参数决定；命中缓存时不再解码，直接返回已有 zip。
+    fmt：jpg / webp / png；max_width / max_height：等比缩小到不超过该尺寸（0 不限）；quality：1~100；
+    scene / dedup：只保留场景切换帧 / 丢弃近似重复帧，见 frame_opts，统计写进日志。
+    shards：None 按时长自动决定是否分片并行（见 EXTRACT_SHARD_MIN_SEC），1 强制单进程，>1 指定段数；
+    strategy：auto / decode（整段解码）/ seek（逐帧跳转），auto 按估算代价选择，见 choose_strategy；
+    keyframes=True 表示接受关键帧精度（取各时刻起的第一个关键帧），跳转更快。
+    分片、decode/seek 的输出相同，不影响缓存 key；keyframes 会。
+    返回: (ok, zip_path_or_err, log)
+    """
+    step = _clamp_step(step_sec)
 
     vp = Path(video_path)
     if not vp.exists():
         return False, "", f"视频不存在: {video_path}"
 
-    out_dir = FRAMES / vp.stem
-    out_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        opts = frame_opts(fmt, (max_width, max_height), keyframes, quality, scene, dedup)
+    except ValueError as e:
+        return False, "", str(e)
+    key, out_dir, zip_path = _cache_entry(vp, step, opts)
+    meta = _read_meta(out_dir)
+    if meta is not None:
+        cache_hit("frames")
+        os.utime(out_dir / META_NAME)  # LRU 访问时间
+        if not zip_path.exists():
+            _write_zip(out_dir, zip_path)
+        return True, str(zip_path), (f"抽帧完成（缓存命中）：间隔 {step}s，{meta.get('frames', '?')} 帧"
+                                     f"{_dedup_note(meta)}{_bytes_note(meta)}")
 
-    out_tpl = out_dir / "frame_%05d.jpg"
-    cmd = [
-        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
-        "-i", str(vp),
-        "-vf", f"fps=1/{step}",
-        str(out_tpl)
-    ]
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    if proc.returncode != 0:
-        return False, "", proc.stdout[-1000:] if proc.stdout else "ffmpeg 执行失败"
+    cache_miss("frames")
+    # 先写到临时目录，完整结束后再改名，避免半成品被当成缓存
+    work = FRAMES / f".work-{key}-{uuid.uuid4().hex[:6]}"
+    work.mkdir(parents=True, exist_ok=True)
+    try:
+        t0 = time.perf_counter()
+        runner = _Runner(work / ".ffmpeg.log").start(vp, work, step, opts, shards, strategy)
+        ok, err = runner.wait()
+        observe(f"extract.ffmpeg.{runner.strategy}", time.perf_counter() - t0, ok)
+        if not ok:
+            return False, "", err
+        flt = _FrameFilter(opts, step)
+        with span("extract.filter"):
+            kept = sum(1 for p in _frame_files(work) if flt.keep(p))
+        meta = _finalize(work, out_dir, vp, step, opts, t0, runner.shards, runner.strategy,
+                         flt.stats(kept, runner.info))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
 
     # 打包 zip
-    zip_path = shutil.make_archive(str(out_dir), "zip", str(out_dir))
-    return True, zip_path, f"抽帧完成：间隔 {step}s"
\ No newline at end of file
+    if not zip_path.exists():
+        with span("extract.zip"):
+            _write_zip(out_dir, zip_path)
+    _evict(out_dir)
+    return True, str(zip_path), (f"抽帧完成：间隔 {step}s，{meta['frames']} 帧{_runner_note(runner)}"
+                                 f"{_dedup_note(meta)}{_bytes_note(meta)}")
+
+def adopt_work_dir(work: Path, video_path: str, step: int, opts: dict, t0: float,
+                   strategy: str = "decode", shards: int = 1, info: Optional[dict] = None) -> Tuple[str, str]:
+    """
+    把别处（如边下边抽的 pipeline、aio 的异步抽帧）产出的临时帧目录收编进缓存：按最终视频文件算 key，
+    做场景/去重过滤、写 .meta.json、改名、打包 zip、LRU 淘汰。返回 (zip_path, log)。
+    info：已有的 probe 结果，没有且开启了场景过滤时现探测（用于估算取样总数）。
+    """
+    vp = Path(video_path)
+    _key, out_dir, zip_path = _cache_entry(vp, step, opts)
+    flt = _FrameFilter(opts, step)
+    with span("extract.filter"):
+        kept = sum(1 for p in _frame_files(work) if flt.keep(p))
+    if info is None and opts.get("scene"):
+        info = probe_video(vp)
+    meta = _finalize(work, out_dir, vp, step, opts, t0, shards, strategy, flt.stats(kept, info))
+    if not zip_path.exists():
+        _write_zip(out_dir, zip_path)
+    _evict(out_dir)
+    return str(zip_path), f"抽帧完成：间隔 {step}s，{meta['frames']} 帧{_dedup_note(meta)}{_bytes_note(meta)}"
+
+def stream_frames_zip(video_path: str, step_sec: int, shards: Optional[int] = None,
+                      strategy: str = "auto", keyframes: bool = False, fmt: str = "jpg",
+                      max_width: int = 0, max_height: int = 0, quality: Optional[int] = None,
+                      scene: float = 0.0, dedup: Optional[int] = None) -> Tuple[bool, Optional[Iterator[bytes]], str]:
+    """
+    流式版本：返回 (ok, zip 字节流迭代器, 文件名或错误信息)；参数同 extract_frames。
+    - 命中缓存：直接从结果目录边读边发；
+    - 未命中：ffmpeg 一边抽帧，一边把已完成的帧写进 zip 流发出去，不在磁盘上另存 zip；
+      结束后帧目录照常进入缓存。
+    ffmpeg 在产出第一帧之前就失败（文件损坏等）时返回 ok=False，调用方还能回 JSON 错误。
+    """
+    step = _clamp_step(step_sec)
+    vp = Path(video_path)
+    if not vp.exists():
+        return False, None, f"视频不存在: {video_path}"
+
+    try:
+        opts = frame_opts(fmt, (max_width, max_height), keyframes, quality, scene, dedup)
+    except ValueError as e:
+        return False, None, str(e)
+    key, out_dir, zip_path = _cache_entry(vp, step, opts)
+    name = zip_path.name
+    if _read_meta(out_dir) is not None:
+        cache_hit("frames")
+        os.utime(out_dir / META_NAME)
+        return True, iter_zip((p.name, p) for p in _frame_files(out_dir)), name
+    cache_miss("frames")
+
+    work = FRAMES / f".work-{key}-{uuid.uuid4().hex[:6]}"
+    work.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    # stderr 落文件，免得管道写满把 ffmpeg 卡住
+    runner = _Runner(work / ".ffmpeg.log").start(vp, work, step, opts, shards, strategy)
+
+    first = work / _frame_name(1, opts)  # 场景/去重模式下首帧也总是保留
+    while runner.running() and not first.exists():
+        time.sleep(0.05)
+    if not first.exists():
+        ok, err = runner.wait()
+        if not ok:
+            shutil.rmtree(work, ignore_errors=True)
+            return False, None, err or "ffmpeg 执行失败"
+
+    flt = _FrameFilter(opts, step)
+    kept = 0
+
+    def produced() -> Iterator[Path]:
+        if opts.get("scene"):
+            scan = _FrameScan(work, opts)
+            while True:
+                running = runner.running()
+                new = scan.poll(force=not running)  # ffmpeg 已退出时最后完整扫一遍
+                yield from new
+                if not new:
+                    if not running:
+                        break
+                    time.sleep(0.05)
+            return
+        # 分片时后面的段可能先写出来，这里仍按序号依次发
+        n = 1
+        while True:
+            running = runner.running()
+            p = work / _frame_name(n, opts)
+            if p.exists():
+                yield p
+                n += 1
+            elif running:
+                time.sleep(0.05)
+            else:
+                # 某个分片少出了帧（关键帧跳转落点偏后、末段偏短）：缺号之后的帧也要发，与缓存里的结果一致
+                yield from _FrameScan(work, opts, after=n - 1).poll(force=True)
+                break
+
+    def frames() -> Iterator[Tuple[str, Path]]:
+        nonlocal kept
+        for p in produced():
+            if flt.keep(p):
+                kept += 1
+                yield p.name, p
+
+    def body() -> Iterator[bytes]:
+        ok = False
+        try:
+            yield from iter_zip(frames())
+            ok, err = runner.wait()
+            if not ok:
+                raise RuntimeError(err or "ffmpeg 执行失败")
+            _finalize(work, out_dir, vp, step, opts, t0, runner.shards, runner.strategy,
+                      flt.stats(kept, runner.info))
+            _evict(out_dir)
+        finally:
+            # 从开始抽帧到 zip 流发完（含客户端读取的时间）
+            observe("extract.stream", time.perf_counter() - t0, ok)
+            if runner.running():  # 客户端中途断开：停掉 ffmpeg
+                runner.kill()
+                runner.wait()
+            shutil.rmtree(work, ignore_errors=True)
+
+    return True, body(), name
+
+def _multi_cmd(vp: Path, branches: List[Tuple[Path, int, dict]]) -> List[str]:
+    """一次解码，split 成多路，每路各自 fps/缩放/编码后写进自己的目录。"""
+    n = len(branches)
+    graph = [f"[0:v]split={n}" + "".join(f"[s{i}]" for i in range(n))]
+    graph += [f"[s{i}]{_vf(step, opts)}[o{i}]" for i, (_w, step, opts) in enumerate(branches)]
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", str(vp),
+           "-filter_complex", ";".join(graph)]
+    for i, (work, _step, opts) in enumerate(branches):
+        cmd += ["-map", f"[o{i}]"] + _enc_args(opts) + [
+            "-f", "image2", "-atomic_writing", "1", str(work / f"frame_%05d.{opts['fmt']}")]
+    return cmd
+
+def extract_multi(video_path: str, outputs: List[tuple],
+                  cancel: Optional[threading.Event] = None) -> Tuple[bool, List[dict], str]:
+    """
+    一次解码产出多组抽帧结果。outputs: [(step, size, format[, quality]), ...]，
+    size 见 parse_size，format 为 jpg/webp/png，quality 见 frame_opts。
+    每组各有自己的缓存目录与 zip，与同参数的 extract_frames 结果通用；已缓存的组不参与解码。
+    cancel 被置位时杀掉 ffmpeg 并返回 (False, [], "cancelled")，不写入缓存。
+    返回: (ok, [{"step", "size", "format", "zip", "frames", "bytes", "cached"}, ...], log)
+    """
+    vp = Path(video_path)
+    if not vp.exists():
+        return False, [], f"视频不存在: {video_path}"
+
+    entries = {}  # key -> (step, size, opts, out_dir, zip_path)，相同参数只算一次
+    order = []
+    for out in outputs:
+        step, size, fmt = out[:3]
+        step = _clamp_step(step)
+        try:
+            opts = frame_opts(fmt, size, quality=out[3] if len(out) > 3 else None)
+        except ValueError as e:
+            return False, [], str(e)
+        key, out_dir, zip_path = _cache_entry(vp, step, opts)
+        entries.setdefault(key, (step, size, opts, out_dir, zip_path))
+        order.append(key)
+    if not entries:
+        return False, [], "outputs 不能为空"
+
+    cached = set()
+    for key, (_step, _size, _opts, out_dir, _zip) in entries.items():
+        if _read_meta(out_dir) is not None:
+            cache_hit("frames")
+            os.utime(out_dir / META_NAME)
+            cached.add(key)
+        else:
+            cache_miss("frames")
+    todo = [k for k in entries if k not in cached]
+
+    t0 = time.perf_counter()
+    works = {k: FRAMES / f".work-{k}-{uuid.uuid4().hex[:6]}" for k in todo}
+    try:
+        if todo:
+            for w in works.values():
+                w.mkdir(parents=True, exist_ok=True)
+            cmd = _multi_cmd(vp, [(works[k], entries[k][0], entries[k][2]) for k in todo])
+            log_path = works[todo[0]] / ".ffmpeg.log"
+            with span("extract.ffmpeg.multi"):
+                with open(log_path, "wb") as log_f:
+                    proc = subprocess.Popen(cmd, stdout=log_f, stderr=subprocess.STDOUT)
+                while True:
+                    try:
+                        rc = proc.wait(timeout=0.2)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if cancel is not None and cancel.is_set():
+                            proc.kill()
+                            proc.wait()
+                            return False, [], "cancelled"
+            if rc != 0:
+                tail = log_path.read_text(encoding="utf-8", errors="replace")[-1000:]
+                return False, [], tail or "ffmpeg 执行失败"
+            for k in todo:
+                step, _size, opts, out_dir, _zip = entries[k]
+                _finalize(works[k], out_dir, vp, step, opts, t0)
+    finally:
+        for w in works.values():
+            shutil.rmtree(w, ignore_errors=True)
+
+    results = []
+    for key in order:
+        step, size, opts, out_dir, zip_path = entries[key]
+        if not zip_path.exists():
+            _write_zip(out_dir, zip_path)
+        meta = _read_meta(out_dir) or {}
+        results.append({"step": step, "size": size, "format": opts["fmt"], "zip": str(zip_path),
+                        "frames": meta.get("frames"), "bytes": meta.get("bytes"), "cached": key in cached})
+    _evict(*(entries[k][3] for k in entries))
+    log = f"抽帧完成：{len(entries)} 组输出，{len(todo)} 组一次解码产出，{len(cached)} 组命中缓存"
+    return True, results, log
@@ -0,0 +1,49 @@
+# frame_dedup.py
+"""
+近似重复帧过滤：对每一帧算 64 位感知哈希（pHash：32×32 灰度 → DCT → 取左上 8×8 与中位数比较），
+与“上一张保留帧”的汉明距离不超过阈值就丢弃。画面越静止，丢得越多。
+"""
+from __future__ import annotations
+import math
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+def _dct_matrix(n: int = 32) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    m = np.cos(math.pi * (2 * x + 1) * k / (2 * n))
+    m[0] /= math.sqrt(2)
+    return m * math.sqrt(2 / n)
+
+_DCT = _dct_matrix()
+
+def phash(path: Path) -> int:
+    from PIL import Image  # gradio 已依赖 Pillow
+    with Image.open(path) as im:
+        g = np.asarray(im.convert("L").resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ g @ _DCT.T)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # 直流分量不参与取中位数
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class Deduper:
+    """按顺序喂帧；keep() 返回 False 的帧由调用方删除。threshold=0 时只丢完全相同的哈希。"""
+
+    def __init__(self, threshold: int):
+        self.threshold = max(0, int(threshold))
+        self._last: Optional[int] = None
+        self.seen = 0
+        self.dropped = 0
+
+    def keep(self, path: Path) -> bool:
+        self.seen += 1
+        h = phash(path)
+        if self._last is not None and hamming(h, self._last) <= self.threshold:
+            self.dropped += 1
+            return False
+        self._last = h
+        return True
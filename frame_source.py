@@ -0,0 +1,123 @@
+# frame_source.py
+"""
+不落盘的帧源：ffmpeg 按 fps=1/step 解码后直接输出原始像素（-f rawvideo），
+这里按固定大小读进 NumPy 数组，分批产出，省掉 JPEG 编码 → zip → 解压 → 解码的来回。
+内存上限约为 batch × 单帧字节数：消费方不读，管道写满后 ffmpeg 自然阻塞。
+"""
+from __future__ import annotations
+import io
+import re
+import subprocess
+import threading
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from extractor import _clamp_step, _vf, frame_opts
+
+# 像素格式 -> 通道数
+PIX_FMTS = {"rgb24": 3, "bgr24": 3, "gray": 1}
+
+# (帧数组 [N, H, W, C]，各帧时间点（秒）)
+FrameBatch = Tuple[np.ndarray, List[float]]
+
+_OUT_DIMS = re.compile(r"Video: rawvideo.*?(\d{2,5})x(\d{2,5})")
+
+class _StderrReader(threading.Thread):
+    """持续读 ffmpeg 的 stderr（避免管道写满），并从 Output #0 的流信息里拿到输出宽高。"""
+
+    def __init__(self, stream):
+        super().__init__(name="frame-source-stderr", daemon=True)
+        self.stream = stream
+        self.dims: Optional[Tuple[int, int]] = None
+        self.ready = threading.Event()
+        self.tail: List[str] = []
+
+    def run(self):
+        in_output = False
+        for raw in iter(self.stream.readline, b""):
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            self.tail = (self.tail + [line])[-20:]
+            if line.startswith("Output #0"):
+                in_output = True
+            elif in_output and self.dims is None:
+                m = _OUT_DIMS.search(line)
+                if m:
+                    self.dims = (int(m.group(1)), int(m.group(2)))
+                    self.ready.set()
+        self.ready.set()  # 进程结束：拿没拿到宽高都不再等
+
+def _cmd(vp: Path, step: int, max_width: int, max_height: int, pix_fmt: str) -> List[str]:
+    vf = _vf(step, frame_opts(size=(max_width, max_height)))
+    return [
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "info",
+        "-i", str(vp), "-vf", vf, "-an",
+        "-f", "rawvideo", "-pix_fmt", pix_fmt, "pipe:1",
+    ]
+
+def iter_frames(video_path: str, step_sec: int, max_width: int = 0, max_height: int = 0,
+                pix_fmt: str = "rgb24", batch: int = 16) -> Iterator[FrameBatch]:
+    """
+    每 step_sec 秒一帧，按 batch 帧一组产出 (uint8 数组 [N, H, W, C], 时间点列表)；最后一组可能不足 batch。
+    max_width / max_height 的缩放规则与 extract_frames 一致。调用方中途停止迭代时 ffmpeg 会被结束。
+    """
+    if pix_fmt not in PIX_FMTS:
+        raise ValueError(f"不支持的像素格式: {pix_fmt}")
+    vp = Path(video_path)
+    if not vp.exists():
+        raise FileNotFoundError(f"视频不存在: {video_path}")
+    step = _clamp_step(step_sec)
+    batch = max(1, int(batch))
+
+    proc = subprocess.Popen(_cmd(vp, step, max_width, max_height, pix_fmt),
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err = _StderrReader(proc.stderr)
+    err.start()
+    try:
+        err.ready.wait()
+        if err.dims is None:
+            proc.wait()
+            raise RuntimeError("\n".join(err.tail)[-1000:] or "ffmpeg 执行失败")
+        w, h = err.dims
+        c = PIX_FMTS[pix_fmt]
+        frame_bytes = w * h * c
+
+        k = 0
+        while True:
+            buf = np.empty((batch, h, w, c), dtype=np.uint8)
+            flat = memoryview(buf).cast("B")
+            n = 0
+            while n < batch:
+                view = flat[n * frame_bytes:(n + 1) * frame_bytes]
+                got = 0
+                while got < frame_bytes:
+                    r = proc.stdout.readinto(view[got:])
+                    if not r:
+                        break
+                    got += r
+                if got < frame_bytes:  # 结束（不完整的尾巴丢弃）
+                    break
+                n += 1
+            if n:
+                yield buf[:n], [(k + i) * step for i in range(n)]
+                k += n
+            if n < batch:
+                break
+        if proc.wait() != 0:
+            raise RuntimeError("\n".join(err.tail)[-1000:] or "ffmpeg 执行失败")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+def iter_npy(batches: Iterator[FrameBatch]) -> Iterator[bytes]:
+    """
+    把每一批编码成一个独立的 .npy（[N, H, W, C] uint8），首尾相接成字节流。
+    读取端对流反复调用 numpy.lib.format.read_array(f) 即可逐批还原，直到 EOF。
+    """
+    for arr, _ts in batches:
+        out = io.BytesIO()
+        np.lib.format.write_array(out, np.ascontiguousarray(arr), allow_pickle=False)
+        yield out.getvalue()
@@ -0,0 +1,184 @@
+# jobs.py
+"""
+后台下载任务队列：固定大小的工作线程池 + 任务 ID + 进度（字节/速率/ETA）+ 取消 + 同视频去重。
+Gradio 的“下载所选”与 /api/jobs 共用同一个 JOBS 实例；/api/download 走 aio.download_video_async，不经过这里，
+两边靠 downloader.try_claim 对同一视频互斥。
+"""
+from __future__ import annotations
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import JOB_WORKERS, JOB_MAX_PENDING, JOB_KEEP_FINISHED
+from downloader import download_video
+from metrics import observe, register_gauge
+from utils import pick_platform_and_code
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, key: str, page_url: Optional[str], direct_url: Optional[str]):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.page_url = page_url
+        self.direct_url = direct_url
+        self.state = QUEUED
+        self.bytes_done = 0
+        self.bytes_total: Optional[int] = None
+        self.rate = 0.0  # 字节/秒，指数平滑
+        self.path: Optional[str] = None
+        self.log = ""
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self._done_event = threading.Event()
+        self._future: Optional[Future] = None
+        self._last = (0.0, 0)
+
+    def on_progress(self, done: int, total: Optional[int]):
+        now = time.monotonic()
+        t_prev, b_prev = self._last
+        if t_prev and now - t_prev >= 0.5:
+            inst = max(0, done - b_prev) / (now - t_prev)
+            self.rate = inst if not self.rate else 0.7 * self.rate + 0.3 * inst
+            self._last = (now, done)
+        elif not t_prev:
+            self._last = (now, done)
+        self.bytes_done = done
+        if total:
+            self.bytes_total = int(total)
+
+    @property
+    def eta(self) -> Optional[float]:
+        if self.state != RUNNING or not self.bytes_total or self.rate <= 0:
+            return None
+        return max(0.0, (self.bytes_total - self.bytes_done) / self.rate)
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.state == DONE:
+            return 100.0
+        if not self.bytes_total:
+            return None
+        return min(100.0, 100.0 * self.bytes_done / self.bytes_total)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done_event.wait(timeout)
+
+    def to_dict(self) -> dict:
+        eta, pct = self.eta, self.percent
+        return {
+            "id": self.id,
+            "state": self.state,
+            "page_url": self.page_url,
+            "direct_url": self.direct_url,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "percent": round(pct, 1) if pct is not None else None,
+            "rate_bps": round(self.rate),
+            "eta_sec": round(eta, 1) if eta is not None else None,
+            "path": self.path,
+            "log": self.log,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 keep_finished: int = JOB_KEEP_FINISHED):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dl-job")
+        self._max_pending = max_pending
+        self._keep = keep_finished
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._inflight: Dict[str, Job] = {}  # 去重 key -> 未结束的任务
+
+    @staticmethod
+    def _key(page_url: Optional[str], direct_url: Optional[str]) -> str:
+        pf, code, _ = pick_platform_and_code(page_url, direct_url)
+        if pf and code:
+            return f"{pf}:{code}"
+        return page_url or direct_url or ""
+
+    def submit(self, page_url: Optional[str], direct_url: Optional[str] = None) -> Job:
+        """提交下载；同一视频已在排队/下载中时直接返回那个任务。队列满时抛 QueueFull。"""
+        key = self._key(page_url, direct_url)
+        with self._lock:
+            running = self._inflight.get(key)
+            if running is not None:
+                return running
+            pending = sum(1 for j in self._inflight.values() if j.state == QUEUED)
+            if pending >= self._max_pending:
+                raise QueueFull(f"排队任务已达上限 {self._max_pending}")
+            job = Job(key, page_url, direct_url)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            self._prune()
+        job._future = self._pool.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job):
+        if job.cancel_event.is_set():
+            return self._finish(job, CANCELLED, None, "cancelled")
+        job.state, job.started = RUNNING, time.time()
+        observe("jobs.queue_wait", job.started - job.created)
+        try:
+            ok, path, log = download_video(job.direct_url, job.page_url, job.on_progress, job.cancel_event)
+        except Exception as e:
+            ok, path, log = False, None, f"error: {e}"
+        if job.cancel_event.is_set() and not ok:
+            state = CANCELLED
+        else:
+            state = DONE if (ok and path) else FAILED
+        self._finish(job, state, path, log)
+
+    def _finish(self, job: Job, state: str, path: Optional[str], log: str):
+        with self._lock:
+            job.state, job.path, job.log, job.finished = state, path, log, time.time()
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+        job._done_event.set()
+
+    def _prune(self):
+        # 只保留最近 keep_finished 个已结束任务，防止长时间运行后无限增长
+        finished = [jid for jid, j in self._jobs.items() if j.state in FINAL_STATES]
+        for jid in finished[:max(0, len(finished) - self._keep)]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self, state: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [j for j in jobs if state is None or j.state == state]
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.state in FINAL_STATES:
+            return False
+        job.cancel_event.set()
+        if job._future is not None and job._future.cancel():  # 尚未开始，直接出队
+            self._finish(job, CANCELLED, None, "cancelled")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        out = {s: 0 for s in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        for j in jobs:
+            out[j.state] += 1
+        return out
+
+JOBS = JobManager()
+register_gauge("jobs_queued", lambda: JOBS.stats()[QUEUED])
+register_gauge("jobs_running", lambda: JOBS.stats()[RUNNING])
@@ -0,0 +1,135 @@
+# link_cache.py
+"""
+已解析直链的 TTL 缓存：key = (platform, code)，过期时间取自签名直链自带的参数
+（expire / x-expires / X-Amz-Date+X-Amz-Expires 等），落盘到 cache/resolved_links.json，重启不丢。
+短链与长链共用一条：code 按 short_links 表换成数字 ID，映射在缓存之后才解析出来时，由 rekey() 把已有条目挪过去。
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+from config import CACHE, LINK_CACHE_DEFAULT_TTL, LINK_CACHE_MARGIN
+from metrics import cache_hit, cache_miss
+from state_store import STORE
+from utils import Platform, pick_platform_and_code
+
+_ABS_KEYS = ("expire", "x-expires", "expires", "x-oss-expires", "deadline")
+
+def expiry_of(direct_url: str, now: Optional[float] = None) -> float:
+    """返回直链的绝对过期时间（unix 秒）；识别不出时按 LINK_CACHE_DEFAULT_TTL 估计。"""
+    now = time.time() if now is None else now
+    qs = {k.lower(): v[0] for k, v in parse_qs(urlparse(direct_url).query).items() if v}
+    for k in _ABS_KEYS:
+        v = qs.get(k)
+        if v and v.isdigit():
+            ts = int(v)
+            return ts / 1000 if ts > 10**12 else float(ts)  # 毫秒时间戳
+    amz_date, amz_exp = qs.get("x-amz-date"), qs.get("x-amz-expires")
+    if amz_date and amz_exp and amz_exp.isdigit():
+        try:
+            t0 = datetime.strptime(amz_date, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc).timestamp()
+            return t0 + int(amz_exp)
+        except ValueError:
+            pass
+    return now + LINK_CACHE_DEFAULT_TTL
+
+class LinkCache:
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, dict] = {}
+        self._load()
+
+    @staticmethod
+    def _key(pf: Platform, code: str) -> str:
+        return f"{pf}:{code}"
+
+    def _load(self):
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            raw = {}
+        now = time.time()
+        data: Dict[str, dict] = {}
+        for k, v in raw.items():
+            if not isinstance(v, dict) or v.get("expires", 0) <= now:
+                continue
+            pf, _, code = k.partition(":")
+            canon = None if code.isdigit() else STORE.get_canonical(pf, code)
+            if canon:  # 早先按短码存的条目，映射已知时并到数字 ID 上
+                k = self._key(pf, canon)
+            if k not in data or v.get("saved", 0) > data[k].get("saved", 0):
+                data[k] = v
+        self._data = data
+
+    def _save(self):
+        # 先写临时文件再 replace，进程中途被杀也不会留下半个 JSON
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def get(self, pf: Platform, code: str) -> Optional[str]:
+        with self._lock:
+            ent = self._data.get(self._key(pf, code))
+            if not ent:
+                return None
+            if ent["expires"] - LINK_CACHE_MARGIN <= time.time():
+                self._data.pop(self._key(pf, code), None)
+                return None
+            return ent["url"]
+
+    def put(self, pf: Platform, code: str, direct_url: str):
+        exp = expiry_of(direct_url)
+        if exp - LINK_CACHE_MARGIN <= time.time():
+            return
+        with self._lock:
+            now = time.time()
+            self._data = {k: v for k, v in self._data.items() if v["expires"] > now}
+            self._data[self._key(pf, code)] = {"url": direct_url, "expires": exp, "saved": now}
+            self._save()
+
+    def rekey(self, pf: Platform, short: str, canonical: str):
+        """短码刚解析出数字 ID：按短码存的直链挪到 ID 名下（ID 名下已有更新的就丢掉短码这条）。"""
+        with self._lock:
+            ent = self._data.pop(self._key(pf, short), None)
+            if ent is None:
+                return
+            old = self._data.get(self._key(pf, canonical))
+            if old is None or ent.get("saved", 0) > old.get("saved", 0):
+                self._data[self._key(pf, canonical)] = ent
+            self._save()
+
+    def drop(self, pf: Platform, code: str):
+        with self._lock:
+            if self._data.pop(self._key(pf, code), None) is not None:
+                self._save()
+
+_CACHE = LinkCache(CACHE / "resolved_links.json")
+
+# ---------- 按页面链接的便捷入口 ----------
+def lookup(page_url: Optional[str]) -> Optional[str]:
+    pf, code, _ = pick_platform_and_code(page_url, None)
+    hit = _CACHE.get(pf, code) if (pf and code) else None
+    (cache_hit if hit else cache_miss)("link")
+    return hit
+
+def remember(page_url: Optional[str], direct_url: Optional[str]):
+    if not direct_url:
+        return
+    pf, code, _ = pick_platform_and_code(page_url, direct_url)
+    if pf and code:
+        _CACHE.put(pf, code, direct_url)
+
+def rekey(platform: Platform, short: str, canonical: str):
+    _CACHE.rekey(platform, short, canonical)
+
+def forget(page_url: Optional[str]):
+    pf, code, _ = pick_platform_and_code(page_url, None)
+    if pf and code:
+        _CACHE.drop(pf, code)
@@ -0,0 +1,107 @@
+# metrics.py
+"""
+Prometheus 指标与轻量计时：
+- span("阶段名")：上下文管理器，耗时记入 vd_stage_seconds{stage} 直方图，异常时 vd_stage_errors_total +1；
+  若当前请求开启了 collect()，同一阶段的耗时也累加进该请求的计时明细（contextvars，按线程/协程隔离）。
+- timed("阶段名")：同上，装饰整个函数。
+- cache_hit / cache_miss：各类缓存的命中计数，命中率在 Prometheus 里按 hit / (hit + miss) 计算，
+  另有 vd_cache_hit_ratio 直接给出进程启动以来的比例。
+- 队列深度等“当前值”由各模块 register_gauge() 注册取值函数，抓取时现算。
+GET /metrics 输出 generate_latest() 的文本。
+"""
+from __future__ import annotations
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# 解析/下载/抽帧各阶段从几十毫秒到几分钟不等
+_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram("vd_stage_seconds", "各阶段耗时（秒）", ["stage"], buckets=_BUCKETS)
+STAGE_ERRORS = Counter("vd_stage_errors_total", "各阶段失败次数", ["stage"])
+SNIFF_RESULTS = Counter("vd_sniff_total", "直链解析结果", ["result"])
+SNIFF_TIER_RESULTS = Counter("vd_sniff_tier_total", "各解析层的结果（命中率 = hit / 全部）", ["tier", "result"])
+DOWNLOADS = Counter("vd_downloads_total", "下载次数（按途径与结果）", ["via", "result"])
+DOWNLOAD_BYTES = Counter("vd_download_bytes_total", "下载字节数", ["via"])
+DOWNLOAD_RATE = Histogram("vd_download_bytes_per_second", "单个直链下载的平均速率（字节/秒）",
+                          buckets=(64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6, 64e6, 128e6))
+YTDLP_FALLBACK = Counter("vd_ytdlp_fallback_total", "回退到 yt-dlp 的次数")
+FRAMES_OUT = Counter("vd_frames_total", "产出的帧数")
+CACHE = Counter("vd_cache_requests_total", "缓存查询次数", ["cache", "result"])
+CACHE_RATIO = Gauge("vd_cache_hit_ratio", "进程启动以来的缓存命中率", ["cache"])
+QUEUE_DEPTH = Gauge("vd_queue_depth", "队列/并发中的数量", ["queue"])
+
+# 当前请求的计时明细：阶段 -> 秒
+_TIMING: ContextVar[Optional[Dict[str, float]]] = ContextVar("vd_timing", default=None)
+
+_hits: Dict[str, list] = {}
+_hits_lock = threading.Lock()
+
+@contextmanager
+def collect() -> Iterator[Dict[str, float]]:
+    """在路由里包住一次请求，yield 的 dict 会收集期间（同一线程/协程内）各 span 的耗时。"""
+    d: Dict[str, float] = {}
+    token = _TIMING.set(d)
+    try:
+        yield d
+    finally:
+        _TIMING.reset(token)
+
+def observe(stage: str, seconds: float, ok: bool = True):
+    """直接记一段已测好的耗时（例如在别的线程里测的）。"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if not ok:
+        STAGE_ERRORS.labels(stage).inc()
+    d = _TIMING.get()
+    if d is not None:
+        d[stage] = round(d.get(stage, 0.0) + seconds, 4)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        observe(stage, time.perf_counter() - t0, ok)
+
+def timed(stage: str) -> Callable:
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def _ratio(cache: str) -> float:
+    h, m = _hits.get(cache, (0, 0))
+    return h / (h + m) if h + m else 0.0
+
+def _count(cache: str, hit: bool):
+    CACHE.labels(cache, "hit" if hit else "miss").inc()
+    with _hits_lock:
+        if cache not in _hits:
+            _hits[cache] = [0, 0]
+            CACHE_RATIO.labels(cache).set_function(lambda c=cache: _ratio(c))
+        _hits[cache][0 if hit else 1] += 1
+
+def cache_hit(cache: str):
+    _count(cache, True)
+
+def cache_miss(cache: str):
+    _count(cache, False)
+
+def register_gauge(queue: str, fn: Callable[[], float]):
+    """注册一个队列深度的取值函数，抓取 /metrics 时调用。"""
+    QUEUE_DEPTH.labels(queue).set_function(fn)
+
+def render() -> tuple:
+    """返回 (body, content_type)，给 /metrics 路由用。"""
+    return generate_latest(), CONTENT_TYPE_LATEST
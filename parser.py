@@ -1,36 +1,410 @@
 # parser.py
 import asyncio
-from typing import List, Tuple, Optional
+import concurrent.futures
+import json
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Tuple, Optional
+from urllib.parse import unquote
+
+import httpx
 from playwright.async_api import async_playwright
 
-async def sniff_one(url: str, headless: bool, wait_ms: int) -> Tuple[str, Optional[str], str]:
+from config import (
+    REFERER, SNIFF_CONCURRENCY, SNIFF_FAST, SNIFF_BLOCK_TYPES, SNIFF_BLOCK_HOSTS,
+    SNIFF_TIERS, SNIFF_HTTP_TIMEOUT, SNIFF_HTTP_UA,
+)
+from metrics import SNIFF_RESULTS, SNIFF_TIER_RESULTS, observe, register_gauge, span
+from utils import detect_platform, extract_code
+
+# (page_url, direct_url, status, elapsed_sec)
+SniffRow = Tuple[str, Optional[str], str, float]
+
+def _is_media(u: str) -> bool:
+    return "douyinvod.com" in u and ("mime_type=video_mp4" in u or u.endswith(".mp4"))
+
+def _should_block(url: str, resource_type: str) -> bool:
+    if resource_type in SNIFF_BLOCK_TYPES:
+        return True
+    return any(h in url for h in SNIFF_BLOCK_HOSTS)
+
+async def _sniff_in_context(browser, url: str, wait_ms: int, fast: bool = False) -> Tuple[Optional[str], str]:
+    """
+    在独立的 BrowserContext 里打开页面并监听请求；context 用完即关，Cookie/缓存互不干扰。
+    fast=True：命中第一个视频请求立即返回（wait_ms 只作超时上限），并屏蔽图片/字体/样式/统计脚本；
+    命中的视频请求本身也会被中止，播放器不必在浏览器里真的拉视频。
+    """
     hit_mp4 = None
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=headless)
+    found = asyncio.Event()
+
+    def capture(u: str) -> bool:
+        nonlocal hit_mp4
+        if not _is_media(u):
+            return False
+        if not hit_mp4:
+            hit_mp4 = u
+            found.set()
+        return True
+
+    async def on_route(route):
+        req = route.request
+        if capture(req.url) or _should_block(req.url, req.resource_type):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    with span("sniff.new_context"):
         ctx = await browser.new_context()
+    try:
+        if fast:
+            await ctx.route("**/*", on_route)
         page = await ctx.new_page()
+        page.on("request", lambda req: capture(req.url))
+
+        t0 = time.perf_counter()
+        try:
+            if fast:
+                await _wait_first_hit(page, url, wait_ms, found)
+            else:
+                await page.goto(url, wait_until="domcontentloaded")
+                await page.wait_for_timeout(wait_ms)
+        except Exception as e:
+            if not hit_mp4:
+                observe("sniff.page_load", time.perf_counter() - t0, False)
+                return None, f"❌ 加载失败: {e}"
+        # 快速模式下即“打开页面到捕获直链”的时间
+        observe("sniff.page_load", time.perf_counter() - t0, bool(hit_mp4))
+    finally:
+        await ctx.close()
+    return hit_mp4, ("✅ 解析成功" if hit_mp4 else "❌ 未捕获到直链")
 
-        def on_request(req):
-            nonlocal hit_mp4
-            u = req.url
-            if "douyinvod.com" in u and ("mime_type=video_mp4" in u or u.endswith(".mp4")):
-                if not hit_mp4:
-                    hit_mp4 = u
+async def _wait_first_hit(page, url: str, wait_ms: int, found: asyncio.Event):
+    """导航与“等命中”并行；命中、导航失败或超时三者先到先返回。"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait_ms / 1000
+    nav = asyncio.ensure_future(page.goto(url, wait_until="domcontentloaded", timeout=wait_ms))
+    hit = asyncio.ensure_future(found.wait())
+    try:
+        done, _ = await asyncio.wait({nav, hit}, timeout=wait_ms / 1000, return_when=asyncio.FIRST_COMPLETED)
+        if hit in done:
+            return
+        if nav in done:
+            nav.result()  # 导航失败直接抛出，不必等满超时
+            remaining = deadline - loop.time()
+            if remaining > 0:
+                await asyncio.wait({hit}, timeout=remaining)
+    finally:
+        for t in (nav, hit):
+            if not t.done():
+                t.cancel()
+            elif not t.cancelled():
+                t.exception()  # 命中后导航才失败的情况，避免 "exception was never retrieved"
 
-        page.on("request", on_request)
+# ---------- 页面内嵌数据 ----------
+_RENDER_DATA = re.compile(r'<script[^>]*\bid="RENDER_DATA"[^>]*>(.*?)</script>', re.S)
+_ROUTER_DATA = re.compile(r"window\._ROUTER_DATA\s*=\s*(\{.*?\})\s*;?\s*</script>", re.S)
+# 这些键下面是播放地址：{"playAddr": [{"src": ...}]}、{"play_addr": {"url_list": [...]}}、{"playApi": "..."}
+_PLAY_KEYS = ("playAddr", "play_addr", "playApi", "play_addr_h264")
 
+def _embedded_json(html: str) -> Iterator[object]:
+    for m in _RENDER_DATA.finditer(html):
+        try:
+            yield json.loads(unquote(m.group(1)))  # RENDER_DATA 是 URL 编码过的 JSON
+        except ValueError:
+            continue
+    for m in _ROUTER_DATA.finditer(html):
         try:
-            await page.goto(url, wait_until="domcontentloaded")
-            await page.wait_for_timeout(wait_ms)
+            yield json.loads(m.group(1))
+        except ValueError:
+            continue
+
+def _urls_under(v) -> Iterator[str]:
+    if isinstance(v, str):
+        yield v
+    elif isinstance(v, list):
+        for x in v:
+            yield from _urls_under(x)
+    elif isinstance(v, dict):
+        for k in ("src", "url_list", "uri"):
+            if k in v:
+                yield from _urls_under(v[k])
+
+def _play_urls(obj) -> Iterator[str]:
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k in _PLAY_KEYS:
+                yield from _urls_under(v)
+            else:
+                yield from _play_urls(v)
+    elif isinstance(obj, list):
+        for x in obj:
+            yield from _play_urls(x)
+
+def _normalize_play_url(u: str) -> Optional[str]:
+    if u.startswith("//"):
+        u = "https:" + u
+    if not u.startswith(("http://", "https://")):
+        return None
+    return u.replace("/playwm/", "/play/")  # 分享页给的是带水印地址，换成无水印的同一接口
+
+def find_play_url(html: str) -> Optional[str]:
+    """从页面 HTML 的内嵌 JSON 里找播放地址；douyinvod 直链优先（带过期参数，可进直链缓存）。"""
+    found = [u for data in _embedded_json(html) for u in map(_normalize_play_url, _play_urls(data)) if u]
+    found.sort(key=lambda u: not _is_media(u))
+    return found[0] if found else None
+
+# ---------- 解析分层 ----------
+_TIER_COUNTS: Dict[str, Dict[str, int]] = {}
+_TIER_LOCK = threading.Lock()
+
+class _Tier:
+    """一层解析：resolve() 返回 (直链或 None, 状态文字)；抛异常算该层出错，交给下一层。"""
+    name = ""
+
+    async def resolve(self, pool: Optional["BrowserPool"], url: str, opts: dict) -> Tuple[Optional[str], str]:
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+class HttpTier(_Tier):
+    """
+    不开浏览器：请求页面 HTML，从内嵌 JSON（RENDER_DATA / window._ROUTER_DATA）里读播放地址。
+    抖音链接在原页面里找不到时，再试服务端直出数据的移动端分享页 iesdouyin.com/share/video/<ID>/。
+    """
+    name = "http"
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = None
+
+    def _http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(headers={"User-Agent": SNIFF_HTTP_UA, "Referer": REFERER},
+                                             timeout=SNIFF_HTTP_TIMEOUT, follow_redirects=True)
+            self._loop = loop
+        return self._client
+
+    async def resolve(self, pool, url, opts):
+        pages = [url]
+        if detect_platform(url):
+            vid = await asyncio.to_thread(extract_code, "douyin", url, True)  # 短链要联网换 ID
+            if vid and vid.isdigit() and f"/share/video/{vid}" not in url:
+                pages.append(f"https://www.iesdouyin.com/share/video/{vid}/")
+        for p in pages:
+            r = await self._http().get(p)
+            if r.status_code == 200:
+                direct = find_play_url(r.text)
+                if direct:
+                    return direct, "✅ 解析成功（页面数据）"
+        return None, "❌ 页面数据中没有播放地址"
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class BrowserTier(_Tier):
+    """无头 Chromium 打开页面、监听视频请求。在池里时占一个页面名额；没有池（sniff_one）时单次启动浏览器。"""
+    name = "browser"
+
+    async def resolve(self, pool, url, opts):
+        if pool is None:
+            async with async_playwright() as p:
+                with span("sniff.browser_launch"):
+                    browser = await p.chromium.launch(headless=opts["headless"])
+                try:
+                    return await _sniff_in_context(browser, url, opts["wait_ms"], opts["fast"])
+                finally:
+                    await browser.close()
+        pool.waiting += 1
+        queued = True
+        t_q = time.perf_counter()
+        try:
+            async with pool._sem:
+                pool.waiting -= 1
+                queued = False
+                pool.active += 1
+                observe("sniff.queue_wait", time.perf_counter() - t_q)
+                try:
+                    browser = await pool._browser(opts["headless"])
+                    return await _sniff_in_context(browser, url, opts["wait_ms"], opts["fast"])
+                finally:
+                    pool.active -= 1
+        finally:
+            if queued:  # 排队时被取消
+                pool.waiting -= 1
+
+TIERS = {"http": HttpTier, "browser": BrowserTier}
+
+def make_tiers(names=SNIFF_TIERS) -> List[_Tier]:
+    return [TIERS[n]() for n in names]
+
+def tier_stats() -> Dict[str, dict]:
+    """进程启动以来各层的 命中 / 未命中 / 出错 次数与命中率。"""
+    with _TIER_LOCK:
+        out = {}
+        for name, c in _TIER_COUNTS.items():
+            n = sum(c.values())
+            out[name] = {**c, "hit_rate": round(c["hit"] / n, 4) if n else 0.0}
+        return out
+
+def _count(tier: str, outcome: str):
+    SNIFF_TIER_RESULTS.labels(tier, outcome).inc()
+    with _TIER_LOCK:
+        c = _TIER_COUNTS.setdefault(tier, {"hit": 0, "miss": 0, "error": 0})
+        c[outcome] += 1
+
+async def _run_tiers(tiers: List[_Tier], pool: Optional["BrowserPool"], url: str,
+                     opts: dict) -> Tuple[Optional[str], str, str]:
+    """依次尝试各层，先拿到直链的为准；返回 (直链, 状态, hit/miss/error)，状态取最后一层的。"""
+    status, result = "❌ 未配置解析方式", "error"
+    for tier in tiers:
+        t0 = time.perf_counter()
+        try:
+            direct, status = await tier.resolve(pool, url, opts)
+            result = "hit" if direct else "miss"
         except Exception as e:
-            await browser.close()
-            return url, None, f"❌ 加载失败: {e}"
+            direct, status, result = None, f"❌ 加载失败: {e}", "error"
+        _count(tier.name, result)
+        observe(f"sniff.tier.{tier.name}", time.perf_counter() - t0, result != "error")
+        if direct:
+            return direct, status, result
+    return None, status, result
 
-        await browser.close()
-    return url, hit_mp4, ("✅ 解析成功" if hit_mp4 else "❌ 未捕获到直链")
+async def sniff_one(url: str, headless: bool, wait_ms: int, fast: bool = False) -> Tuple[str, Optional[str], str]:
+    # 按 SNIFF_TIERS 逐层尝试，只有前面各层失败才单次独立启动浏览器；批量场景请用 BrowserPool
+    tiers = make_tiers()
+    try:
+        hit_mp4, status, _ = await _run_tiers(tiers, None, url, {"headless": headless, "wait_ms": wait_ms, "fast": fast})
+    finally:
+        for t in tiers:
+            await t.aclose()
+    return url, hit_mp4, status
 
-async def sniff_serial(urls: List[str], headless: bool, wait_ms: int):
+async def sniff_serial(urls: List[str], headless: bool, wait_ms: int, fast: bool = False):
     results = []
     for u in urls:
-        results.append(await sniff_one(u, headless, wait_ms))
-    return results
\ No newline at end of file
+        results.append(await sniff_one(u, headless, wait_ms, fast))
+    return results
+
+class BrowserPool:
+    """
+    常驻解析池：
+    - 每个 URL 按 tiers（默认 SNIFF_TIERS）逐层尝试，便宜的 HTTP 层命中就不碰浏览器；
+    - 一个后台线程跑专属事件循环，Playwright driver 与 Chromium 只在第一次需要时启动一次（按 headless 区分）；
+    - 每个 URL 一个独立 context，解析完即关闭；
+    - 全局信号量限制同时打开的页面数（所有调用方共享），单次批量还可再传更小的并发。
+    Gradio 与 FastAPI 都是同步线程调用，这里对外只暴露同步接口。
+    """
+
+    def __init__(self, concurrency: int = SNIFF_CONCURRENCY, tiers=SNIFF_TIERS):
+        self.concurrency = max(1, int(concurrency))
+        self.tiers = make_tiers(tiers)
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pw = None
+        self._browsers: Dict[bool, object] = {}
+        self._launch_lock: Optional[asyncio.Lock] = None
+        # 排队等页面名额 / 正在解析的数量（只在事件循环线程里改）
+        self.waiting = 0
+        self.active = 0
+
+    # ---------- 事件循环 / 浏览器 ----------
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="sniff-pool", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def _browser(self, headless: bool):
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            if self._pw is None:
+                self._pw = await async_playwright().start()
+            b = self._browsers.get(headless)
+            if b is None or not b.is_connected():  # 崩溃/被关掉后自动重启
+                with span("sniff.browser_launch"):
+                    b = await self._pw.chromium.launch(headless=headless)
+                self._browsers[headless] = b
+            return b
+
+    async def _sniff(self, url: str, headless: bool, wait_ms: int, fast: bool,
+                     limit: asyncio.Semaphore) -> SniffRow:
+        async with limit:
+            t0 = time.perf_counter()
+            hit_mp4, status, result = await _run_tiers(self.tiers, self, url,
+                                                       {"headless": headless, "wait_ms": wait_ms, "fast": fast})
+            dt = time.perf_counter() - t0
+            SNIFF_RESULTS.labels(result).inc()
+            observe("sniff.total", dt, result != "error")
+            return url, hit_mp4, status, dt
+
+    # ---------- 对外接口 ----------
+    def sniff_iter(self, urls: List[str], headless: bool = True, wait_ms: int = 8000,
+                   concurrency: Optional[int] = None, fast: bool = SNIFF_FAST) -> Iterator[SniffRow]:
+        """按完成顺序逐条产出结果，便于前端增量刷新。"""
+        if not urls:
+            return
+        loop = self._ensure_loop()
+        limit = asyncio.Semaphore(max(1, int(concurrency or self.concurrency)))
+        futs = [
+            asyncio.run_coroutine_threadsafe(self._sniff(u, headless, wait_ms, fast, limit), loop)
+            for u in urls
+        ]
+        try:
+            for f in concurrent.futures.as_completed(futs):
+                yield f.result()
+        finally:
+            for f in futs:  # 调用方中途放弃时，取消尚未开始的任务
+                f.cancel()
+
+    def sniff_many(self, urls: List[str], headless: bool = True, wait_ms: int = 8000,
+                   concurrency: Optional[int] = None, fast: bool = SNIFF_FAST) -> List[SniffRow]:
+        """按输入顺序返回全部结果。"""
+        got = {}
+        for row in self.sniff_iter(urls, headless, wait_ms, concurrency, fast):
+            got.setdefault(row[0], row)
+        return [got[u] for u in urls]
+
+    async def _aclose(self):
+        for t in self.tiers:
+            await t.aclose()
+        for b in list(self._browsers.values()):
+            try:
+                await b.close()
+            except Exception:
+                pass
+        self._browsers.clear()
+        if self._pw is not None:
+            await self._pw.stop()
+            self._pw = None
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._aclose(), loop).result(timeout=10)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+
+_POOL: Optional[BrowserPool] = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool() -> BrowserPool:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = BrowserPool()
+            register_gauge("sniff_waiting", lambda: _POOL.waiting)
+            register_gauge("sniff_active", lambda: _POOL.active)
+        return _POOL
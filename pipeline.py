@@ -0,0 +1,257 @@
+# pipeline.py
+"""
+边下边抽帧：直链按小段顺序下载写入 .direct.part（见 PIPE_PIECE），同时把“从头连续已落盘”的字节
+喂给 ffmpeg 的 stdin，下载结束时抽帧也基本结束，总耗时接近 max(下载, 解码) 而不是两者之和。
+只有 moov 在前的 MP4（faststart / fragmented）能从管道里边收边解；
+开头就遇到 mdat（moov 在文件尾）时不启动 ffmpeg，下载完再按普通流程抽帧。
+"""
+from __future__ import annotations
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from config import FRAMES, DL_CHUNK, PIPE_PIECE
+import downloader
+import link_cache
+from downloader import Progress
+from extractor import _clamp_step, _ffmpeg_cmd, adopt_work_dir, extract_frames, frame_opts
+from metrics import span, timed
+from state_store import PAGE_TO_PATH
+from utils import find_existing_by_code, pick_platform_and_code, refresh_code, target_path_for
+
+STREAMABLE, MOOV_LAST, UNKNOWN = "streamable", "moov_last", "unknown"
+
+class _BoxSniffer:
+    """
+    随着已落盘的前缀变长，逐个读顶层 box 头：
+    先见到 moov/moof -> 可流式解码；先见到 mdat -> moov 在尾部；开头不是 ftyp -> 不是 MP4，交给 ffmpeg 试。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.layout: Optional[str] = None
+        self._next = 0  # 下一个顶层 box 的起始偏移
+
+    def feed(self, avail: int) -> Optional[str]:
+        if self.layout:
+            return self.layout
+        with open(self.path, "rb") as f:
+            while self.layout is None and self._next + 16 <= avail:
+                f.seek(self._next)
+                head = f.read(16)
+                size, typ = int.from_bytes(head[:4], "big"), head[4:8]
+                if size == 1:
+                    size = int.from_bytes(head[8:16], "big")
+                if typ in (b"moov", b"moof"):
+                    self.layout = STREAMABLE
+                elif typ == b"mdat":
+                    self.layout = MOOV_LAST
+                elif (self._next == 0 and typ != b"ftyp") or size < 8:
+                    self.layout = UNKNOWN
+                else:
+                    self._next += size
+        return self.layout
+
+def _prefix(meta: Optional[dict], done: int) -> int:
+    """从文件头开始连续写好的字节数；单流下载（没有分段 sidecar）时就是已下载字节数。"""
+    if meta is None:
+        return done
+    n = 0
+    for g in meta["segments"]:
+        if g["start"] != n:
+            break
+        n += g["done"]
+        if g["start"] + g["done"] <= g["end"]:
+            break
+    return n
+
+class _Feeder(threading.Thread):
+    """
+    从正在写入的 .part 文件里读出已连续落盘的字节写进 ffmpeg stdin。
+    文件本身就是缓冲区：ffmpeg 慢了只是落后，不会拖慢下载，也不会占用额外内存。
+    每次现开现关文件，下载完成改名后从最终文件接着读。
+    """
+
+    def __init__(self, paths: List[Path], proc: subprocess.Popen):
+        super().__init__(name="pipeline-feed", daemon=True)
+        self.paths = paths
+        self.proc = proc
+        self.avail = 0            # 可以安全读取的前缀长度
+        self.finished = False     # 下载结束（成功或失败）
+        self.cond = threading.Condition()
+
+    def advance_to(self, n: int):
+        with self.cond:
+            if n > self.avail:
+                self.avail = n
+                self.cond.notify()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify()
+
+    def _open(self):
+        for p in self.paths:
+            try:
+                return open(p, "rb")
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(self.paths[-1])
+
+    def run(self):
+        fed = 0
+        try:
+            while True:
+                with self.cond:
+                    while fed >= self.avail and not self.finished:
+                        self.cond.wait()
+                    avail, done = self.avail, self.finished
+                if fed < avail:
+                    with self._open() as f:
+                        f.seek(fed)
+                        while fed < avail:
+                            data = f.read(min(DL_CHUNK, avail - fed))
+                            if not data:
+                                break
+                            self.proc.stdin.write(data)
+                            fed += len(data)
+                if done and fed >= avail:
+                    break
+        except (BrokenPipeError, OSError, ValueError):
+            pass  # ffmpeg 提前退出（出错或被终止），以它的返回码为准
+        finally:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+
+def _sequential(direct_url: Optional[str], page_url: Optional[str], step: int, extract_kw: dict,
+                progress: Optional[Progress], cancel: Optional[threading.Event], why: str) -> Tuple[bool, str, str]:
+    ok, path, log = downloader.download_video(direct_url, page_url, progress, cancel)
+    if not ok or not path:
+        return False, "", f"{why}；下载失败：{log}"
+    ok2, zip_path, log2 = extract_frames(path, step, **extract_kw)
+    return ok2, zip_path, f"{why}；下载：{log}；{log2}"
+
+@timed("pipeline.total")
+def download_and_extract(direct_url: Optional[str], page_url: Optional[str], step_sec: int,
+                         progress: Optional[Progress] = None, cancel: Optional[threading.Event] = None,
+                         **extract_kw) -> Tuple[bool, str, str]:
+    """
+    下载并抽帧，能流水线就流水线。extract_kw 同 extract_frames 的输出参数（fmt / max_width / max_height /
+    quality / scene / dedup）。视频已在本地、没有直链、moov 在尾部或流式解码失败时退回“先下载再抽帧”。
+    返回: (ok, zip_path_or_err, log)；成功后与 download_video 一样写入 PAGE_TO_PATH。
+    """
+    step = _clamp_step(step_sec)
+    pf, code, msg = pick_platform_and_code(page_url, direct_url, resolve=True)
+    if pf != "douyin" or not code:
+        return False, "", f"不支持的平台或无法提取编码：{msg}"
+    try:
+        opts = frame_opts(extract_kw.get("fmt", "jpg"), (extract_kw.get("max_width", 0), extract_kw.get("max_height", 0)),
+                          False, extract_kw.get("quality"), extract_kw.get("scene", 0.0), extract_kw.get("dedup"))
+    except ValueError as e:
+        return False, "", str(e)
+    key = f"{pf}:{code}"
+    claimed = downloader.try_claim(key)  # 与任务队列 / async 接口互斥，见 downloader.try_claim
+    existing = find_existing_by_code(pf, code)
+    if existing or not claimed:
+        if claimed:
+            downloader.release(key)
+        if not existing:  # 别处正在下同一个视频：download_video 会等它下完
+            return _sequential(direct_url, page_url, step, extract_kw, progress, cancel, "该视频正在别处下载，下完后抽帧")
+        if page_url:
+            PAGE_TO_PATH[page_url] = str(existing)
+        ok, zip_path, log = extract_frames(str(existing), step, **extract_kw)
+        return ok, zip_path, f"视频已存在；{log}"
+    from_cache = False
+    if not direct_url and page_url:
+        direct_url = link_cache.lookup(page_url)
+        from_cache = bool(direct_url)
+    if not direct_url:
+        downloader.release(key)
+        return _sequential(None, page_url, step, extract_kw, progress, cancel, "无直链，先下载再抽帧")
+
+    target = target_path_for(pf, code, "mp4")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    part, _meta_path = downloader._part_paths(target)
+    work = FRAMES / f".work-pipe-{uuid.uuid4().hex[:6]}"
+    work.mkdir(parents=True, exist_ok=True)
+    log_path = work / ".ffmpeg.log"
+
+    sniffer = _BoxSniffer(part)
+    state = {"meta": None, "proc": None, "feeder": None}
+
+    def start_ffmpeg() -> _Feeder:
+        with open(log_path, "wb") as log_f:
+            proc = subprocess.Popen(_ffmpeg_cmd("pipe:0", work, step, opts),
+                                    stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log_f)
+        feeder = _Feeder([part, target], proc)
+        feeder.start()
+        state["proc"], state["feeder"] = proc, feeder
+        return feeder
+
+    def on_progress(done: int, total: Optional[int]):
+        avail = _prefix(state["meta"], done)
+        feeder = state["feeder"]
+        if feeder is None and sniffer.layout is None and sniffer.feed(avail) in (STREAMABLE, UNKNOWN):
+            feeder = start_ffmpeg()
+        if feeder is not None:
+            feeder.advance_to(avail)
+        if progress:
+            progress(done, total)
+
+    t0 = time.perf_counter()
+    try:
+        try:
+            ok, path, dl_log = downloader._try_direct(direct_url, target, on_progress, cancel, PIPE_PIECE,
+                                                      lambda meta: state.update(meta=meta))
+        finally:
+            downloader.release(key)  # 之后的回退走 download_video，会自己再占
+            if state["feeder"] is not None:
+                state["feeder"].finish()
+        if not ok or not path:
+            if cancel is not None and cancel.is_set():
+                return False, "", "cancelled"
+            if from_cache:
+                link_cache.forget(page_url)  # 缓存的直链已不可用
+            # 直链失效等：走原来的下载流程（传入的直链会按 .part 续传，必要时回退 yt-dlp）
+            return _sequential(None if from_cache else direct_url, page_url, step, extract_kw,
+                               progress, cancel, f"边下边抽失败（{dl_log}）")
+        t_dl = time.perf_counter() - t0
+        refresh_code(pf, code)
+        if page_url:
+            PAGE_TO_PATH[page_url] = str(path)
+        dl_note = f"下载：{dl_log}{' (cached link)' if from_cache else ''}"
+
+        proc = state["proc"]
+        if proc is None:
+            ok, zip_path, log = extract_frames(str(path), step, **extract_kw)
+            why = "moov 在文件尾，下载完成后抽帧" if sniffer.layout == MOOV_LAST else "未能识别容器，下载完成后抽帧"
+            return ok, zip_path, f"{why}；{dl_note}；{log}"
+        with span("pipeline.decode_tail"):  # 下载完后还要等解码多久，越小说明重叠得越好
+            while proc.poll() is None:
+                if cancel is not None and cancel.is_set():
+                    return False, "", "cancelled"  # finally 里杀掉 ffmpeg
+                try:
+                    proc.wait(timeout=0.2)
+                except subprocess.TimeoutExpired:
+                    pass
+            rc = proc.returncode
+            state["feeder"].join()
+        if rc != 0:
+            ok, zip_path, log = extract_frames(str(path), step, **extract_kw)
+            return ok, zip_path, f"流式解码失败，已改为下载后抽帧；{dl_note}；{log}"
+        zip_path, log = adopt_work_dir(work, str(path), step, opts, t0)
+        total = time.perf_counter() - t0
+        return True, zip_path, f"边下边抽：下载用时 {t_dl:.1f}s，总计 {total:.1f}s；{dl_note}；{log}"
+    finally:
+        proc = state["proc"]
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        shutil.rmtree(work, ignore_errors=True)
@@ -0,0 +1,153 @@
+# short_links.py
+"""
+抖音短链（https://v.douyin.com/<短码>/）-> 数字视频 ID，不开浏览器：
+用连接池里的 HEAD 逐跳跟随 302（服务端不接受 HEAD 时改 GET，只读响应头），Location 里一出现 /video/<id> 就停；
+跳到底还没有 ID 时读最终页面开头一段找 canonical 链接。
+映射不会变，存在 state/index.sqlite3 的 short_links 表；解析失败（断网等）在 SHORT_LINK_RETRY_SEC 内不再重试，
+调用方先按短码处理。下载前 utils.pick_platform_and_code(resolve=True) 经这里换成数字 ID，所以视频文件都按数字 ID 命名；
+其余查找默认只查索引库里已有的映射，不联网。
+migrate_short_files()：把早先按短码保存的视频改名为数字 ID，已有同 ID 文件的视为重复下载，删掉多余的那份。
+"""
+from __future__ import annotations
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import link_cache
+from config import UA, SHORT_LINK_TIMEOUT, SHORT_LINK_MAX_HOPS, SHORT_LINK_RETRY_SEC
+from metrics import cache_hit, cache_miss, span
+from state_store import STORE
+from utils import PLATFORM_DIRS, _TEMP_SUFFIXES, find_existing_by_code, refresh_code
+
+# 跳转地址 / 页面里可能出现的数字 ID 形式
+_ID_PATTERNS = (
+    re.compile(r"/(?:share/)?(?:video|note|slides)/(\d{8,})"),
+    re.compile(r"[?&](?:modal_id|aweme_id|item_ids?)=(\d{8,})"),
+)
+_PAGE_PEEK = 256 * 1024  # 最终页面最多读这么多字节找 ID
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+_FAILED: Dict[str, float] = {}  # 短码 -> 上次解析失败的时间（monotonic）
+_FAILED_LOCK = threading.Lock()
+
+def _session() -> requests.Session:
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update({"User-Agent": UA})
+            _SESSION = s
+        return _SESSION
+
+def id_in(text: str) -> Optional[str]:
+    for pat in _ID_PATTERNS:
+        m = pat.search(text or "")
+        if m:
+            return m.group(1)
+    return None
+
+def follow(url: str) -> Optional[str]:
+    """逐跳跟随短链跳转，返回数字视频 ID；拿不到返回 None，网络错误抛 requests.RequestException。"""
+    s = _session()
+    for _ in range(SHORT_LINK_MAX_HOPS + 1):
+        vid = id_in(url)
+        if vid:
+            return vid
+        r = s.head(url, allow_redirects=False, timeout=SHORT_LINK_TIMEOUT)
+        if r.is_redirect:
+            url = urljoin(url, r.headers["Location"])
+            continue
+        # 不支持 HEAD 或已到最终页：GET 一次，跳转就继续，否则在页面开头找 canonical 链接
+        with s.get(url, allow_redirects=False, stream=True, timeout=SHORT_LINK_TIMEOUT) as g:
+            if g.is_redirect:
+                url = urljoin(url, g.headers["Location"])
+                continue
+            if not g.ok:
+                return None
+            head = b""
+            for chunk in g.iter_content(64 * 1024):
+                head += chunk
+                if len(head) >= _PAGE_PEEK:
+                    break
+            return id_in(head.decode("utf-8", errors="replace"))
+    return None
+
+def resolve_short(platform: str, short: str, url: Optional[str] = None) -> Optional[str]:
+    """短码 -> 数字 ID：先查持久化映射，没有再联网跟随跳转；失败返回 None（短时间内不重试）。"""
+    canon = STORE.get_canonical(platform, short)
+    if canon:
+        cache_hit("short_link")
+        return canon
+    cache_miss("short_link")
+    with _FAILED_LOCK:
+        failed = _FAILED.get(short)
+    if failed is not None and time.monotonic() - failed < SHORT_LINK_RETRY_SEC:
+        return None
+    try:
+        with span("resolve.short_link"):
+            vid = follow(url or f"https://v.douyin.com/{short}/")
+    except requests.RequestException:
+        vid = None
+    if vid:
+        STORE.put_canonical(platform, short, vid)
+        link_cache.rekey(platform, short, vid)  # 之前按短码缓存的直链改挂到 ID 上
+        with _FAILED_LOCK:
+            _FAILED.pop(short, None)
+    else:
+        with _FAILED_LOCK:
+            _FAILED[short] = time.monotonic()
+    return vid
+
+def resolve_many(shorts: Iterable[str], platform: str = "douyin", concurrency: int = 8) -> Dict[str, Optional[str]]:
+    """并发解析一批短码（各自一条池化连接），返回 {短码: 数字 ID 或 None}。"""
+    todo: List[str] = list(dict.fromkeys(shorts))
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(todo) or 1)), thread_name_prefix="short-link") as ex:
+        return dict(zip(todo, ex.map(lambda c: resolve_short(platform, c), todo)))
+
+def migrate_short_files(platform: str = "douyin") -> Dict[str, int]:
+    """
+    videos/<platform>/ 里文件名不是数字 ID 的（早先按短码保存的）：解析出 ID 后改名为 <ID>.<ext>；
+    已有同 ID 的文件时这份是重复下载，删除，索引里指向它的链接改指那份。解析不了的留着，下次启动再试。
+    """
+    stats = {"renamed": 0, "duplicates": 0, "unresolved": 0}
+    d = PLATFORM_DIRS[platform]
+    if not d.exists():
+        return stats
+    files = [Path(e.path) for e in os.scandir(d)
+             if e.is_file() and not e.name.startswith(".") and "." in e.name and not e.name.endswith(_TEMP_SUFFIXES)
+             and not e.name.split(".", 1)[0].isdigit()]
+    if not files:
+        return stats
+    ids = resolve_many({p.name.split(".", 1)[0] for p in files}, platform)
+    for p in files:
+        short, ext = p.name.split(".", 1)
+        vid = ids.get(short)
+        if not vid:
+            stats["unresolved"] += 1
+            continue
+        existing = find_existing_by_code(platform, vid)
+        if existing and existing != p:
+            STORE.move_file(str(p), str(existing))
+            p.unlink(missing_ok=True)
+            stats["duplicates"] += 1
+        else:
+            new = p.with_name(f"{vid}.{ext}")
+            os.replace(p, new)
+            STORE.move_file(str(p), str(new))
+            refresh_code(platform, vid)
+            stats["renamed"] += 1
+        refresh_code(platform, short)
+    return stats
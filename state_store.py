@@ -1,6 +1,328 @@
 # state_store.py
+"""
+持久化索引（SQLite，WAL 模式），替代原来的进程内 dict：
+- page_keys：page_url / local:// 虚拟 key -> 文件路径
+- files    ：文件路径 -> 平台、编码、大小、mtime、sha1
+- dirs     ：videos/<platform>/ 的目录 mtime，用于增量对账
+- short_links：短链短码 -> 数字视频 ID（见 short_links.py），跳转关系不会变，永久保存
+每个线程一条连接；写操作走 BEGIN IMMEDIATE，多线程/多进程并发写都安全。
+"""
 from __future__ import annotations
-from typing import Dict
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, MutableMapping, Optional
 
-# 记录：page_url -> last_downloaded_path
-PAGE_TO_PATH: Dict[str, str] = {}
\ No newline at end of file
+from config import STATE_DB, VIDEOS
+from utils import pick_platform_and_code
+
+# 下载中的临时文件、sidecar 等不入索引
+_SKIP_SUFFIXES = (".part", ".ytdl", ".json", ".tmp")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    platform TEXT,
+    code     TEXT,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1     TEXT,
+    updated  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_code ON files(platform, code);
+CREATE TABLE IF NOT EXISTS page_keys (
+    key     TEXT PRIMARY KEY,
+    path    TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_page_keys_path ON page_keys(path);
+CREATE TABLE IF NOT EXISTS dirs (
+    path     TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS short_links (
+    platform  TEXT NOT NULL,
+    short     TEXT NOT NULL,
+    canonical TEXT NOT NULL,
+    updated   REAL NOT NULL,
+    PRIMARY KEY (platform, short)
+);
+"""
+
+def file_sha1(path: Path, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(bufsize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _platform_code(p: Path):
+    # videos/<platform>/<code>.<ext> 才有平台与编码；本地上传的文件两者为空
+    try:
+        rel = p.relative_to(VIDEOS)
+    except ValueError:
+        return None, None
+    if len(rel.parts) != 2:
+        return None, None
+    return rel.parts[0], p.stem
+
+class StateStore:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = c
+        return c
+
+    @contextlib.contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+
+    # ---------- 文件 ----------
+    def _upsert_file(self, c: sqlite3.Connection, p: Path, st: os.stat_result, sha1: Optional[str]):
+        pf, code = _platform_code(p)
+        c.execute(
+            "INSERT INTO files(path, platform, code, size, mtime_ns, sha1, updated) VALUES (?,?,?,?,?,?,?) "
+            "ON CONFLICT(path) DO UPDATE SET platform=excluded.platform, code=excluded.code, "
+            "size=excluded.size, mtime_ns=excluded.mtime_ns, sha1=excluded.sha1, updated=excluded.updated",
+            (str(p), pf, code, st.st_size, st.st_mtime_ns, sha1, time.time()),
+        )
+
+    def record_file(self, path: str, sha1: Optional[str] = None) -> Optional[dict]:
+        """登记（或刷新）一个文件；大小/mtime 未变时沿用已有哈希，不重复计算。"""
+        p = Path(path).resolve()
+        try:
+            st = p.stat()
+        except OSError:
+            return None
+        old = self.file_info(str(p))
+        unchanged = bool(old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns and old["sha1"])
+        if unchanged and sha1 in (None, old["sha1"]):
+            return old
+        if sha1 is None:
+            sha1 = file_sha1(p)
+        with self._tx() as c:
+            self._upsert_file(c, p, st, sha1)
+        return self.file_info(str(p))
+
+    def file_info(self, path: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT path, platform, code, size, mtime_ns, sha1 FROM files WHERE path=?", (str(path),)
+        ).fetchone()
+        if not row:
+            return None
+        return dict(zip(("path", "platform", "code", "size", "mtime_ns", "sha1"), row))
+
+    def find_by_code(self, platform: str, code: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT path FROM files WHERE platform=? AND code=? ORDER BY mtime_ns DESC LIMIT 1",
+            (platform, code),
+        ).fetchone()
+        return row[0] if row else None
+
+    def move_file(self, old: str, new: str):
+        """文件改名后（如短码迁移为数字 ID）：把指向旧路径的 key 改指新路径，沿用已算好的哈希。"""
+        o, n = str(Path(old).resolve()), str(Path(new).resolve())
+        info = self.file_info(o)
+        with self._tx() as c:
+            c.execute("UPDATE page_keys SET path=?, updated=? WHERE path=?", (n, time.time(), o))
+            c.execute("DELETE FROM files WHERE path=?", (o,))
+        if self.file_info(n) is None and info:
+            self.record_file(n, info["sha1"])  # 改名不改内容
+        else:
+            self.record_file(n)
+
+    def forget_file(self, path: str):
+        """文件被删掉后：连同指向它的 key 一起移出索引（与 reconcile 发现文件消失时的处理相同）。"""
+        p = str(Path(path).resolve())
+        with self._tx() as c:
+            c.execute("DELETE FROM files WHERE path=?", (p,))
+            c.execute("DELETE FROM page_keys WHERE path=?", (p,))
+
+    # ---------- 短链 ----------
+    def get_canonical(self, platform: str, short: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT canonical FROM short_links WHERE platform=? AND short=?", (platform, short)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_canonical(self, platform: str, short: str, canonical: str):
+        with self._tx() as c:
+            c.execute(
+                "INSERT INTO short_links(platform, short, canonical, updated) VALUES (?,?,?,?) "
+                "ON CONFLICT(platform, short) DO UPDATE SET canonical=excluded.canonical, updated=excluded.updated",
+                (platform, short, canonical, time.time()),
+            )
+
+    # ---------- page_url / local:// ----------
+    def get_path(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT path FROM page_keys WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_key(self, key: str, path: str):
+        p = str(Path(path).resolve())
+        if self.get_path(key) == p:
+            self.record_file(p)
+            return
+        with self._tx() as c:
+            c.execute(
+                "INSERT INTO page_keys(key, path, updated) VALUES (?,?,?) "
+                "ON CONFLICT(key) DO UPDATE SET path=excluded.path, updated=excluded.updated",
+                (key, p, time.time()),
+            )
+        self.record_file(p)
+
+    def del_key(self, key: str) -> bool:
+        with self._tx() as c:
+            return c.execute("DELETE FROM page_keys WHERE key=?", (key,)).rowcount > 0
+
+    def keys(self):
+        return [r[0] for r in self._conn().execute("SELECT key FROM page_keys")]
+
+    def count_keys(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM page_keys").fetchone()[0]
+
+    # ---------- 启动对账 ----------
+    def reconcile(self, root: Path = VIDEOS) -> Dict[str, int]:
+        """
+        把 videos/<platform>/ 与索引对齐：目录 mtime 没变就整目录跳过；
+        变了再逐个比对 size/mtime，只对新增或变化的文件算哈希，消失的文件连同指向它的 key 一并删除。
+        """
+        stats = {"dirs_skipped": 0, "added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        if not root.exists():
+            return stats
+        c = self._conn()
+        for d in sorted(p for p in root.iterdir() if p.is_dir()):
+            d = d.resolve()
+            d_mtime = d.stat().st_mtime_ns
+            row = c.execute("SELECT mtime_ns FROM dirs WHERE path=?", (str(d),)).fetchone()
+            if row and row[0] == d_mtime:
+                stats["dirs_skipped"] += 1
+                continue
+
+            lo = str(d) + os.sep
+            hi = str(d) + chr(ord(os.sep) + 1)
+            known = {
+                r[0]: (r[1], r[2])
+                for r in c.execute("SELECT path, size, mtime_ns FROM files WHERE path >= ? AND path < ?", (lo, hi))
+                if Path(r[0]).parent == d
+            }
+            seen = set()
+            with os.scandir(d) as it:
+                for e in it:
+                    if not e.is_file() or e.name.startswith(".") or e.name.endswith(_SKIP_SUFFIXES):
+                        continue
+                    p = Path(e.path)
+                    st = e.stat()
+                    seen.add(str(p))
+                    old = known.get(str(p))
+                    if old == (st.st_size, st.st_mtime_ns):
+                        stats["unchanged"] += 1
+                        continue
+                    try:
+                        sha1 = file_sha1(p)
+                    except OSError:
+                        continue
+                    with self._tx() as tx:
+                        self._upsert_file(tx, p, st, sha1)
+                    stats["updated" if old else "added"] += 1
+
+            gone = [p for p in known if p not in seen]
+            with self._tx() as tx:
+                for p in gone:
+                    tx.execute("DELETE FROM files WHERE path=?", (p,))
+                    tx.execute("DELETE FROM page_keys WHERE path=?", (p,))
+                tx.execute(
+                    "INSERT INTO dirs(path, mtime_ns) VALUES (?,?) "
+                    "ON CONFLICT(path) DO UPDATE SET mtime_ns=excluded.mtime_ns",
+                    (str(d), d_mtime),
+                )
+            stats["removed"] += len(gone)
+        return stats
+
+class PageIndex(MutableMapping):
+    """兼容原 PAGE_TO_PATH 的 dict 用法（in / get / [] / []=），底层读写 SQLite。"""
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    def __getitem__(self, key: str) -> str:
+        p = self.store.get_path(key)
+        if p is None:
+            raise KeyError(key)
+        return p
+
+    def __setitem__(self, key: str, path: str):
+        self.store.put_key(key, path)
+
+    def __delitem__(self, key: str):
+        if not self.store.del_key(key):
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return self.store.get_path(key) is not None
+
+    def __iter__(self):
+        return iter(self.store.keys())
+
+    def __len__(self) -> int:
+        return self.store.count_keys()
+
+STORE = StateStore(STATE_DB)
+
+# 记录：page_url / local:// -> last_downloaded_path
+PAGE_TO_PATH: MutableMapping[str, str] = PageIndex(STORE)
+
+def resolve_page(page_url: str) -> Optional[str]:
+    """
+    先查 page_key；查不到再按平台+编码在文件索引里找（重启后从未记录过该链接、但视频已在盘上）。
+    """
+    vp = STORE.get_path(page_url)
+    if vp and Path(vp).exists():
+        return vp
+    pf, code, _ = pick_platform_and_code(page_url, None)
+    if pf and code:
+        found = STORE.find_by_code(pf, code)
+        if found and Path(found).exists():
+            STORE.put_key(page_url, found)
+            return found
+    return vp
+
+def start_reconcile() -> threading.Thread:
+    """后台对账，不阻塞启动；之后把按短码保存的旧文件迁移成数字 ID（需要联网解析短链）。"""
+    def _run():
+        try:
+            s = STORE.reconcile()
+            print(f"[state_store] reconcile: {s}")
+        except Exception as e:
+            print(f"[state_store] reconcile failed: {e}")
+        try:
+            from short_links import migrate_short_files
+            s = migrate_short_files()
+            if any(s.values()):
+                print(f"[state_store] short-code files: {s}")
+        except Exception as e:
+            print(f"[state_store] short-code migration failed: {e}")
+    t = threading.Thread(target=_run, name="state-reconcile", daemon=True)
+    t.start()
+    return t
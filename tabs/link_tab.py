@@ -1,23 +1,84 @@
 # tabs/link_tab.py
 from __future__ import annotations
-import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import gradio as gr
 
-Row = List[str]  # [page_url, direct_url, status]
+Row = List[str]  # [page_url, direct_url, status, extract_note]
+Out = Tuple[int, str, float, float, float]  # 抽帧间隔, fmt, max_w, max_h, quality（界面上的输出参数）
 RUNNING = False  # 简单互斥
 
+# 状态筛选项（服务端按状态前缀过滤，只把当前页发给浏览器）
+FILTERS = ["全部", "未下载", "已下载", "失败", "进行中", "待解析"]
+# 批量操作的范围：几千条时不必逐个勾选，按筛选结果或序号区间整批操作
+SCOPES = ["勾选的行（当前页）", "当前筛选结果（全部页）", "序号范围"]
+_FAIL_NOTES_MAX = 20  # 抽帧失败详情最多列出多少条
+
+def _category(status: str) -> str:
+    if status.startswith("✅ 已下载"):
+        return "已下载"
+    if status.startswith("❌"):
+        return "失败"
+    if status.startswith(("⬇️", "⏳ 排队")):
+        return "进行中"
+    if status.startswith("⏳"):
+        return "待解析"
+    return "其它"  # 解析成功、已取消等
+
+def _match(row: Row, flt: str) -> bool:
+    if flt == "全部":
+        return True
+    cat = _category(row[2])
+    if flt == "未下载":
+        return cat != "已下载"
+    return cat == flt
+
+def _parse_ranges(text: str, n: int) -> List[int]:
+    """“1-200, 305” -> 0 起的行号（去重、保持顺序），超出范围的忽略。"""
+    out: Dict[int, None] = {}
+    for a, b in re.findall(r"(\d+)\s*(?:[-~～]\s*(\d+))?", text or ""):
+        lo, hi = int(a), int(b or a)
+        if lo > hi:
+            lo, hi = hi, lo
+        for k in range(max(1, lo), min(n, hi) + 1):
+            out[k - 1] = None
+    return list(out)
+
+class _Every:
+    """节流：距上次放行不足 sec 秒时返回 False；进行中的任务据此限制整页重绘的频率。"""
+
+    def __init__(self, sec: float):
+        self.sec = sec
+        self.last = 0.0
+
+    def __call__(self) -> bool:
+        now = time.monotonic()
+        if now - self.last < self.sec:
+            return False
+        self.last = now
+        return True
+
 def build_link_tab(CTX: dict):
     STEP_MIN = CTX["STEP_MIN"]
     STEP_MAX = CTX["STEP_MAX"]
     PAGE_TO_PATH = CTX["PAGE_TO_PATH"]
-    sniff_serial = CTX["sniff_serial"]
-    download_video = CTX["download_video"]
+    sniff_pool = CTX["sniff_pool"]
+    SNIFF_CONCURRENCY = CTX["SNIFF_CONCURRENCY"]
+    SNIFF_FAST = CTX["SNIFF_FAST"]
+    PAGE_SIZE = CTX["LINK_PAGE_SIZE"]
+    REFRESH_SEC = CTX["LINK_REFRESH_SEC"]
+    JOBS = CTX["JOBS"]
     detect_platform = CTX["detect_platform"]
     extract_code = CTX["extract_code"]
     find_existing_by_code = CTX["find_existing_by_code"]
+    lookup_direct = CTX["lookup_direct"]
+    remember_direct = CTX["remember_direct"]
+    extract_query = CTX["extract_query"]
 
     EXAMPLES = [
         "https://v.douyin.com/nZasikV8ea4/",
@@ -25,26 +86,57 @@ def build_link_tab(CTX: dict):
     ]
 
     # ---------- 工具 ----------
+    def _code_of(u: str) -> Tuple[str, Optional[str]]:
+        pf = detect_platform(u) or "douyin"
+        return pf, extract_code(pf, u, resolve=True)
+
     def precheck_rows(urls: List[str]) -> Tuple[List[Row], List[str]]:
+        # 短链换视频 ID 要联网，几千条时并发做
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="link-precheck") as ex:
+            codes = list(ex.map(_code_of, urls))
         rows, to_parse = [], []
-        for u in urls:
-            pf = detect_platform(u) or "douyin"
-            code = extract_code(pf, u) if pf else None
+        for u, (pf, code) in zip(urls, codes):
             existing = find_existing_by_code(pf, code) if (pf and code) else None
             if existing:
                 PAGE_TO_PATH[u] = str(existing)
-                rows.append([u, "", f"✅ 已下载 · {existing.name}"])
+                rows.append([u, "", f"✅ 已下载 · {existing.name}", ""])
+                continue
+            cached = lookup_direct(u)
+            if cached:
+                rows.append([u, cached, "✅ 解析成功 · 缓存", ""])
             else:
-                rows.append([u, "", "⏳ 待解析"])
+                rows.append([u, "", "⏳ 待解析", ""])
                 to_parse.append(u)
         return rows, to_parse
 
+    def _mb(n: Optional[float]) -> str:
+        return f"{(n or 0) / 1048576:.1f} MiB"
+
+    def _job_status(job) -> str:
+        if job.state == "queued":
+            return "⏳ 排队中…"
+        if job.state == "running":
+            pct = job.percent
+            parts = [f"{pct:.0f}%" if pct is not None else _mb(job.bytes_done)]
+            if job.rate:
+                parts.append(f"{_mb(job.rate)}/s")
+            if job.eta is not None:
+                parts.append(f"ETA {job.eta:.0f}s")
+            return "⬇️ 下载中 · " + " · ".join(parts)
+        if job.state == "done" and job.path:
+            return f"✅ 已下载 · {Path(job.path).name}"
+        if job.state == "cancelled":
+            return "⏹ 已取消"
+        return "❌ 下载失败"
+
     def _short(u: str, n: int = 28) -> str:
         return (u[:n] + "…") if len(u) > n else u
 
-    def build_table(rows: List[Row], step_val: int) -> str:
+    def build_table(rows: List[Row], indices: List[int], out: Out) -> str:
+        """只渲染 indices 指定的行（当前页），序号仍是整批里的行号；“抽帧”链接带上所选输出参数。"""
         from urllib.parse import quote
-        step_val = max(STEP_MIN, min(STEP_MAX, int(step_val or 1)))
+        step_val = max(STEP_MIN, min(STEP_MAX, int(out[0] or 1)))
+        qs = extract_query(step_val, *out[1:])
         html = [
             "<table style='border-collapse:collapse;width:100%;font-size:14px'>",
             "<thead><tr>",
@@ -55,16 +147,17 @@ def build_link_tab(CTX: dict):
             f"<th style='border:1px solid #ddd;padding:8px'>抽帧（每 {step_val}s）</th>",
             "</tr></thead><tbody>",
         ]
-        for i, (u, direct, status) in enumerate(rows, 1):
+        for i in indices:
+            u, direct, status, note = rows[i]
             orig = f'<a href="{u}" target="_blank" rel="noopener">原始</a>'
             dspan = (f'<a href="{direct}" target="_blank" rel="noopener">直链</a>' if direct
                      else "<span style='color:#999'>待解析</span>")
             can_extract = (u in PAGE_TO_PATH)
-            ex = (f'<a href="/api/extract_by_page?page_url={quote(u, safe="")}&step={step_val}" target="_blank">抽帧</a>'
-                  if can_extract else "<span style='color:#999'>请先下载</span>")
+            ex = note or (f'<a href="/api/extract_by_page?page_url={quote(u, safe="")}&{qs}" target="_blank">抽帧</a>'
+                          if can_extract else "<span style='color:#999'>请先下载</span>")
             html.append(
                 "<tr>"
-                f"<td style='border:1px solid #ddd;padding:8px'>{i}</td>"
+                f"<td style='border:1px solid #ddd;padding:8px'>{i + 1}</td>"
                 f"<td style='border:1px solid #ddd;padding:8px'>{orig}</td>"
                 f"<td style='border:1px solid #ddd;padding:8px;word-break:break-all'>{dspan}</td>"
                 f"<td style='border:1px solid #ddd;padding:8px'>{status}</td>"
@@ -74,183 +167,320 @@ def build_link_tab(CTX: dict):
         html.append("</tbody></table>")
         return "\n".join(html)
 
+    # ---------- 分页视图 ----------
+    # view（gr.State 里的 dict）记录当前页码与筛选，翻页时原地修改；
+    # 进行中的解析 / 下载 / 抽帧每次刷新都按它重绘，所以任务跑着也能翻页、换筛选
+    def _filtered(rows: List[Row], flt: str) -> List[int]:
+        return [i for i, r in enumerate(rows) if _match(r, flt)]
+
+    def _page_indices(rows: List[Row], view: dict) -> Tuple[List[int], int, int]:
+        idx = _filtered(rows, view["filter"])
+        pages = max(1, -(-len(idx) // PAGE_SIZE))
+        view["page"] = min(max(1, int(view["page"] or 1)), pages)
+        start = (view["page"] - 1) * PAGE_SIZE
+        return idx[start:start + PAGE_SIZE], len(idx), pages
+
+    def render(rows: List[Row], view: dict, out: Out) -> Tuple[str, str]:
+        """(当前页表格 HTML, 页码与各状态计数)"""
+        if not rows:
+            return "", ""
+        shown, n_match, pages = _page_indices(rows, view)
+        counts: Dict[str, int] = {}
+        for r in rows:
+            cat = _category(r[2])
+            counts[cat] = counts.get(cat, 0) + 1
+        summary = " · ".join(f"{k} {counts[k]}" for k in FILTERS[2:] if counts.get(k))
+        info = (f"第 {view['page']}/{pages} 页 · 筛选「{view['filter']}」{n_match} 条 / 共 {len(rows)} 条"
+                + (f"（{summary}）" if summary else ""))
+        return build_table(rows, shown, out), info
+
+    def page_choices(rows: List[Row], view: dict) -> List[str]:
+        shown, _, _ = _page_indices(rows, view) if rows else ([], 0, 1)
+        return [f"{i+1}｜{_short(rows[i][0])}" for i in shown]
+
     # ---------- UI ----------
     urls_in = gr.Textbox(label="视频链接（每行一个）", value="\n".join(EXAMPLES), lines=6)
     with gr.Row():
         headless = gr.Checkbox(value=True, label="无头模式（不弹窗）")
         wait_ms = gr.Slider(3000, 20000, value=8000, step=500, label="等待时长（毫秒）")
+        concurrency = gr.Slider(1, 16, value=SNIFF_CONCURRENCY, step=1, label="并发解析数")
+        fast_mode = gr.Checkbox(value=SNIFF_FAST, label="快速模式（命中即返回，屏蔽图片/字体/样式）")
     step_slider = gr.Slider(STEP_MIN, STEP_MAX, value=1, step=1, label="抽帧间隔（秒）")
+    with gr.Row():
+        out_fmt = gr.Dropdown(["jpg", "webp", "png"], value="jpg", label="输出格式")
+        out_max_w = gr.Number(value=0, precision=0, minimum=0, label="最大宽度（0=原尺寸）")
+        out_max_h = gr.Number(value=0, precision=0, minimum=0, label="最大高度（0=原尺寸）")
+        out_quality = gr.Slider(0, 100, value=0, step=1, label="质量（0=默认；PNG 无损，忽略）")
 
     with gr.Row():
         btn_parse   = gr.Button("一键解析", variant="primary")
         btn_dl      = gr.Button("⬇️ 下载所选（批量）", variant="secondary")
         btn_extract = gr.Button("🖼️ 抽帧所选（批量）", variant="secondary")
+        btn_cancel  = gr.Button("⏹ 取消所选下载", variant="stop")
 
     with gr.Row():
         with gr.Column(scale=1, min_width=300):
-            select_multi = gr.CheckboxGroup(choices=[], label="选择多条（与右侧表格序号对应）", value=[])
+            scope = gr.Radio(SCOPES, value=SCOPES[0], label="操作范围")
+            select_multi = gr.CheckboxGroup(choices=[], label="勾选当前页的条目（与右侧表格序号对应）", value=[])
+            range_in = gr.Textbox(label="序号范围", placeholder="如 1-200, 305（操作范围选“序号范围”时生效）")
             status_note  = gr.Markdown("")
         with gr.Column(scale=5):
+            with gr.Row():
+                view_filter = gr.Dropdown(FILTERS, value=FILTERS[0], label="按状态筛选")
+                btn_prev = gr.Button("◀ 上一页", size="sm")
+                page_no = gr.Number(value=1, precision=0, minimum=1, label="页码")
+                btn_next = gr.Button("下一页 ▶", size="sm")
+            page_info = gr.Markdown("")
             results_html = gr.HTML(label="解析结果")
             extract_msg  = gr.HTML()
 
     rows_state = gr.State([])  # List[Row]
+    view_state = gr.State({"page": 1, "filter": FILTERS[0]})
+    out_inputs = [step_slider, out_fmt, out_max_w, out_max_h, out_quality]  # 顺序同 Out
+
+    # ---------- 翻页 / 筛选 ----------
+    def _show(rows: List[Row], view: dict, out: Out):
+        table, info = render(rows, view, out)
+        return table, info, gr.update(choices=page_choices(rows, view), value=[]), view["page"]
+
+    def on_filter(rows: List[Row], view: dict, flt: str, step_val: int, fmt: str, max_w, max_h, quality):
+        view["filter"], view["page"] = flt or FILTERS[0], 1
+        return _show(rows, view, (step_val, fmt, max_w, max_h, quality))
+
+    def on_page(rows: List[Row], view: dict, page, step_val: int, fmt: str, max_w, max_h, quality):
+        view["page"] = int(page or 1)
+        return _show(rows, view, (step_val, fmt, max_w, max_h, quality))
+
+    def on_prev(rows: List[Row], view: dict, step_val: int, fmt: str, max_w, max_h, quality):
+        view["page"] = int(view["page"]) - 1
+        return _show(rows, view, (step_val, fmt, max_w, max_h, quality))
+
+    def on_next(rows: List[Row], view: dict, step_val: int, fmt: str, max_w, max_h, quality):
+        view["page"] = int(view["page"]) + 1
+        return _show(rows, view, (step_val, fmt, max_w, max_h, quality))
+
+    def on_out_change(rows: List[Row], view: dict, step_val: int, fmt: str, max_w, max_h, quality):
+        # 改了间隔或输出参数：重绘当前页，让“抽帧”链接跟着变（不清空勾选）
+        return render(rows, view, (step_val, fmt, max_w, max_h, quality))
+
+    view_outputs = [results_html, page_info, select_multi, page_no]
+    view_filter.change(on_filter, inputs=[rows_state, view_state, view_filter] + out_inputs, outputs=view_outputs)
+    page_no.submit(on_page, inputs=[rows_state, view_state, page_no] + out_inputs, outputs=view_outputs)
+    btn_prev.click(on_prev, inputs=[rows_state, view_state] + out_inputs, outputs=view_outputs)
+    btn_next.click(on_next, inputs=[rows_state, view_state] + out_inputs, outputs=view_outputs)
+    for comp in out_inputs:
+        comp.change(on_out_change, inputs=[rows_state, view_state] + out_inputs, outputs=[results_html, page_info])
 
     # ---------- 解析（两阶段） ----------
-    def run_batch(urls_text: str, headless_val: bool, wait_ms_val: int, step_val: int, prog=gr.Progress()):
+    def run_batch(urls_text: str, headless_val: bool, wait_ms_val: int, conc_val: int, fast_val: bool,
+                  view: dict, step_val: int, fmt: str, max_w, max_h, quality, prog=gr.Progress()):
         global RUNNING
         if RUNNING:
-            yield results_html, rows_state, select_multi, status_note
+            yield results_html, page_info, rows_state, select_multi, page_no, status_note
             return
         RUNNING = True
+        out = (step_val, fmt, max_w, max_h, quality)
         try:
             urls = [x.strip() for x in urls_text.splitlines() if x.strip()]
             if not urls:
-                yield "<p>请输入至少一个有效链接</p>", [], gr.update(choices=[], value=[]), "⚠️ 无链接"
+                yield ("<p>请输入至少一个有效链接</p>", "", [], gr.update(choices=[], value=[]),
+                       gr.update(), "⚠️ 无链接")
                 return
 
             # ① 预检查
-            rows_pre, to_parse = precheck_rows(urls)
-            table1 = build_table(rows_pre, step_val)
-            choices = [f"{i+1}｜{_short(rows_pre[i][0])}" for i in range(len(rows_pre))]
-            yield table1, rows_pre, gr.update(choices=choices, value=[]), "清单已生成"
+            rows, to_parse = precheck_rows(urls)
+            view["page"] = 1
+            table, info = render(rows, view, out)
+            yield table, info, rows, gr.update(choices=page_choices(rows, view), value=[]), 1, "清单已生成"
 
-            # ② 仅解析未下载
+            # ② 仅解析未下载：共享浏览器池并发解析，结果原地写回，按节流刷新当前页
             if not to_parse:
                 return
-            prog(0, desc="解析未下载的视频…")
-            parsed = asyncio.run(sniff_serial(to_parse, headless=headless_val, wait_ms=wait_ms_val))
-            prog(1)
-
-            dmap = {p: d for (p, d, _s) in parsed}
-            smap = {p: s for (p, d, s) in parsed}
-            merged: List[Row] = []
-            for (u, d, s) in rows_pre:
+            to_parse = list(dict.fromkeys(to_parse))
+            pending: Dict[str, List[int]] = {}
+            for i, (u, _d, s, _n) in enumerate(rows):
                 if s.startswith("⏳"):
-                    d = dmap.get(u, "")
-                    s = smap.get(u, "❌ 解析失败")
-                merged.append([u, d, s])
-
-            table2 = build_table(merged, step_val)
-            choices2 = [f"{i+1}｜{_short(merged[i][0])}" for i in range(len(merged))]
-            yield table2, merged, gr.update(choices=choices2, value=[]), "解析完成"
+                    pending.setdefault(u, []).append(i)
+            done, total, t_sum = 0, len(to_parse), 0.0
+            every = _Every(REFRESH_SEC)
+            prog(0, desc="解析未下载的视频…")
+            for (u, d, s, elapsed) in sniff_pool.sniff_iter(
+                to_parse, headless=headless_val, wait_ms=int(wait_ms_val),
+                concurrency=int(conc_val or 1), fast=bool(fast_val),
+            ):
+                done += 1
+                t_sum += elapsed
+                remember_direct(u, d)
+                for i in pending.get(u, []):
+                    rows[i] = [u, d or "", f"{s} · {elapsed:.1f}s", ""]
+                prog(done / total, desc=f"解析中 {done}/{total}")
+                if every():
+                    table, info = render(rows, view, out)
+                    yield table, info, rows, gr.update(), gr.update(), f"解析中 {done}/{total}"
+
+            note = f"解析完成：{total} 条，单条平均 {t_sum / max(1, total):.1f}s"
+            table, info = render(rows, view, out)
+            yield table, info, rows, gr.update(choices=page_choices(rows, view), value=[]), view["page"], note
         finally:
             RUNNING = False
 
     btn_parse.click(
         run_batch,
-        inputs=[urls_in, headless, wait_ms, step_slider],
-        outputs=[results_html, rows_state, select_multi, status_note],
+        inputs=[urls_in, headless, wait_ms, concurrency, fast_mode, view_state] + out_inputs,
+        outputs=[results_html, page_info, rows_state, select_multi, page_no, status_note],
         show_progress="full"
     )
 
-    # ---------- 批量下载 ----------
-    def do_download(rows: List[Row], selected_list: List[str], step_val: int):
-        if not rows:
-            return gr.update(), "请先解析", rows
-        if not selected_list:
-            return gr.update(), "请先在左侧勾选至少一条", rows
-
-        # 解析选中的序号
+    # ---------- 批量下载（后台任务队列，实时刷新进度） ----------
+    def _selected_indices(rows: List[Row], view: dict, scope_val: str, selected_list: List[str],
+                          ranges: str) -> List[int]:
+        if scope_val == SCOPES[1]:
+            return _filtered(rows, view["filter"])
+        if scope_val == SCOPES[2]:
+            return _parse_ranges(ranges, len(rows))
         indices: List[int] = []
-        for s in selected_list:
+        for s in selected_list or []:
             try:
                 idx = int(s.split("｜", 1)[0]) - 1
                 if 0 <= idx < len(rows):
                     indices.append(idx)
             except Exception:
                 pass
+        return indices
+
+    def _no_selection(rows: List[Row], scope_val: str) -> str:
+        if not rows:
+            return "请先解析"
+        if scope_val == SCOPES[1]:
+            return "当前筛选结果为空"
+        if scope_val == SCOPES[2]:
+            return "请填写有效的序号范围"
+        return "请先在左侧勾选至少一条"
+
+    def do_download(rows: List[Row], view: dict, scope_val: str, selected_list: List[str], ranges: str,
+                    step_val: int, fmt: str, max_w, max_h, quality):
+        out = (step_val, fmt, max_w, max_h, quality)
+        indices = _selected_indices(rows or [], view, scope_val, selected_list, ranges)
         if not indices:
-            return gr.update(), "选择解析失败", rows
+            yield gr.update(), gr.update(), _no_selection(rows, scope_val)
+            return
 
         # 统计哪些已下载、哪些需要下载
-        already, todo = [], []
-        for i in indices:
-            u, d, st = rows[i]
-            if u in PAGE_TO_PATH or (st.startswith("✅ 已下载")):
-                already.append(i)
-            else:
-                todo.append(i)
-
+        todo = [i for i in indices if not (rows[i][0] in PAGE_TO_PATH or rows[i][2].startswith("✅ 已下载"))]
         if not todo:
-            return build_table(rows, step_val), "所选视频全部已下载，未重复下载。", rows
-
-        # 标记下载中
-        for i in todo:
-            rows[i][2] = "⬇️ 下载中…"
+            table, info = render(rows, view, out)
+            yield table, info, "所选视频全部已下载，未重复下载。"
+            return
 
-        # 逐条下载
-        ok_cnt, fail_cnt = 0, 0
+        # 提交到任务队列（同一视频已在下载中会复用原任务）
+        jobs = {}
         for i in todo:
-            page_url, direct_url, _ = rows[i]
-            ok, path, log = download_video(direct_url or None, page_url or None)
-            if ok and path:
-                PAGE_TO_PATH[page_url] = path
-                rows[i][2] = f"✅ 已下载 · {Path(path).name}"
-                ok_cnt += 1
-            else:
-                rows[i][2] = "❌ 下载失败"
-                fail_cnt += 1
-
+            page_url, direct_url = rows[i][0], rows[i][1]
+            try:
+                jobs[i] = JOBS.submit(page_url or None, direct_url or None)
+            except Exception as e:
+                rows[i][2] = f"❌ 无法加入队列：{e}"
+
+        # 轮询进度，逐行原地更新状态，按节流重绘当前页，直到全部结束
+        every = _Every(REFRESH_SEC)
+        while True:
+            for i, job in jobs.items():
+                rows[i][2] = _job_status(job)
+            finished = [j for j in jobs.values() if j.state in ("done", "failed", "cancelled")]
+            ok_cnt = sum(1 for j in finished if j.state == "done")
+            tip = f"下载中：完成 {len(finished)}/{len(jobs)}（成功 {ok_cnt}）"
+            if len(finished) == len(jobs):
+                break
+            if every():
+                table, info = render(rows, view, out)
+                yield table, info, tip
+            time.sleep(0.5)
+
+        fail_cnt = len(jobs) - ok_cnt
         tip = f"批量下载完成：成功 {ok_cnt} 条；失败 {fail_cnt} 条。"
-        table_new = build_table(rows, step_val)
-        return table_new, tip, rows
-
+        if len(todo) < len(indices):
+            tip += f" 另有 {len(indices) - len(todo)} 条已下载，已跳过。"
+        table, info = render(rows, view, out)
+        yield table, info, tip
+
+    def do_cancel(rows: List[Row], view: dict, scope_val: str, selected_list: List[str], ranges: str):
+        urls = {rows[i][0] for i in _selected_indices(rows or [], view, scope_val, selected_list, ranges)}
+        n = 0
+        for job in JOBS.list():
+            if job.page_url in urls and JOBS.cancel(job.id):
+                n += 1
+        return f"已请求取消 {n} 个下载任务"
+
+    selection = [rows_state, view_state, scope, select_multi, range_in]
     btn_dl.click(
         do_download,
-        inputs=[rows_state, select_multi, step_slider],
-        outputs=[results_html, status_note, rows_state],
-        show_progress="full"
+        inputs=selection + out_inputs,
+        outputs=[results_html, page_info, status_note],
+        show_progress="minimal"
     )
 
-    # ---------- 批量抽帧 ----------
-    def do_extract(rows: List[Row], selected_list: List[str], step_val: int):
-        if not rows:
-            return "请先解析"
-        if not selected_list:
-            return "请先在左侧勾选至少一条"
+    btn_cancel.click(
+        do_cancel,
+        inputs=selection,
+        outputs=[status_note],
+    )
 
-        indices: List[int] = []
-        for s in selected_list:
-            try:
-                idx = int(s.split("｜", 1)[0]) - 1
-                if 0 <= idx < len(rows):
-                    indices.append(idx)
-            except Exception:
-                pass
+    # ---------- 批量抽帧 ----------
+    def do_extract(rows: List[Row], view: dict, scope_val: str, selected_list: List[str], ranges: str,
+                   step_val: int, fmt: str, max_w, max_h, quality):
+        indices = _selected_indices(rows or [], view, scope_val, selected_list, ranges)
         if not indices:
-            return "选择解析失败"
+            yield gr.update(), gr.update(), _no_selection(rows, scope_val)
+            return
 
-        not_downloaded, ok_links, fail_notes = [], [], []
         from urllib.parse import quote
-
-        for i in indices:
-            page_url, _, st = rows[i]
+        from extractor import extract_frames  # 延迟导入，避免循环
+        out = (step_val, fmt, max_w, max_h, quality)
+        qs = extract_query(*out)
+        not_downloaded, fail_notes, ok_cnt = [], [], 0
+
+        def summary(done: int) -> str:
+            parts = [f"抽帧 {done}/{len(indices)}：成功 {ok_cnt} · 失败 {len(fail_notes)}"]
+            if not_downloaded:
+                parts.append(f"⚠️ {len(not_downloaded)} 条未下载，已跳过："
+                             + "、".join(map(str, not_downloaded[:_FAIL_NOTES_MAX]))
+                             + ("…" if len(not_downloaded) > _FAIL_NOTES_MAX else ""))
+            if fail_notes:
+                parts.append("❌ 失败详情：<br>" + "<br>".join(fail_notes[:_FAIL_NOTES_MAX])
+                             + ("<br>…" if len(fail_notes) > _FAIL_NOTES_MAX else ""))
+            return "<br><br>".join(parts)
+
+        # 每条抽完就把结果写进该行的“抽帧”列，按节流刷新当前页
+        every = _Every(REFRESH_SEC)
+        for k, i in enumerate(indices):
+            page_url = rows[i][0]
             vp = PAGE_TO_PATH.get(page_url)
             if not vp:
                 not_downloaded.append(i + 1)
                 continue
-            from extractor import extract_frames  # 延迟导入，避免循环
-            ok, zip_path, log = extract_frames(vp, step_val)
+            rows[i][3] = "⏳ 抽帧中…"
+            if every():
+                table, info = render(rows, view, out)
+                yield table, info, summary(k)
+            ok, zip_path, log = extract_frames(vp, step_val, fmt=fmt, max_width=int(max_w or 0),
+                                               max_height=int(max_h or 0), quality=int(quality or 0) or None)
             if not ok:
-                fail_notes.append(f"第{i+1}行：{log}")
+                rows[i][3] = "❌ 抽帧失败"
+                fail_notes.append(f"第{i+1}行：{escape(log)}")
             else:
-                href = f"/api/extract_by_page?page_url={quote(page_url, safe='')}&step={step_val}"
-                ok_links.append(f"第{i+1}行：<a href='{href}' target='_blank'>下载zip</a>")
-
-        parts = []
-        if ok_links:
-            parts.append("✅ 抽帧完成：<br>" + "<br>".join(ok_links))
-        if not_downloaded:
-            parts.append("⚠️ 以下未下载，已跳过：" + "、".join(map(str, not_downloaded)))
-        if fail_notes:
-            parts.append("❌ 失败详情：<br>" + "<br>".join(fail_notes))
+                ok_cnt += 1
+                href = f"/api/extract_by_page?page_url={quote(page_url, safe='')}&{qs}"
+                rows[i][3] = f"✅ <a href='{href}' target='_blank'>下载zip</a> · {escape(log)}"
 
-        return "<br><br>".join(parts) if parts else "没有可抽帧的条目（可能都未下载）。"
+        table, info = render(rows, view, out)
+        if not ok_cnt and not fail_notes:
+            yield table, info, "没有可抽帧的条目（可能都未下载）。"
+            return
+        yield table, info, summary(len(indices))
 
     btn_extract.click(
         do_extract,
-        inputs=[rows_state, select_multi, step_slider],
-        outputs=[extract_msg],
+        inputs=selection + out_inputs,
+        outputs=[results_html, page_info, extract_msg],
         show_progress="full"
-    )
\ No newline at end of file
+    )
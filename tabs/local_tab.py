@@ -3,6 +3,7 @@ from __future__ import annotations
 from pathlib import Path
 from typing import List
 import hashlib
+from html import escape
 import gradio as gr
 
 Row = List[str]  # [virtual_key, "", status]
@@ -12,6 +13,7 @@ def build_local_tab(CTX: dict):
     STEP_MAX = CTX["STEP_MAX"]
     PAGE_TO_PATH = CTX["PAGE_TO_PATH"]
     extract_frames = CTX["extract_frames"]
+    extract_query = CTX["extract_query"]
 
     def _virtual_key_for_local(path: str) -> str:
         h = hashlib.sha1(Path(path).resolve().as_posix().encode("utf-8")).hexdigest()[:10]
@@ -20,9 +22,10 @@ def build_local_tab(CTX: dict):
     def _short(u: str, n: int = 28) -> str:
         return (u[:n] + "…") if len(u) > n else u
 
-    def build_local_table(rows: List[Row], step_val: int) -> str:
+    def build_local_table(rows: List[Row], step_val: int, fmt: str, max_w, max_h, quality) -> str:
         from urllib.parse import quote
         step_val = max(STEP_MIN, min(STEP_MAX, int(step_val or 1)))
+        qs = extract_query(step_val, fmt, max_w, max_h, quality)  # 链接与所选输出参数一致
         html = [
             "<table style='border-collapse:collapse;width:100%;font-size:14px'>",
             "<thead><tr>",
@@ -36,7 +39,7 @@ def build_local_tab(CTX: dict):
             can_extract = vkey in PAGE_TO_PATH
             fname = Path(PAGE_TO_PATH.get(vkey, vkey)).name
             ex = (
-                f'<a href="/api/extract_by_page?page_url={quote(vkey, safe="")}&step={step_val}" target="_blank">抽帧</a>'
+                f'<a href="/api/extract_by_page?page_url={quote(vkey, safe="")}&{qs}" target="_blank">抽帧</a>'
                 if can_extract else "<span style='color:#999'>文件无效</span>"
             )
             html.append(
@@ -61,6 +64,11 @@ def build_local_tab(CTX: dict):
         file_types=[".mp4", ".mov", ".mkv", ".flv", ".webm"]
     )
     local_step_slider = gr.Slider(STEP_MIN, STEP_MAX, value=1, step=1, label="抽帧间隔（秒）")
+    with gr.Row():
+        local_fmt = gr.Dropdown(["jpg", "webp", "png"], value="jpg", label="输出格式")
+        local_max_w = gr.Number(value=0, precision=0, minimum=0, label="最大宽度（0=原尺寸）")
+        local_max_h = gr.Number(value=0, precision=0, minimum=0, label="最大高度（0=原尺寸）")
+        local_quality = gr.Slider(0, 100, value=0, step=1, label="质量（0=默认；PNG 无损，忽略）")
 
     with gr.Row():
         btn_local_refresh = gr.Button("↻ 刷新清单", variant="secondary")
@@ -76,9 +84,10 @@ def build_local_tab(CTX: dict):
             local_extract_msg  = gr.HTML()
 
     local_rows_state = gr.State([])  # List[Row]，形如 [virtual_key, "", status]
+    local_out = [local_step_slider, local_fmt, local_max_w, local_max_h, local_quality]  # 抽帧输出参数
 
     # ---------- 事件 ----------
-    def on_local_files_added(paths: list[str] | None, step_val: int):
+    def on_local_files_added(paths: list[str] | None, step_val: int, fmt: str, max_w, max_h, quality):
         rows: List[Row] = []
         if paths:
             for p in paths:
@@ -94,17 +103,17 @@ def build_local_tab(CTX: dict):
         if not rows:
             return "<p>尚未选择有效视频文件。</p>", [], gr.update(choices=[], value=[]), "⚠️ 无文件"
 
-        table = build_local_table(rows, step_val)
+        table = build_local_table(rows, step_val, fmt, max_w, max_h, quality)
         choices = _rebuild_local_choices(rows)
         return table, rows, gr.update(choices=choices, value=[]), f"已加入 {len(rows)} 个文件"
 
-    def on_local_refresh(rows: List[Row], step_val: int):
+    def on_local_refresh(rows: List[Row], step_val: int, fmt: str, max_w, max_h, quality):
         alive_rows: List[Row] = []
         for vkey, d, st in rows or []:
             if vkey in PAGE_TO_PATH and Path(PAGE_TO_PATH[vkey]).exists():
                 fname = Path(PAGE_TO_PATH[vkey]).name
                 alive_rows.append([vkey, d, f"✅ 已就绪 · {fname}"])
-        table = build_local_table(alive_rows, step_val)
+        table = build_local_table(alive_rows, step_val, fmt, max_w, max_h, quality)
         choices = _rebuild_local_choices(alive_rows)
         return table, alive_rows, gr.update(choices=choices, value=[]), f"清单刷新：{len(alive_rows)} 个有效文件"
 
@@ -112,7 +121,8 @@ def build_local_tab(CTX: dict):
         # 只清 UI 状态（不删除 PAGE_TO_PATH 中的映射，以便路由还能下载 zip）
         return "<p>清单已清空。</p>", [], gr.update(choices=[], value=[]), "已清空"
 
-    def do_local_extract(rows: List[Row], selected_list: List[str], step_val: int):
+    def do_local_extract(rows: List[Row], selected_list: List[str], step_val: int,
+                         fmt: str, max_w, max_h, quality):
         if not rows:
             return "请先上传文件或刷新清单"
         if not selected_list:
@@ -137,12 +147,14 @@ def build_local_tab(CTX: dict):
             if not vp or not Path(vp).exists():
                 missing.append(i + 1)
                 continue
-            ok, zip_path, log = extract_frames(vp, step_val)
+            ok, zip_path, log = extract_frames(vp, step_val, fmt=fmt, max_width=int(max_w or 0),
+                                               max_height=int(max_h or 0), quality=int(quality or 0) or None)
             if not ok:
-                fail_notes.append(f"第{i+1}行：{log}")
+                fail_notes.append(f"第{i+1}行：{escape(log)}")
             else:
-                href = f"/api/extract_by_page?page_url={quote(vkey, safe='')}&step={step_val}"
-                ok_links.append(f"第{i+1}行：<a href='{href}' target='_blank'>下载zip</a>")
+                qs = extract_query(step_val, fmt, max_w, max_h, quality)
+                href = f"/api/extract_by_page?page_url={quote(vkey, safe='')}&{qs}"
+                ok_links.append(f"第{i+1}行：<a href='{href}' target='_blank'>下载zip</a> · {escape(log)}")
 
         parts = []
         if ok_links:
@@ -156,16 +168,23 @@ def build_local_tab(CTX: dict):
     # 事件绑定
     local_uploader.change(
         on_local_files_added,
-        inputs=[local_uploader, local_step_slider],
+        inputs=[local_uploader] + local_out,
         outputs=[local_results_html, local_rows_state, local_select_multi, local_status_note],
     )
 
     btn_local_refresh.click(
         on_local_refresh,
-        inputs=[local_rows_state, local_step_slider],
+        inputs=[local_rows_state] + local_out,
         outputs=[local_results_html, local_rows_state, local_select_multi, local_status_note],
     )
 
+    def on_local_out_change(rows: List[Row], step_val: int, fmt: str, max_w, max_h, quality):
+        # 改了间隔或输出参数：重绘清单，让“抽帧”链接跟着变（不清空勾选）
+        return build_local_table(rows, step_val, fmt, max_w, max_h, quality) if rows else gr.update()
+
+    for comp in local_out:
+        comp.change(on_local_out_change, inputs=[local_rows_state] + local_out, outputs=[local_results_html])
+
     btn_local_clear.click(
         on_local_clear,
         inputs=[],
@@ -174,7 +193,7 @@ def build_local_tab(CTX: dict):
 
     btn_local_extract.click(
         do_local_extract,
-        inputs=[local_rows_state, local_select_multi, local_step_slider],
+        inputs=[local_rows_state, local_select_multi] + local_out,
         outputs=[local_extract_msg],
         show_progress="full"
     )
\ No newline at end of file
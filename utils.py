@@ -1,10 +1,13 @@
 # utils.py
 from __future__ import annotations
+import os
 import re
+import threading
+import time
 from pathlib import Path
-from typing import Optional, Tuple, Literal
+from typing import Dict, Optional, Tuple, Literal
 
-from config import BASE
+from config import BASE, INDEX_RECHECK_SEC
 
 Platform = Literal["douyin"]
 
@@ -12,9 +15,13 @@ PLATFORM_DIRS = {
     "douyin": BASE / "videos" / "douyin",
 }
 
+_ENSURED = set()
+
 def ensure_platform_dir(pf: Platform) -> Path:
     d = PLATFORM_DIRS[pf]
-    d.mkdir(parents=True, exist_ok=True)
+    if d not in _ENSURED:  # 每个进程只 mkdir 一次
+        d.mkdir(parents=True, exist_ok=True)
+        _ENSURED.add(d)
     return d
 
 def detect_platform(url: str) -> Optional[Platform]:
@@ -23,23 +30,29 @@ def detect_platform(url: str) -> Optional[Platform]:
         return "douyin"
     return None
 
-def extract_code_douyin(url: str) -> Optional[str]:
+def extract_code_douyin(url: str, resolve: bool = False) -> Optional[str]:
     """
     规则：
     - 长链: https://www.douyin.com/video/7536306586487196969?...  => 7536306586487196969
-    - 短链: https://v.douyin.com/nZasikV8ea4/                   => nZasikV8ea4
+    - 短链: https://v.douyin.com/nZasikV8ea4/                   => 已解析过的换成数字 ID（查索引库，不联网）；
+      resolve=True 时没解析过的联网跟随跳转（见 short_links.py），仍拿不到 ID 时退回短码 nZasikV8ea4
     """
     m = re.search(r"/video/([0-9]+)", url)
     if m:
         return m.group(1)
     m2 = re.search(r"https?://v\.douyin\.com/([^/?#]+)/?", url)
     if m2:
-        return m2.group(1)
+        # 需要索引库（resolve 时还要联网），用到时再导入（避免循环依赖）
+        if resolve:
+            from short_links import resolve_short
+            return resolve_short("douyin", m2.group(1), m2.group(0)) or m2.group(1)
+        from state_store import STORE
+        return STORE.get_canonical("douyin", m2.group(1)) or m2.group(1)
     return None
 
-def extract_code(platform: Platform, url: str) -> Optional[str]:
+def extract_code(platform: Platform, url: str, resolve: bool = False) -> Optional[str]:
     if platform == "douyin":
-        return extract_code_douyin(url)
+        return extract_code_douyin(url, resolve)
     return None
 
 def target_path_for(platform: Platform, code: str, ext: Optional[str] = None) -> Path:
@@ -50,21 +63,126 @@ def target_path_for(platform: Platform, code: str, ext: Optional[str] = None) ->
     else:
         return out_dir / f"{code}"
 
+# 下载中的临时文件、sidecar 等不算“已存在”
+_TEMP_SUFFIXES = (".part", ".ytdl", ".json", ".tmp")
+
+class _DirIndex:
+    """
+    平台目录的 code -> 最新文件 内存索引：首次使用时 scandir 一遍，之后查找是 O(1) 的 dict 访问。
+    外部改动靠目录 mtime 发现（最多每 INDEX_RECHECK_SEC 秒 stat 一次目录），变了就整体重建；
+    本进程的下载通过 add()/refresh_code() 直接更新，不触发重建。
+    """
+
+    def __init__(self, d: Path):
+        self.dir = d
+        self._lock = threading.Lock()
+        self._by_code: Dict[str, Tuple[int, Path]] = {}
+        self._dir_mtime: Optional[int] = None
+        self._checked = 0.0
+
+    @staticmethod
+    def _code_of(name: str) -> Optional[str]:
+        # 与原来的 glob(f"{code}.*") 对齐：第一个点之前是编码
+        if name.startswith(".") or "." not in name or name.endswith(_TEMP_SUFFIXES):
+            return None
+        return name.split(".", 1)[0]
+
+    def _dir_mtime_now(self) -> Optional[int]:
+        try:
+            return self.dir.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _rebuild(self):
+        mt = self._dir_mtime_now()  # 先取 mtime 再扫：扫描期间的新改动会在下次检查时被发现
+        by_code: Dict[str, Tuple[int, Path]] = {}
+        try:
+            with os.scandir(self.dir) as it:
+                for e in it:
+                    code = self._code_of(e.name)
+                    if not code:
+                        continue
+                    try:
+                        if not e.is_file():
+                            continue
+                        m = e.stat().st_mtime_ns
+                    except OSError:
+                        continue
+                    cur = by_code.get(code)
+                    if cur is None or m > cur[0]:
+                        by_code[code] = (m, Path(e.path))
+        except FileNotFoundError:
+            pass
+        self._by_code = by_code
+        self._dir_mtime = mt
+        self._checked = time.monotonic()
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self._dir_mtime is not None and now - self._checked < INDEX_RECHECK_SEC:
+            return
+        if self._dir_mtime is None or self._dir_mtime_now() != self._dir_mtime:
+            self._rebuild()
+        self._checked = now
+
+    def get(self, code: str) -> Optional[Path]:
+        with self._lock:
+            self._maybe_refresh()
+            ent = self._by_code.get(code)
+            return ent[1] if ent else None
+
+    def refresh_code(self, code: str) -> Optional[Path]:
+        """只重扫某个编码的文件（下载完成后调用），并把目录 mtime 记为当前值。"""
+        with self._lock:
+            if self._dir_mtime is None:
+                self._rebuild()
+            best = None
+            for p in self.dir.glob(f"{code}.*"):
+                if self._code_of(p.name) != code:
+                    continue
+                try:
+                    m = p.stat().st_mtime_ns
+                except OSError:
+                    continue
+                if best is None or m > best[0]:
+                    best = (m, p)
+            if best:
+                self._by_code[code] = best
+            else:
+                self._by_code.pop(code, None)
+            self._dir_mtime = self._dir_mtime_now()
+            self._checked = time.monotonic()
+            return best[1] if best else None
+
+_INDEXES: Dict[str, _DirIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+def _dir_index(platform: Platform) -> _DirIndex:
+    with _INDEXES_LOCK:
+        idx = _INDEXES.get(platform)
+        if idx is None:
+            idx = _INDEXES[platform] = _DirIndex(ensure_platform_dir(platform))
+        return idx
+
 def find_existing_by_code(platform: Platform, code: str) -> Optional[Path]:
-    out_dir = ensure_platform_dir(platform)
     # 匹配任意后缀（mp4、mkv、webm等），优先最新
-    cands = sorted(out_dir.glob(f"{code}.*"), key=lambda p: p.stat().st_mtime, reverse=True)
-    return cands[0] if cands else None
+    return _dir_index(platform).get(code)
+
+def refresh_code(platform: Platform, code: str) -> Optional[Path]:
+    """下载/删除某编码文件后调用，增量更新内存索引并返回最新文件。"""
+    return _dir_index(platform).refresh_code(code)
 
-def pick_platform_and_code(page_url: Optional[str], direct_url: Optional[str]) -> Tuple[Optional[Platform], Optional[str], str]:
+def pick_platform_and_code(page_url: Optional[str], direct_url: Optional[str],
+                           resolve: bool = False) -> Tuple[Optional[Platform], Optional[str], str]:
     """
     优先从 page_url 识别平台和编码；不行再尝试 direct_url。
+    resolve=True 时未解析过的短链会联网换成数字 ID，只在真正要下载（需要确定文件名）时用。
     """
     src = page_url or direct_url or ""
     pf = detect_platform(src)
     if not pf:
         return None, None, "无法识别平台"
-    code = extract_code(pf, page_url or "") or extract_code(pf, direct_url or "")
+    code = extract_code(pf, page_url or "", resolve) or extract_code(pf, direct_url or "", resolve)
     if not code:
         return pf, None, "未能从链接中提取视频编码"
     return pf, code, "ok"
\ No newline at end of file
@@ -0,0 +1,81 @@
+# zipstream.py
+"""
+边产出边发送的 ZIP 写入器：
+- 输出端不可 seek，zipfile 自动改用 data descriptor，条目可以在大小未知时先写；
+- 图片本身已压缩，一律 ZIP_STORED，不再浪费 CPU 做 DEFLATE；
+- allowZip64：单文件 / 偏移 > 4 GiB 或条目超过 65535 个时自动写 ZIP64 结构。
+"""
+from __future__ import annotations
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+CHUNK = 256 * 1024
+
+class _Sink:
+    """只实现 write/tell/flush（故意不实现 seek），zipfile 会按流式模式写。"""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def write(self, b) -> int:
+        self._buf += b
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+class ZipWriter:
+    """
+    增量版本：add() 一次写一个条目并逐块产出字节，close() 返回中央目录；
+    给 async 调用方用（条目在事件循环里一个个等来，不能交给同步生成器去拉）。
+    """
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zf = zipfile.ZipFile(self._sink, "w", zipfile.ZIP_STORED, allowZip64=True)
+
+    def add(self, name: str, path: Path) -> Iterator[bytes]:
+        sink = self._sink
+        zinfo = zipfile.ZipInfo.from_file(path, name)
+        zinfo.compress_type = zipfile.ZIP_STORED
+        with open(path, "rb") as src, self._zf.open(zinfo, "w") as dst:
+            while True:
+                chunk = src.read(CHUNK)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                if len(sink._buf) >= CHUNK:
+                    yield sink.drain()
+        data = sink.drain()
+        if data:
+            yield data
+
+    def close(self) -> bytes:
+        self._zf.close()
+        return self._sink.drain()  # 中央目录（及 ZIP64 尾部）
+
+def iter_zip(entries: Iterable[Tuple[str, Path]]) -> Iterator[bytes]:
+    """entries 产出 (zip 内文件名, 磁盘路径)；可以是边生成边产出的生成器。"""
+    zw = ZipWriter()
+    for name, path in entries:
+        yield from zw.add(name, path)
+    tail = zw.close()
+    if tail:
+        yield tail
+
+def write_zip(entries: Iterable[Tuple[str, Path]], zip_path: Path):
+    """同样的 STORED 格式写到磁盘文件。"""
+    with open(zip_path, "wb") as f:
+        for chunk in iter_zip(entries):
+            f.write(chunk)